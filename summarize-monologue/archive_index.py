@@ -0,0 +1,566 @@
+"""
+アーカイブ（archive_service.py）したメモのローカル検索インデックス。
+SQLiteのFTS5（trigramトークナイザー。分かち書きなしで日本語の部分一致検索ができる）による全文検索と、
+埋め込みベクトルを連続したfloat32のファイルとして保存しメモリマップで読み込むベクトル検索を組み合わせます。
+
+使い方:
+    ARCHIVE_BUCKET_NAME=[アーカイブのバケット] python archive_index.py sync     # 前回から追加・更新されたアーカイブだけを取り込む
+    python archive_index.py query "引っ越しの段取り"                            # 全文検索とベクトル検索の結果を統合して表示
+    python archive_index.py query "引っ越し" --no-vectors --limit 5             # 全文検索のみ（Geminiを呼び出さない）
+
+インデックスの構成（ARCHIVE_INDEX_DIR）:
+    index.sqlite3   メモ・パッセージ（要約と、文字起こしを ARCHIVE_PASSAGE_CHARS 文字程度に区切ったもの）・全文検索の索引・取り込み済みのファイル
+    vectors.f32     パッセージの埋め込み（パッセージID - 1 行目に ARCHIVE_EMBEDDING_DIMENSIONS 次元の単位ベクトル）。
+                    パッセージIDを詰め直した後は、meta に記録した vectors-<時刻>.f32 に置き換わります
+
+取り込み済みのファイルは内容のハッシュで管理し、sync では変更のあったファイルのメモだけを、ファイルごとに1つのトランザクションで入れ替えます。
+再処理されたメモはパッセージの行を再利用し、内容の変わったパッセージだけを埋め込み直します。
+削除したパッセージの行が ARCHIVE_COMPACT_DEAD_RATIO を超えた場合は、パッセージIDを詰めてベクトルのファイルを作り直します。
+埋め込みに失敗したパッセージは、次回の sync で埋め込みます。
+"""
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import time
+import array
+import sqlite3
+import argparse
+import operator
+from datetime import datetime
+from archive_service import read_archive, ARCHIVE_BUCKET_NAME, ARCHIVE_PREFIX
+from tracing import span
+
+ARCHIVE_INDEX_DIR = os.environ.get('ARCHIVE_INDEX_DIR', os.path.expanduser('~/.monologue-archive-index'))
+# 埋め込みのモデルと次元数（モデルを指定しない場合は全文検索のみ）
+ARCHIVE_EMBEDDING_MODEL = os.environ.get('ARCHIVE_EMBEDDING_MODEL', 'gemini-embedding-001')
+ARCHIVE_EMBEDDING_DIMENSIONS = int(os.environ.get('ARCHIVE_EMBEDDING_DIMENSIONS', 768))
+# 文字起こしを区切るパッセージの文字数の目安（文の区切りで分割する）
+ARCHIVE_PASSAGE_CHARS = int(os.environ.get('ARCHIVE_PASSAGE_CHARS', 400))
+# 削除したパッセージの行（ベクトルのファイルの使われない行）がこの割合を超えたら、パッセージIDを詰めて作り直す
+ARCHIVE_COMPACT_DEAD_RATIO = float(os.environ.get('ARCHIVE_COMPACT_DEAD_RATIO', 0.25))
+# ベクトルのファイル名（詰め直す前のインデックスや、まだ詰め直していないインデックスの場合）
+DEFAULT_VECTORS_FILE = 'vectors.f32'
+# 1回の埋め込みのリクエストに含めるパッセージ数
+EMBEDDING_BATCH_SIZE = 100
+# 全文検索とベクトル検索の順位を統合する（Reciprocal Rank Fusion）際の定数と、それぞれから取得する候補数
+RRF_K = 60
+CANDIDATES = 50
+# trigramトークナイザーで索引を使って検索できる最短の文字数
+TRIGRAM_MIN_CHARS = 3
+SENTENCE_END_PATTERN = re.compile(r'(?<=[。！？!?\n])')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS sources (object_name TEXT PRIMARY KEY, version TEXT, indexed_at TEXT);
+CREATE TABLE IF NOT EXISTS memos (
+    id INTEGER PRIMARY KEY,
+    event_id TEXT UNIQUE,
+    title TEXT,
+    file_name TEXT,
+    recorded_at TEXT,
+    tags TEXT,
+    markdown TEXT,
+    next_actions TEXT,
+    object_name TEXT
+);
+-- IDを再利用しない（ベクトルのファイルの行と対応させるため。詰め直す場合は ArchiveIndex.compact でファイルとあわせて振り直す）
+CREATE TABLE IF NOT EXISTS passages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    memo_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    embedded INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS passages_memo ON passages (memo_id);
+CREATE INDEX IF NOT EXISTS passages_pending ON passages (embedded);
+CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5(text, content='passages', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS passages_ai AFTER INSERT ON passages BEGIN
+    INSERT INTO passages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS passages_ad AFTER DELETE ON passages BEGIN
+    INSERT INTO passages_fts (passages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS passages_au AFTER UPDATE OF text ON passages BEGIN
+    INSERT INTO passages_fts (passages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO passages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+def split_passages(text, passage_chars=None):
+    """
+    文字起こしを文の区切りで、passage_chars 文字程度のパッセージに分割します。
+
+    Args:
+        text (str): 文字起こし
+        passage_chars (int): パッセージの文字数の目安。省略時は ARCHIVE_PASSAGE_CHARS
+
+    Returns:
+        list: パッセージのリスト
+    """
+    passage_chars = passage_chars or ARCHIVE_PASSAGE_CHARS
+    passages = []
+    current = ""
+    for sentence in SENTENCE_END_PATTERN.split(text):
+        current += sentence
+        if len(current) >= passage_chars:
+            passages.append(current.strip())
+            current = ""
+    if current.strip():
+        passages.append(current.strip())
+    return [passage for passage in passages if passage]
+
+def _normalize(vector):
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+class VectorStore:
+    """
+    パッセージの埋め込みを、パッセージIDの順に並べたfloat32のファイルとして保存する。
+    検索時はファイルをメモリマップし、numpyがあれば行列として一括で、なければ1行ずつ内積を計算する。
+    """
+
+    def __init__(self, path, dimensions):
+        self.path = path
+        self.dimensions = dimensions
+        self.row_bytes = dimensions * 4
+
+    def write(self, rows):
+        """
+        ベクトルを書き込みます。
+
+        Args:
+            rows (list): (パッセージID, ベクトル) のリスト
+        """
+        mode = 'r+b' if os.path.exists(self.path) else 'w+b'
+        with open(self.path, mode) as f:
+            for passage_id, vector in rows:
+                f.seek((passage_id - 1) * self.row_bytes)
+                f.write(array.array('f', vector).tobytes())
+
+    def clear(self, passage_ids):
+        """
+        削除した・内容が変わったパッセージのベクトルを0にします（行は詰めない）。
+        """
+        if os.path.exists(self.path):
+            self.write([(passage_id, [0.0] * self.dimensions) for passage_id in passage_ids])
+
+    def rewrite(self, path, rows):
+        """
+        ベクトルを指定した順に並べ直した新しいファイルを書き込みます（パッセージIDを詰め直す場合）。
+
+        Args:
+            path (str): 新しいファイルのパス
+            rows (list): 新しいファイルの行の順に並べた (元のパッセージID, 埋め込み済みか) のリスト
+        """
+        source = open(self.path, 'rb') if os.path.exists(self.path) else None
+        try:
+            with open(path, 'wb') as f:
+                for passage_id, embedded in rows:
+                    vector = b''
+                    if source and embedded:
+                        source.seek((passage_id - 1) * self.row_bytes)
+                        vector = source.read(self.row_bytes)
+                    # 埋め込みがまだない行は0にする
+                    f.write(vector.ljust(self.row_bytes, b'\0'))
+        finally:
+            if source:
+                source.close()
+
+    def truncate(self):
+        """
+        すべてのベクトルを削除します（モデルや次元数を変更した場合や、詰め直す前の古いファイル）。
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def search(self, query_vector, top_k):
+        """
+        コサイン類似度（単位ベクトルの内積）が高い順にパッセージIDを返します。
+
+        Args:
+            query_vector (list): 正規化したクエリのベクトル
+            top_k (int): 返す件数
+
+        Returns:
+            list: (パッセージID, 類似度) のリスト
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.row_bytes:
+            return []
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+
+        if np is not None:
+            matrix = np.memmap(self.path, dtype=np.float32, mode='r')
+            matrix = matrix[:len(matrix) // self.dimensions * self.dimensions].reshape(-1, self.dimensions)
+            scores = matrix @ np.asarray(query_vector, dtype=np.float32)
+            top = np.argsort(-scores)[:top_k]
+            return [(int(index) + 1, float(scores[index])) for index in top if scores[index] > 0]
+
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            floats = view.cast('f')
+            try:
+                rows = len(floats) // self.dimensions
+                scores = [
+                    (sum(map(operator.mul, query_vector, floats[row * self.dimensions:(row + 1) * self.dimensions])), row + 1)
+                    for row in range(rows)
+                ]
+            finally:
+                floats.release()
+                view.release()
+        return [(passage_id, score) for score, passage_id in sorted(scores, reverse=True)[:top_k] if score > 0]
+
+class ArchiveIndex:
+    """
+    アーカイブしたメモの全文検索とベクトル検索のインデックス。
+    """
+
+    def __init__(self, index_dir=ARCHIVE_INDEX_DIR, embedding_model=ARCHIVE_EMBEDDING_MODEL, dimensions=ARCHIVE_EMBEDDING_DIMENSIONS):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.embedding_model = embedding_model
+        self.db = sqlite3.connect(os.path.join(index_dir, 'index.sqlite3'))
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'vectors'").fetchone()
+        self.vectors = VectorStore(os.path.join(index_dir, row[0] if row else DEFAULT_VECTORS_FILE), dimensions)
+        # 取り込み中のトランザクションで削除した・内容が変わったパッセージ（コミットした後でベクトルを0にする）
+        self._stale_passages = []
+        self._check_embedding_settings()
+
+    def close(self):
+        self.db.close()
+
+    def _check_embedding_settings(self):
+        """
+        埋め込みのモデルや次元数が前回と異なる場合は、ベクトルを削除してすべてのパッセージを埋め込み直す対象にします。
+        """
+        settings = f"{self.embedding_model}:{self.vectors.dimensions}"
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'embedding'").fetchone()
+        if row and row[0] != settings:
+            print(f"埋め込みの設定が変更されたため、ベクトルを作成し直します: {row[0]} -> {settings}")
+            self.vectors.truncate()
+            self.db.execute("UPDATE passages SET embedded = 0")
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('embedding', ?)", (settings,))
+        self.db.commit()
+
+    def indexed_versions(self):
+        """
+        取り込み済みのファイルと、その内容のハッシュを返します。
+        """
+        return dict(self.db.execute("SELECT object_name, version FROM sources"))
+
+    def upsert(self, record, object_name):
+        """
+        1件のメモを取り込みます。同じイベントIDのメモがある場合は入れ替えます（再処理されたメモ）。
+        入れ替える場合はパッセージの行（IDとベクトルのファイルの行）を順に再利用し、内容が変わったパッセージだけを埋め込み直す対象にします。
+        コミットは呼び出し側で行います（index_file）。
+
+        Args:
+            record (dict): アーカイブのレコード
+            object_name (str): アーカイブのファイル名
+
+        Returns:
+            int: 取り込んだパッセージ数
+        """
+        fields = (
+            record.get('title'), record.get('file_name'), record.get('recorded_at') or record.get('archived_at'),
+            json.dumps(record.get('tags', []), ensure_ascii=False), record.get('markdown', ''),
+            json.dumps(record.get('nextActions', []), ensure_ascii=False), object_name,
+        )
+        existing = self.db.execute("SELECT id FROM memos WHERE event_id = ?", (record['event_id'],)).fetchone()
+        if existing:
+            memo_id = existing[0]
+            self.db.execute(
+                "UPDATE memos SET title = ?, file_name = ?, recorded_at = ?, tags = ?, markdown = ?, next_actions = ?, object_name = ? WHERE id = ?",
+                fields + (memo_id,),
+            )
+            old_passages = self.db.execute("SELECT id, text, embedded FROM passages WHERE memo_id = ? ORDER BY seq", (memo_id,)).fetchall()
+        else:
+            cursor = self.db.execute(
+                "INSERT INTO memos (event_id, title, file_name, recorded_at, tags, markdown, next_actions, object_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (record['event_id'],) + fields,
+            )
+            memo_id = cursor.lastrowid
+            old_passages = []
+
+        # 要約はタイトルとタグを含めて1つのパッセージにし、文字起こしは区切って検索の単位にする
+        summary = "\n".join(filter(None, [record.get('title'), " ".join(record.get('tags', [])), record.get('markdown', '')]))
+        passages = [('summary', summary)] + [('transcript', text) for text in split_passages(record.get('transcription', ''))]
+        reused = []
+        for seq, ((kind, text), (passage_id, old_text, embedded)) in enumerate(zip(passages, old_passages)):
+            if text != old_text:
+                embedded = 0
+                self._stale_passages.append(passage_id)
+            reused.append((seq, kind, text, embedded, passage_id))
+        self.db.executemany("UPDATE passages SET seq = ?, kind = ?, text = ?, embedded = ? WHERE id = ?", reused)
+        # パッセージ数が減った場合は残りの行を削除し（compact で詰める）、増えた場合は新しい行を追加する
+        removed = [passage_id for passage_id, _, _ in old_passages[len(passages):]]
+        self.db.executemany("DELETE FROM passages WHERE id = ?", [(passage_id,) for passage_id in removed])
+        self._stale_passages.extend(removed)
+        self.db.executemany(
+            "INSERT INTO passages (memo_id, seq, kind, text) VALUES (?, ?, ?, ?)",
+            [(memo_id, seq, kind, text) for seq, (kind, text) in enumerate(passages) if seq >= len(old_passages)],
+        )
+        return len(passages)
+
+    def mark_indexed(self, object_name, version):
+        """
+        ファイルを取り込み済みとして記録します。コミットは呼び出し側で行います（index_file）。
+        """
+        self.db.execute(
+            "INSERT OR REPLACE INTO sources (object_name, version, indexed_at) VALUES (?, ?, ?)",
+            (object_name, version, datetime.utcnow().isoformat()),
+        )
+
+    def index_file(self, object_name, version, records):
+        """
+        1つのアーカイブのファイルのメモを、取り込み済みの記録とあわせて1つのトランザクションで取り込みます。
+        途中のレコードで失敗した場合はファイル全体をロールバックし、次回の sync で取り込み直します。
+
+        Args:
+            object_name (str): アーカイブのファイル名
+            version (str): ファイルの内容のハッシュ
+            records (list): ファイルのレコード
+
+        Returns:
+            int: 取り込んだパッセージ数
+        """
+        self._stale_passages = []
+        try:
+            with self.db:
+                passages = sum(self.upsert(record, object_name) for record in records)
+                self.mark_indexed(object_name, version)
+        except Exception:
+            self._stale_passages = []
+            raise
+        # ベクトルはコミットした後で0にする（ロールバックした場合に、残ったパッセージのベクトルを失わないように）
+        self.vectors.clear(self._stale_passages)
+        self._stale_passages = []
+        return passages
+
+    def compact(self, dead_ratio=ARCHIVE_COMPACT_DEAD_RATIO):
+        """
+        削除したパッセージの行が dead_ratio を超えた場合に、パッセージIDを1から詰めて振り直し、ベクトルのファイルを作り直します。
+        新しいベクトルのファイルは別の名前で書き込み、IDの振り直しと同じトランザクションで meta のファイル名を切り替えるため、
+        途中で中断しても元のインデックスのまま残ります。
+
+        Args:
+            dead_ratio (float): 詰め直す、削除したパッセージの行の割合
+
+        Returns:
+            int: 詰めた行数（詰め直さなかった場合は0）
+        """
+        row = self.db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'passages'").fetchone()
+        allocated = row[0] if row else 0
+        dead = allocated - self.db.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+        if dead <= 0 or dead <= allocated * dead_ratio:
+            return 0
+
+        with span("archive_index.compact") as s:
+            rows = self.db.execute("SELECT id, memo_id, seq, kind, text, embedded FROM passages ORDER BY id").fetchall()
+            file_name = f"vectors-{int(time.time() * 1000)}.f32"
+            vectors = VectorStore(os.path.join(self.index_dir, file_name), self.vectors.dimensions)
+            try:
+                self.vectors.rewrite(vectors.path, [(passage_id, embedded) for passage_id, _, _, _, _, embedded in rows])
+                with self.db:
+                    self.db.execute("DELETE FROM passages")
+                    self.db.executemany(
+                        "INSERT INTO passages (id, memo_id, seq, kind, text, embedded) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(new_id,) + row[1:] for new_id, row in enumerate(rows, 1)],
+                    )
+                    self.db.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'passages'", (len(rows),))
+                    self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('vectors', ?)", (file_name,))
+            except Exception:
+                vectors.truncate()
+                raise
+            self.vectors.truncate()
+            self.vectors = vectors
+            s.set(passages=len(rows), dead=dead)
+        print(f"削除したパッセージの行を詰めました: {dead}行（{allocated}行 -> {len(rows)}行）")
+        return dead
+
+    def _embed(self, texts, task_type):
+        from gemini_service import get_genai_client, model_router
+
+        response = model_router.retry('models.embed_content', lambda: get_genai_client().models.embed_content(
+            model=self.embedding_model, contents=texts,
+            config={'task_type': task_type, 'output_dimensionality': self.vectors.dimensions},
+        ))
+        return [_normalize(embedding.values) for embedding in response.embeddings]
+
+    def embed_pending(self):
+        """
+        埋め込みがまだないパッセージを埋め込みます。
+
+        Returns:
+            int: 埋め込んだパッセージ数
+        """
+        if not self.embedding_model:
+            return 0
+        embedded = 0
+        while True:
+            rows = self.db.execute("SELECT id, text FROM passages WHERE embedded = 0 ORDER BY id LIMIT ?", (EMBEDDING_BATCH_SIZE,)).fetchall()
+            if not rows:
+                return embedded
+            vectors = self._embed([text for _, text in rows], 'RETRIEVAL_DOCUMENT')
+            self.vectors.write([(passage_id, vector) for (passage_id, _), vector in zip(rows, vectors)])
+            self.db.executemany("UPDATE passages SET embedded = 1 WHERE id = ?", [(passage_id,) for passage_id, _ in rows])
+            self.db.commit()
+            embedded += len(rows)
+
+    def _full_text_candidates(self, query):
+        """
+        全文検索でパッセージを探します。3文字以上の語はFTS5の索引で、それより短い語はLIKEで絞り込みます。
+
+        Returns:
+            list: 関連度の高い順のパッセージID
+        """
+        terms = query.split()
+        long_terms = [term for term in terms if len(term) >= TRIGRAM_MIN_CHARS]
+        short_terms = [term for term in terms if len(term) < TRIGRAM_MIN_CHARS]
+        conditions = " AND ".join(["passages.text LIKE ?"] * len(short_terms)) or "1"
+        likes = [f"%{term}%" for term in short_terms]
+        if long_terms:
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in long_terms)
+            rows = self.db.execute(
+                "SELECT passages.id FROM passages_fts JOIN passages ON passages.id = passages_fts.rowid "
+                f"WHERE passages_fts MATCH ? AND {conditions} ORDER BY bm25(passages_fts) LIMIT ?",
+                [match] + likes + [CANDIDATES],
+            )
+        elif short_terms:
+            rows = self.db.execute(f"SELECT id FROM passages WHERE {conditions} ORDER BY id DESC LIMIT ?", likes + [CANDIDATES])
+        else:
+            return []
+        return [row[0] for row in rows]
+
+    def search(self, query, limit=10, use_vectors=True):
+        """
+        全文検索とベクトル検索の結果を順位で統合し、関連するメモを返します。
+
+        Args:
+            query (str): 検索する語句・質問
+            limit (int): 返すメモの件数
+            use_vectors (bool): ベクトル検索を使うか（Falseの場合はGeminiを呼び出さない）
+
+        Returns:
+            list: メモの辞書（タイトル・録音日時・タグ・最も関連するパッセージ・スコア）のリスト
+        """
+        ranked_lists = [self._full_text_candidates(query)]
+        if use_vectors and self.embedding_model:
+            query_vector = self._embed([query], 'RETRIEVAL_QUERY')[0]
+            ranked_lists.append([passage_id for passage_id, _ in self.vectors.search(query_vector, CANDIDATES)])
+
+        scores = {}
+        for ranked in ranked_lists:
+            for rank, passage_id in enumerate(ranked):
+                scores[passage_id] = scores.get(passage_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        if not scores:
+            return []
+
+        placeholders = ",".join("?" * len(scores))
+        rows = self.db.execute(
+            "SELECT passages.id, passages.kind, passages.text, memos.event_id, memos.title, memos.recorded_at, memos.tags "
+            f"FROM passages JOIN memos ON memos.id = passages.memo_id WHERE passages.id IN ({placeholders})",
+            list(scores),
+        )
+        # メモごとに最も関連するパッセージを残す
+        best = {}
+        for passage_id, kind, text, event_id, title, recorded_at, tags in rows:
+            score = scores[passage_id]
+            if event_id not in best or score > best[event_id]['score']:
+                best[event_id] = {
+                    'event_id': event_id, 'title': title, 'recorded_at': recorded_at, 'tags': json.loads(tags),
+                    'kind': kind, 'snippet': _snippet(text, query), 'score': round(score, 5),
+                }
+        return sorted(best.values(), key=lambda memo: memo['score'], reverse=True)[:limit]
+
+def _snippet(text, query, width=60):
+    """
+    パッセージのうち、検索語が最初に現れる位置の前後を切り出します（見つからない場合は先頭）。
+    """
+    positions = [text.find(term) for term in query.split() if term in text]
+    start = max(min(positions) - width, 0) if positions else 0
+    snippet = text[start:start + width * 2].replace("\n", " ")
+    return ("…" if start else "") + snippet + ("…" if start + width * 2 < len(text) else "")
+
+def sync_index(index, bucket_name=ARCHIVE_BUCKET_NAME, prefix=ARCHIVE_PREFIX):
+    """
+    GCSのアーカイブのうち、前回から追加・更新されたファイルだけを取り込み、埋め込みがないパッセージを埋め込みます。
+
+    Args:
+        index (ArchiveIndex): 更新するインデックス
+        bucket_name (str): アーカイブのバケット
+        prefix (str): アーカイブのファイル名のプレフィックス
+
+    Returns:
+        dict: 取り込んだファイル数・メモ数・パッセージ数・詰めた行数・埋め込んだパッセージ数
+    """
+    from cloud_storage_service import list_gcs_files, download_bytes_from_gcs
+
+    if not bucket_name:
+        raise ValueError("ARCHIVE_BUCKET_NAME が設定されていません")
+    counts = {'objects': 0, 'memos': 0, 'passages': 0, 'compacted': 0, 'embedded': 0}
+    with span("archive_index.sync") as s:
+        known = index.indexed_versions()
+        changed = [file for file in list_gcs_files(bucket_name, prefix) if known.get(file['name']) != file['md5Hash']]
+        for file in changed:
+            data = download_bytes_from_gcs(bucket_name, file['name'])
+            if data is None:
+                continue
+            records = read_archive(data)
+            counts['passages'] += index.index_file(file['name'], file['md5Hash'], records)
+            counts['memos'] += len(records)
+            counts['objects'] += 1
+        # 埋め込む前に詰め直し、新しいパッセージは詰めた後のIDで埋め込む
+        counts['compacted'] = index.compact()
+        try:
+            counts['embedded'] = index.embed_pending()
+        except Exception as e:
+            # 全文検索の索引は更新済みのため、埋め込みは次回の sync で再試行する
+            s.set(error=str(e))
+            print(f"パッセージの埋め込み中にエラーが発生しました（次回の sync で再試行します）: {e}")
+        s.set(**counts)
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='アーカイブしたメモの検索インデックスを更新・検索します')
+    parser.add_argument('--index-dir', default=ARCHIVE_INDEX_DIR, help='インデックスの保存先')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('sync', help='追加・更新されたアーカイブを取り込む')
+    query_parser = subparsers.add_parser('query', help='メモを検索する')
+    query_parser.add_argument('query', help='検索する語句・質問')
+    query_parser.add_argument('--limit', type=int, default=10, help='表示するメモの件数')
+    query_parser.add_argument('--no-vectors', action='store_true', help='全文検索のみを使う（Geminiを呼び出さない）')
+    query_parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+    args = parser.parse_args(argv)
+
+    index = ArchiveIndex(args.index_dir)
+    try:
+        if args.command == 'sync':
+            counts = sync_index(index)
+            print(f"インデックスを更新しました: ファイル {counts['objects']}件, メモ {counts['memos']}件, "
+                  f"パッセージ {counts['passages']}件, 埋め込み {counts['embedded']}件")
+            return counts
+
+        started_at = time.perf_counter()
+        results = index.search(args.query, limit=args.limit, use_vectors=not args.no_vectors)
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        else:
+            for result in results:
+                print(f"{result['recorded_at'] or '-'}  {result['title']}  [{', '.join(result['tags'])}]  ({result['kind']}, {result['score']})")
+                print(f"    {result['snippet']}")
+            print(f"{len(results)}件（{elapsed_ms:.1f} ms）", file=sys.stderr)
+        return results
+    finally:
+        index.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+処理したメモの文字起こし・要約・タグ・処理時間をGCSに保存するアーカイブ。
+Notionには要約しか残らないため、文字起こしを含めて後から検索できるよう、1件のメモを1行のJSON（gzip圧縮したJSONL）として保存します。
+保存したファイルは archive_index.py が差分だけを取り込んで、ローカルの検索インデックスを更新します。
+
+保存先:
+    gs://{ARCHIVE_BUCKET_NAME}/{ARCHIVE_PREFIX}{YYYY}/{MM}/{DD}/{イベントID}.jsonl.gz
+
+音声をアップロードするバケットに保存すると要約の関数が起動してしまうため、アーカイブには別のバケットを指定します。
+"""
+import os
+import gzip
+import json
+from datetime import datetime
+from cloud_storage_service import upload_bytes_to_gcs
+from tracing import span
+
+# アーカイブを保存するバケット（空の場合はアーカイブしない）
+ARCHIVE_BUCKET_NAME = os.environ.get('ARCHIVE_BUCKET_NAME', '')
+ARCHIVE_PREFIX = os.environ.get('ARCHIVE_PREFIX', 'memos/')
+# 録音日時として扱うファイル名の先頭のタイムスタンプの形式
+RECORDED_AT_FORMAT = '%Y%m%d%H%M%S'
+
+def is_archive_enabled():
+    """
+    アーカイブの保存先が設定されているかを返します。
+    """
+    return bool(ARCHIVE_BUCKET_NAME)
+
+def _recorded_at(file_name):
+    """
+    ファイル名の先頭のタイムスタンプから録音日時を取得します（形式が異なる場合はNone）。
+    """
+    try:
+        return datetime.strptime(os.path.basename(file_name).split('_')[0], RECORDED_AT_FORMAT).isoformat()
+    except ValueError:
+        return None
+
+def build_archive_record(event_id, file_name, result, source, timings=None, duration_seconds=None):
+    """
+    1件のメモのアーカイブのレコードを作成します。
+
+    Args:
+        event_id (str): イベントID
+        file_name (str): 処理対象のファイル名
+        result (dict): transcribe_and_summarizeと同じ形式の辞書（transcription, markdown, nextActions, tags）
+        source (str): 結果の取得方法（interactive / progressive / batch / cache）
+        timings (dict): ステージ名と所要時間（ミリ秒）
+        duration_seconds (float): 録音の長さ（秒）
+
+    Returns:
+        dict: アーカイブのレコード
+    """
+    from notion_service import memo_title
+    from gemini_service import model_router, PROMPT_VERSION
+
+    return {
+        'event_id': event_id,
+        'file_name': file_name,
+        'title': memo_title(file_name),
+        'recorded_at': _recorded_at(file_name),
+        'archived_at': datetime.utcnow().isoformat(),
+        'duration_seconds': duration_seconds,
+        'source': source,
+        'models': model_router.signature(),
+        'prompt_version': PROMPT_VERSION,
+        'transcription': result.get('transcription', ''),
+        'markdown': result.get('markdown', ''),
+        'nextActions': result.get('nextActions', []),
+        'tags': result.get('tags', []),
+        'timings': timings or {},
+    }
+
+def archive_day_prefix(day):
+    """
+    指定した日にアーカイブしたファイルのプレフィックスを返します。
+    """
+    return f"{ARCHIVE_PREFIX}{day:%Y/%m/%d}/"
+
+def archive_object_name(event_id, archived_at=None):
+    """
+    アーカイブのファイル名を返します（日付ごとのディレクトリに分けて、一覧の取得を日付で絞り込めるようにする）。
+    """
+    return f"{archive_day_prefix(archived_at or datetime.utcnow())}{event_id}.jsonl.gz"
+
+def archive_memo(record):
+    """
+    アーカイブのレコードをGCSに保存します。アーカイブは処理結果に影響しないため、失敗しても例外は送出しません。
+
+    Args:
+        record (dict): build_archive_recordで作成したレコード
+
+    Returns:
+        bool: 保存した場合True。アーカイブが無効、または失敗した場合False
+    """
+    if not is_archive_enabled():
+        return False
+    with span("archive.write") as s:
+        data = gzip.compress((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+        name = archive_object_name(record['event_id'], datetime.fromisoformat(record['archived_at']))
+        s.set(bytes=len(data))
+        if not upload_bytes_to_gcs(ARCHIVE_BUCKET_NAME, name, data, content_type='application/gzip'):
+            s.set(error="upload failed")
+            return False
+    print(f"メモをアーカイブしました: gs://{ARCHIVE_BUCKET_NAME}/{name}（{len(data)} bytes）")
+    return True
+
+def read_archive(data):
+    """
+    アーカイブのファイルの内容（gzip圧縮したJSONL）をレコードのリストに変換します。
+
+    Args:
+        data (bytes): ファイルの内容
+
+    Returns:
+        list: アーカイブのレコードのリスト
+    """
+    return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines() if line.strip()]
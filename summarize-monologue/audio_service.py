@@ -0,0 +1,356 @@
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+
+# 再生時間の判定に必要なヘッダー部分として読み込むバイト数
+AUDIO_HEADER_BYTES = 64 * 1024
+
+def _parse_extended_float(data):
+    """
+    AIFFのサンプリングレートで使われる80bit拡張浮動小数点数を変換します。
+
+    Args:
+        data (bytes): 10バイトのビッグエンディアン拡張浮動小数点数
+
+    Returns:
+        float: 変換後の値
+    """
+    exponent, mantissa = struct.unpack('>HQ', data)
+    sign = -1 if exponent & 0x8000 else 1
+    exponent &= 0x7FFF
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    return sign * mantissa * 2.0 ** (exponent - 16383 - 63)
+
+def _get_aiff_duration(header):
+    """
+    AIFF/AIFF-CのCOMMチャンクから再生時間を求めます。
+
+    Args:
+        header (bytes): ファイル先頭のバイト列
+
+    Returns:
+        float: 再生時間（秒）。判定できない場合はNone
+    """
+    offset = 12
+    while offset + 8 <= len(header):
+        chunk_id, chunk_size = struct.unpack('>4sI', header[offset:offset + 8])
+        if chunk_id == b'COMM' and offset + 26 <= len(header):
+            _, num_frames, _ = struct.unpack('>hIh', header[offset + 8:offset + 16])
+            sample_rate = _parse_extended_float(header[offset + 16:offset + 26])
+            return num_frames / sample_rate if sample_rate else None
+        # チャンクは偶数バイト境界に揃えられている
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+def _get_wav_duration(header):
+    """
+    WAVのfmt/dataチャンクから再生時間を求めます。
+
+    Args:
+        header (bytes): ファイル先頭のバイト列
+
+    Returns:
+        float: 再生時間（秒）。判定できない場合はNone
+    """
+    offset = 12
+    byte_rate = None
+    while offset + 8 <= len(header):
+        chunk_id, chunk_size = struct.unpack('<4sI', header[offset:offset + 8])
+        if chunk_id == b'fmt ' and offset + 20 <= len(header):
+            byte_rate = struct.unpack('<I', header[offset + 16:offset + 20])[0]
+        elif chunk_id == b'data':
+            return chunk_size / byte_rate if byte_rate else None
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+def get_audio_duration(header):
+    """
+    音声ファイルのヘッダーから再生時間を求めます。
+    非圧縮のAIFF/WAVのみ対応しており、それ以外の形式ではNoneを返します。
+
+    Args:
+        header (bytes): ファイル先頭のバイト列（AUDIO_HEADER_BYTES程度）
+
+    Returns:
+        float: 再生時間（秒）。判定できない場合はNone
+    """
+    try:
+        if len(header) < 12:
+            return None
+        if header[:4] == b'FORM' and header[8:12] in (b'AIFF', b'AIFC'):
+            return _get_aiff_duration(header)
+        if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+            return _get_wav_duration(header)
+        return None
+    except struct.error as e:
+        print(f"音声ファイルのヘッダー解析中にエラーが発生しました: {e}")
+        return None
+
+# Geminiにアップロードする前に音声をモノラル・低サンプリングレートのOpusに変換するか
+TRANSCODE_AUDIO = os.environ.get('TRANSCODE_AUDIO', 'true').lower() == 'true'
+TRANSCODE_SAMPLE_RATE = int(os.environ.get('TRANSCODE_SAMPLE_RATE', 16000))
+TRANSCODE_BITRATE = os.environ.get('TRANSCODE_BITRATE', '24k')
+# 無音とみなす音量と、残す無音の長さ（先頭・末尾の無音を削除し、長い沈黙は短く詰める）
+SILENCE_THRESHOLD = os.environ.get('SILENCE_THRESHOLD', '-50dB')
+SILENCE_MIN_SECONDS = float(os.environ.get('SILENCE_MIN_SECONDS', 3))
+SILENCE_KEEP_SECONDS = 0.5
+TRANSCODE_CHUNK_SIZE = 1024 * 1024
+# 変換後のファイルの拡張子（Gemini Files APIはこの拡張子からMIMEタイプを判定する）
+TRANSCODED_SUFFIX = '.ogg'
+
+def is_transcoding_available():
+    """
+    音声の変換に必要なffmpeg/ffprobeが利用できるかを確認します。
+
+    Returns:
+        bool: 利用できる場合はTrue
+    """
+    return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+def get_transcoded_path(local_file_path):
+    """
+    変換後の音声ファイルの保存先を返します。
+
+    Args:
+        local_file_path (str): 元の音声ファイルの保存先
+
+    Returns:
+        str: 変換後の音声ファイルの保存先
+    """
+    return f"{local_file_path}{TRANSCODED_SUFFIX}"
+
+def get_file_duration(file_path):
+    """
+    ffprobeで音声ファイルの再生時間を求めます。
+
+    Args:
+        file_path (str): 音声ファイルのパス
+
+    Returns:
+        float: 再生時間（秒）。判定できない場合はNone
+    """
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', file_path],
+        capture_output=True, text=True,
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+def transcode_stream(stream, output_path):
+    """
+    音声データのストリームをffmpegに流し込み、モノラル・16kHzのOpusに変換します。
+    入力はチャンク単位で渡すため、元のファイル全体をメモリやディスクに展開しません。
+    先頭・末尾の無音は削除し、SILENCE_MIN_SECONDS以上の沈黙はSILENCE_KEEP_SECONDSに詰めます。
+
+    Args:
+        stream (io.IOBase): 元の音声データの読み込みストリーム
+        output_path (str): 変換後の音声ファイルの保存先
+
+    Returns:
+        dict: 変換前後のバイト数・変換後の再生時間・所要時間
+    """
+    silence_filter = (
+        f"silenceremove=start_periods=1:start_threshold={SILENCE_THRESHOLD}:start_silence={SILENCE_KEEP_SECONDS}"
+        f":stop_periods=-1:stop_threshold={SILENCE_THRESHOLD}:stop_duration={SILENCE_MIN_SECONDS}:stop_silence={SILENCE_KEEP_SECONDS}"
+    )
+    command = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', 'pipe:0',
+        '-ac', '1', '-ar', str(TRANSCODE_SAMPLE_RATE),
+        '-af', silence_filter,
+        '-c:a', 'libopus', '-b:a', TRANSCODE_BITRATE, '-application', 'voip',
+        output_path,
+    ]
+
+    started_at = time.perf_counter()
+    input_bytes = 0
+    # stderrをパイプにすると、出力がパイプの容量を超えた時点でffmpegが止まり、stdinへの書き込みも止まるため、一時ファイルに書き出す
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=stderr_file)
+        try:
+            try:
+                while True:
+                    chunk = stream.read(TRANSCODE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    process.stdin.write(chunk)
+                    input_bytes += len(chunk)
+            except BrokenPipeError:
+                # ffmpegが異常終了した場合は、下のreturncodeの確認でエラーにする
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+            process.wait()
+        finally:
+            # 入力の読み込みなどで例外が発生した場合も、ffmpegのプロセスを残さない
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode(errors='replace')
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpegによる音声の変換に失敗しました: {stderr.strip()}")
+
+    return {
+        'input_bytes': input_bytes,
+        'output_bytes': os.path.getsize(output_path),
+        'duration_seconds': get_file_duration(output_path),
+        'elapsed_seconds': time.perf_counter() - started_at,
+    }
+
+# 区間に分割する際の無音の検出（ffmpegのsilencedetect）に使う、無音とみなす最小の長さ
+SEGMENT_SILENCE_MIN_SECONDS = float(os.environ.get('SEGMENT_SILENCE_MIN_SECONDS', 0.4))
+# 音声を切り出す際に一度に読み書きするバイト数
+SEGMENT_COPY_CHUNK_SIZE = 1024 * 1024
+
+def _get_pcm_layout(header):
+    """
+    非圧縮のWAV/AIFFのヘッダーから、音声データの位置と1フレームのバイト数を求めます。
+
+    Args:
+        header (bytes): ファイル先頭のバイト列
+
+    Returns:
+        dict: 形式（wav / aiff）・フォーマットのチャンク・データの開始位置とバイト数・1フレームのバイト数・サンプリングレート。
+            非圧縮のWAV/AIFF以外の場合はNone
+    """
+    if len(header) < 12:
+        return None
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        kind, endian = 'wav', '<'
+    elif header[:4] == b'FORM' and header[8:12] == b'AIFF':
+        kind, endian = 'aiff', '>'
+    else:
+        return None
+
+    layout = {'kind': kind}
+    offset = 12
+    while offset + 8 <= len(header):
+        chunk_id, chunk_size = struct.unpack(f'{endian}4sI', header[offset:offset + 8])
+        body = header[offset + 8:offset + 8 + chunk_size]
+        if chunk_id == b'fmt ' and len(body) >= 16:
+            audio_format, channels, sample_rate, _, block_align, _ = struct.unpack('<HHIIHH', body[:16])
+            if audio_format not in (1, 3, 0xFFFE):
+                return None
+            layout.update(format_chunk=header[offset:offset + 8 + chunk_size], frame_bytes=block_align, sample_rate=sample_rate)
+        elif chunk_id == b'COMM' and len(body) >= 18:
+            channels, _, sample_size = struct.unpack('>hIh', body[:8])
+            layout.update(format_chunk=header[offset:offset + 8 + chunk_size], frame_bytes=channels * ((sample_size + 7) // 8),
+                          sample_rate=_parse_extended_float(body[8:18]))
+        elif chunk_id == b'data':
+            layout.update(data_offset=offset + 8, data_size=chunk_size)
+            break
+        elif chunk_id == b'SSND' and len(body) >= 8:
+            # SSNDチャンクの先頭8バイトはオフセットとブロックサイズ
+            data_offset = struct.unpack('>I', body[:4])[0]
+            layout.update(data_offset=offset + 16 + data_offset, data_size=chunk_size - 8 - data_offset)
+            break
+        offset += 8 + chunk_size + (chunk_size & 1)
+    if not {'format_chunk', 'data_offset'} <= layout.keys() or not layout['frame_bytes'] or not layout['sample_rate']:
+        return None
+    return layout
+
+def _cut_pcm_segment(input_path, output_path, layout, start, end):
+    """
+    非圧縮のWAV/AIFFから指定した区間の音声データを切り出し、同じ形式のファイルとして保存します。
+    """
+    frame_bytes = layout['frame_bytes']
+    total_frames = layout['data_size'] // frame_bytes
+    first_frame = min(int(start * layout['sample_rate']), total_frames)
+    last_frame = min(int(end * layout['sample_rate']), total_frames)
+    data_size = (last_frame - first_frame) * frame_bytes
+
+    format_chunk = layout['format_chunk']
+    if layout['kind'] == 'wav':
+        header = b'RIFF' + struct.pack('<I', 4 + len(format_chunk) + 8 + data_size + (data_size & 1)) + b'WAVE'
+        header += format_chunk + b'data' + struct.pack('<I', data_size)
+    else:
+        # COMMチャンクのフレーム数を、切り出した区間のフレーム数に書き換える
+        format_chunk = format_chunk[:10] + struct.pack('>I', last_frame - first_frame) + format_chunk[14:]
+        header = b'FORM' + struct.pack('>I', 4 + len(format_chunk) + 16 + data_size + (data_size & 1)) + b'AIFF'
+        header += format_chunk + b'SSND' + struct.pack('>III', 8 + data_size, 0, 0)
+
+    with open(input_path, 'rb') as source, open(output_path, 'wb') as output:
+        output.write(header)
+        source.seek(layout['data_offset'] + first_frame * frame_bytes)
+        remaining = data_size
+        while remaining > 0:
+            chunk = source.read(min(SEGMENT_COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            output.write(chunk)
+            remaining -= len(chunk)
+        if data_size & 1:
+            output.write(b'\0')
+
+def cut_audio_segment(input_path, output_path, start, end):
+    """
+    音声ファイルから指定した区間を切り出して保存します。
+    非圧縮のWAV/AIFFはヘッダーを解析して音声データの範囲をそのまま切り出し、それ以外の形式はffmpegで切り出します。
+
+    Args:
+        input_path (str): 元の音声ファイルのパス
+        output_path (str): 切り出した音声の保存先（元のファイルと同じ形式）
+        start (float): 区間の開始（秒）
+        end (float): 区間の終了（秒）
+
+    Returns:
+        str: 切り出した音声ファイルのパス
+    """
+    with open(input_path, 'rb') as f:
+        layout = _get_pcm_layout(f.read(AUDIO_HEADER_BYTES))
+    if layout is not None:
+        _cut_pcm_segment(input_path, output_path, layout, start, end)
+        return output_path
+
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError(f"音声の区間を切り出すにはffmpegが必要です: {input_path}")
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-ss', f"{start:.3f}", '-t', f"{end - start:.3f}",
+         '-i', input_path, '-c', 'copy', output_path],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpegによる音声の切り出しに失敗しました: {result.stderr.strip()}")
+    return output_path
+
+def detect_silences(file_path):
+    """
+    ffmpegのsilencedetectで、音声ファイル内の無音の区間を求めます。
+    長い録音を区間に分割する際に、発話の途中ではなく無音の位置で区切るために使用します。
+
+    Args:
+        file_path (str): 音声ファイルのパス
+
+    Returns:
+        list: (開始秒, 終了秒) のタプルのリスト。ffmpegが利用できない場合や検出に失敗した場合は空のリスト
+    """
+    if shutil.which('ffmpeg') is None:
+        return []
+    result = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-nostats', '-i', file_path,
+         '-af', f"silencedetect=noise={SILENCE_THRESHOLD}:d={SEGMENT_SILENCE_MIN_SECONDS}", '-f', 'null', '-'],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        print(f"無音の検出に失敗したため、一定の長さで区切ります: {result.stderr.strip()[-200:]}")
+        return []
+
+    silences = []
+    start = None
+    for line in result.stderr.splitlines():
+        if 'silence_start:' in line:
+            start = float(line.split('silence_start:')[1].split()[0])
+        elif 'silence_end:' in line and start is not None:
+            silences.append((start, float(line.split('silence_end:')[1].split()[0])))
+            start = None
+    return silences
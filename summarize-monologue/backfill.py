@@ -0,0 +1,113 @@
+"""
+GCSバケットのプレフィックス配下にある音声ファイルをまとめて処理するバッチ処理。
+障害からの復旧やプロンプト変更後の再処理に使用します。
+
+使い方:
+    python backfill.py --bucket [GCSバケット名] --prefix 202501 --workers 4
+
+Firestoreに処理完了・処理中として記録されているファイルはスキップされるため、
+途中で中断しても同じコマンドを再実行すれば続きから処理できます。
+失敗した処理は再試行時刻を過ぎていれば再処理されるため、定期実行すると未処理分が自動的に解消されます。
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from cloud_storage_service import list_gcs_files
+from firestore_service import generate_event_id, is_event_claimable
+from main import summarize_monologue_async, BUCKET_NAME, RESULT_COMPLETED, RESULT_SKIPPED, RESULT_DEFERRED
+
+def process_object(data):
+    """
+    1つの音声ファイルをCloudEventトリガー時と同じパイプラインで処理します。
+
+    Args:
+        data (dict): CloudEventのデータと同じ形式の辞書
+
+    Returns:
+        str: 処理結果のメッセージ
+    """
+    return asyncio.run(summarize_monologue_async(data))
+
+def list_pending_objects(bucket_name, prefix):
+    """
+    プレフィックス配下のファイルのうち、まだ処理されていないもの（リース切れ・再試行待ちを過ぎたものを含む）を取得します。
+
+    Args:
+        bucket_name (str): GCSバケット名
+        prefix (str): ファイル名のプレフィックス
+
+    Returns:
+        tuple: (未処理のファイルのリスト, スキップしたファイル数)
+    """
+    pending = []
+    skipped = 0
+    for data in list_gcs_files(bucket_name, prefix):
+        if not is_event_claimable(generate_event_id(bucket_name, data["name"])):
+            skipped += 1
+            continue
+        pending.append(data)
+    return pending, skipped
+
+def run_backfill(bucket_name, prefix, workers, executor_type='thread', limit=None):
+    """
+    未処理のファイルをワーカープールで並列に処理し、進捗とスループットを出力します。
+    GeminiとNotionへの同時リクエスト数は各サービスの上限設定（GEMINI_MAX_CONCURRENCY / NOTION_MAX_CONCURRENCY）で制御されます。
+    プロセスプールの場合、上限はプロセスごとに適用されます。
+
+    Args:
+        bucket_name (str): GCSバケット名
+        prefix (str): ファイル名のプレフィックス
+        workers (int): 並列数
+        executor_type (str): thread または process
+        limit (int): 処理するファイル数の上限
+
+    Returns:
+        dict: 結果ごとの件数
+    """
+    pending, skipped = list_pending_objects(bucket_name, prefix)
+    if limit:
+        pending = pending[:limit]
+    print(f"処理対象: {len(pending)}件 (処理済み・処理中・再試行待ちのためスキップ: {skipped}件)")
+
+    counts = {'completed': 0, 'skipped': skipped, 'deferred': 0, 'failed': 0}
+    started_at = time.perf_counter()
+    executor_class = ProcessPoolExecutor if executor_type == 'process' else ThreadPoolExecutor
+
+    with executor_class(max_workers=workers) as executor:
+        futures = {executor.submit(process_object, data): data["name"] for data in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            file_name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = f"Error: {e}"
+
+            if result == RESULT_COMPLETED:
+                counts['completed'] += 1
+            elif result == RESULT_SKIPPED:
+                counts['skipped'] += 1
+            elif result == RESULT_DEFERRED:
+                counts['deferred'] += 1
+            else:
+                counts['failed'] += 1
+
+            elapsed = time.perf_counter() - started_at
+            print(f"[{done}/{len(pending)}] {file_name}: {result} (経過 {elapsed:.1f}秒)")
+
+    elapsed_minutes = (time.perf_counter() - started_at) / 60
+    throughput = counts['completed'] / elapsed_minutes if elapsed_minutes > 0 else 0
+    print(f"完了: {counts['completed']}件, スキップ: {counts['skipped']}件, バッチ処理に登録: {counts['deferred']}件, 失敗: {counts['failed']}件")
+    print(f"スループット: {throughput:.2f} 件/分 (所要 {elapsed_minutes:.2f}分)")
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GCSのプレフィックス配下の音声ファイルをまとめて処理します')
+    parser.add_argument('--bucket', default=BUCKET_NAME, help='GCSバケット名')
+    parser.add_argument('--prefix', default=None, help='処理対象のファイル名のプレフィックス')
+    parser.add_argument('--workers', type=int, default=4, help='並列数')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread', help='ワーカープールの種類')
+    parser.add_argument('--limit', type=int, default=None, help='処理するファイル数の上限')
+    args = parser.parse_args()
+
+    run_backfill(args.bucket, args.prefix, args.workers, args.executor, args.limit)
@@ -0,0 +1,414 @@
+"""
+急がないボイスメモをGeminiのバッチAPIでまとめて処理する仕組み。
+アップロード時に processing-mode=batch のメタデータが付いた音声は、Geminiにアップロードしたうえで
+イベントのドキュメントに batch_pending として記録し、ポーリング（poll_gemini_batches）がまとめてバッチジョブを作成します。
+バッチジョブが完了したら、結果をNotionに送信してイベントの処理を完了にします。
+
+イベントのドキュメントの状態:
+    batch_pending（バッチへの登録待ち）→ batch_submitting（ジョブの作成中）→ batch_submitted（ジョブの完了待ち）→ completed / failed
+
+ジョブの作成中に異常終了して batch_submitting のまま BATCH_SUBMIT_TIMEOUT_SECONDS を過ぎたイベントは、ポーリングが
+作成済みのジョブがあれば batch_submitted に、なければ batch_pending に戻します。
+ジョブが失敗・期限切れ・取り消しで終了した場合は、イベントを通常の処理（interactive）でやり直します。
+"""
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from firestore_service import (
+    get_firestore_client, _transactional, _as_naive_utc, get_processing_state, fenced_update,
+    mark_processing_completed, mark_processing_failed, LeaseLost, COLLECTION_NAME,
+)
+from cloud_storage_service import delete_file_from_gcs
+from gemini_service import (
+    get_genai_client, model_router, SYSTEM_PREAMBLE, SUMMARY_INSTRUCTION, SINGLE_CALL_PROMPT, PROMPT_VERSION, GEMINI_MODEL,
+)
+from cache_service import generate_cache_key, set_cached_result
+from tag_service import tag_vocabulary_prompt
+from archive_service import is_archive_enabled, build_archive_record, archive_memo
+from tracing import span
+
+# アップロード時に指定する処理方式のメタデータ（x-goog-meta-processing-mode）
+PROCESSING_MODE_METADATA_KEY = 'processing-mode'
+# メタデータがない場合の処理方式（interactive / batch）
+DEFAULT_PROCESSING_MODE = os.environ.get('DEFAULT_PROCESSING_MODE', 'interactive')
+# バッチジョブを記録するコレクション
+BATCH_COLLECTION_NAME = os.environ.get('BATCH_COLLECTION_NAME', 'monologue_batch_jobs')
+BATCH_MODEL = os.environ.get('BATCH_MODEL', GEMINI_MODEL)
+# 登録待ちがこの件数に達するか、最も古いものが BATCH_MAX_WAIT_SECONDS 待った時点でバッチジョブを作成する
+BATCH_MIN_REQUESTS = int(os.environ.get('BATCH_MIN_REQUESTS', 10))
+BATCH_MAX_WAIT_SECONDS = int(os.environ.get('BATCH_MAX_WAIT_SECONDS', 900))
+# 1つのバッチジョブに含める最大件数
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 100))
+# ジョブの作成中（batch_submitting）のまま、この秒数を過ぎたイベントは作成が中断したとみなして戻す
+BATCH_SUBMIT_TIMEOUT_SECONDS = int(os.environ.get('BATCH_SUBMIT_TIMEOUT_SECONDS', 600))
+# 成功したとみなすバッチジョブの状態と、終了した（これ以上変化しない）状態
+SUCCEEDED_STATES = ('JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED')
+TERMINAL_STATES = SUCCEEDED_STATES + ('JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED')
+
+def processing_mode(data):
+    """
+    CloudEventのデータ（GCSのオブジェクトのメタデータ）から処理方式を判定します。
+
+    Args:
+        data (dict): CloudEventのデータ
+
+    Returns:
+        str: interactive または batch
+    """
+    mode = (data.get('metadata') or {}).get(PROCESSING_MODE_METADATA_KEY, DEFAULT_PROCESSING_MODE)
+    return 'batch' if mode == 'batch' else 'interactive'
+
+def _state_name(state):
+    """
+    バッチジョブの状態（JobState）を文字列に変換します。
+    """
+    return getattr(state, 'name', None) or str(state)
+
+def _timestamp(value):
+    return _as_naive_utc(value).replace(tzinfo=timezone.utc).timestamp()
+
+def defer_to_batch(event_id, audio_path=None, audio_file=None, duration_seconds=None, content_hash=None, lease_owner=None):
+    """
+    音声をGeminiにアップロードし、イベントをバッチへの登録待ちとして記録します。
+    アップロードしたファイルはバッチジョブの完了後に削除します（Files APIの保存期間は48時間）。
+
+    Args:
+        event_id (str): イベントID
+        audio_path (str): 音声ファイルのパス（未アップロードの場合に使用）
+        audio_file (types.File): アップロード済みのファイル
+        duration_seconds (float): 録音の長さ（秒）
+        content_hash (str): 音声ファイルの内容ハッシュ
+        lease_owner (str): リースの所有者を識別するID（Noneの場合は確認しない）
+
+    Raises:
+        LeaseLost: リースが他の処理に引き継がれていた場合
+    """
+    with span("batch.defer") as s:
+        if audio_file is None:
+            audio_file = model_router.retry('files.upload', lambda: get_genai_client().files.upload(file=audio_path))
+        update = fenced_update(event_id, lambda doc_data: {
+            'status': 'batch_pending',
+            'batch_enqueued_at': datetime.utcnow(),
+            'gemini_file': {'name': audio_file.name, 'uri': audio_file.uri, 'mime_type': audio_file.mime_type},
+            'duration_seconds': duration_seconds,
+            'content_hash': content_hash,
+        }, lease_owner)
+        s.set(file=audio_file.name)
+        if update is None:
+            _delete_gemini_file({'gemini_file': {'name': audio_file.name}})
+            raise LeaseLost(f"イベント {event_id} のリースが他の処理に引き継がれたため、バッチ処理に登録しません")
+    print(f"バッチ処理の登録待ちとして記録しました: イベントID={event_id}, ファイル={audio_file.name}")
+
+def build_batch_request(event_id, event):
+    """
+    1件のイベントのバッチリクエスト（文字起こしと要約を1回で行う）を作成します。
+
+    Args:
+        event_id (str): イベントID
+        event (dict): イベントのドキュメント
+
+    Returns:
+        dict: InlinedRequestの辞書
+    """
+    from schema import TranscriptionSummaryResponse
+
+    gemini_file = event['gemini_file']
+    return {
+        'contents': [{
+            'role': 'user',
+            'parts': [
+                {'text': SINGLE_CALL_PROMPT},
+                {'file_data': {'file_uri': gemini_file['uri'], 'mime_type': gemini_file['mime_type']}},
+            ],
+        }],
+        'config': {
+            'system_instruction': SYSTEM_PREAMBLE + SUMMARY_INSTRUCTION + tag_vocabulary_prompt(),
+            'response_mime_type': 'application/json',
+            'response_schema': TranscriptionSummaryResponse,
+        },
+        'metadata': {'event_id': event_id},
+    }
+
+def _transition(event_id, from_status, to_status, fields=None):
+    """
+    イベントの状態が from_status の場合のみ、トランザクション内で to_status に変更します。
+
+    Returns:
+        bool: 変更した場合True
+    """
+    def update(transaction, doc_ref):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists or snapshot.get('status') != from_status:
+            return False
+        transaction.update(doc_ref, dict(fields or {}, status=to_status))
+        return True
+
+    db = get_firestore_client()
+    return _transactional(update)(db.transaction(), db.collection(COLLECTION_NAME).document(event_id))
+
+def submit_pending_requests(now=None):
+    """
+    バッチへの登録待ちのイベントをまとめて1つのバッチジョブを作成します。
+    件数が BATCH_MIN_REQUESTS に満たず、最も古いものの待ち時間が BATCH_MAX_WAIT_SECONDS 未満の場合は作成しません。
+
+    Args:
+        now (float): 現在時刻（UNIX時間）
+
+    Returns:
+        str: 作成したバッチジョブの名前。作成しなかった場合はNone
+    """
+    from google.cloud import firestore
+
+    now = now or time.time()
+    snapshots = get_firestore_client().collection(COLLECTION_NAME) \
+        .where(filter=firestore.FieldFilter('status', '==', 'batch_pending')).limit(BATCH_MAX_REQUESTS).stream()
+    pending = [(snapshot.id, snapshot.to_dict()) for snapshot in snapshots]
+    if not pending:
+        return None
+    oldest_wait = now - min(_timestamp(event['batch_enqueued_at']) for _, event in pending)
+    if len(pending) < BATCH_MIN_REQUESTS and oldest_wait < BATCH_MAX_WAIT_SECONDS:
+        print(f"バッチへの登録待ち: {len(pending)}件（最も古いものの待ち時間 {oldest_wait:.0f}秒）。ジョブの作成を待ちます")
+        return None
+
+    with span("batch.submit", model=BATCH_MODEL) as s:
+        # 複数のポーリングが同時に実行されても、同じイベントを2つのジョブに含めないようにする
+        submitter = uuid.uuid4().hex
+        submitting = {'batch_submitter': submitter, 'batch_submitting_until': datetime.utcnow() + timedelta(seconds=BATCH_SUBMIT_TIMEOUT_SECONDS)}
+        claimed = [(event_id, event) for event_id, event in pending if _transition(event_id, 'batch_pending', 'batch_submitting', submitting)]
+        if not claimed:
+            return None
+        try:
+            requests = [build_batch_request(event_id, event) for event_id, event in claimed]
+            job = model_router.retry('batches.create', lambda: get_genai_client().batches.create(
+                model=BATCH_MODEL, src=requests, config={'display_name': f"monologue-{submitter[:8]}"},
+            ))
+        except Exception:
+            for event_id, _ in claimed:
+                _transition(event_id, 'batch_submitting', 'batch_pending')
+            raise
+
+        event_ids = [event_id for event_id, _ in claimed]
+        get_firestore_client().collection(BATCH_COLLECTION_NAME).document(job.name.replace('/', '_')).set({
+            'job_name': job.name,
+            'submitter': submitter,
+            'model': BATCH_MODEL,
+            'event_ids': event_ids,
+            'state': _state_name(job.state),
+            'done': False,
+            'submitted_at': datetime.utcnow(),
+        })
+        for event_id in event_ids:
+            _transition(event_id, 'batch_submitting', 'batch_submitted', {'batch_job': job.name})
+        s.set(job=job.name, requests=len(event_ids), oldest_wait_ms=round(oldest_wait * 1000, 1))
+    print(f"バッチジョブを作成しました: {job.name}（{len(event_ids)}件）")
+    return job.name
+
+def reclaim_stale_submissions(now=None):
+    """
+    ジョブの作成中（batch_submitting）のまま期限を過ぎたイベントを戻します。
+    同じ作成処理のジョブが記録されていればそのジョブの完了待ち（batch_submitted）に、なければ登録待ち（batch_pending）に戻します。
+
+    Args:
+        now (datetime): 現在時刻（UTC）
+
+    Returns:
+        int: 戻したイベントの件数
+    """
+    from google.cloud import firestore
+
+    now = now or datetime.utcnow()
+    db = get_firestore_client()
+    snapshots = db.collection(COLLECTION_NAME).where(filter=firestore.FieldFilter('status', '==', 'batch_submitting')).stream()
+    # 期限のない batch_submitting は期限を導入する前に作成が中断したものとして扱う
+    stale = [(snapshot.id, snapshot.to_dict()) for snapshot in snapshots]
+    stale = [(event_id, event) for event_id, event in stale if (_as_naive_utc(event.get('batch_submitting_until')) or now) <= now]
+
+    reclaimed = 0
+    for event_id, event in stale:
+        jobs = db.collection(BATCH_COLLECTION_NAME) \
+            .where(filter=firestore.FieldFilter('submitter', '==', event.get('batch_submitter'))).limit(1).stream()
+        job = next((snapshot.to_dict() for snapshot in jobs), None)
+        job_name = job['job_name'] if job and event_id in job['event_ids'] else None
+
+        def reclaim(transaction, doc_ref):
+            # 確認と更新の間に作成処理が進んだ場合は戻さない
+            snapshot = doc_ref.get(transaction=transaction)
+            if not snapshot.exists or snapshot.get('status') != 'batch_submitting' or snapshot.to_dict().get('batch_submitter') != event.get('batch_submitter'):
+                return False
+            if job_name:
+                transaction.update(doc_ref, {'status': 'batch_submitted', 'batch_job': job_name})
+            else:
+                transaction.update(doc_ref, {'status': 'batch_pending', 'batch_submitter': firestore.DELETE_FIELD, 'batch_submitting_until': firestore.DELETE_FIELD})
+            return True
+
+        if _transactional(reclaim)(db.transaction(), db.collection(COLLECTION_NAME).document(event_id)):
+            reclaimed += 1
+            print(f"ジョブの作成が中断したイベントを戻しました: {event_id}（{'ジョブの完了待ち' if job_name else '登録待ち'}）")
+    return reclaimed
+
+def _delete_gemini_file(event):
+    gemini_file = (event or {}).get('gemini_file')
+    if not gemini_file:
+        return
+    try:
+        get_genai_client().files.delete(name=gemini_file['name'])
+    except Exception as e:
+        print(f"Geminiからのファイル削除中にエラーが発生しました: {e}")
+
+def complete_batch_event(event_id, inlined_response, job_name=None):
+    """
+    バッチジョブの1件の結果をNotionに送信し、イベントの処理を完了にします。
+    失敗した場合は処理の失敗として記録し、再試行時刻を過ぎたら再処理されるようにします。
+
+    Args:
+        event_id (str): イベントID
+        inlined_response: InlinedResponse（response または error を持つ）
+        job_name (str): 結果を返したジョブの名前（イベントが別のジョブに含め直されていた場合はスキップする）
+
+    Returns:
+        bool: 処理を完了した場合True
+    """
+    from schema import TranscriptionSummaryResponse
+    from notion_service import send_to_notion, format_next_actions
+
+    event = get_processing_state(event_id)
+    if event is None or event.get('status') != 'batch_submitted' or (job_name and event.get('batch_job') != job_name):
+        print(f"バッチの結果を受け取りましたが、イベントがこのジョブの完了待ちではないためスキップします: {event_id}")
+        return False
+
+    with span("batch.complete_event", event_id=event_id) as s:
+        try:
+            if inlined_response is None or getattr(inlined_response, 'error', None):
+                raise RuntimeError(f"バッチのリクエストが失敗しました: {getattr(inlined_response, 'error', None)}")
+            result = TranscriptionSummaryResponse.model_validate_json(inlined_response.response.text).model_dump()
+            summary = {key: result[key] for key in ('markdown', 'nextActions', 'tags')}
+            if not send_to_notion(event['file_name'], summary['markdown'], format_next_actions(summary['nextActions']), summary['tags']):
+                raise RuntimeError("Notionへの送信中にエラーが発生しました")
+            if event.get('content_hash'):
+                set_cached_result(generate_cache_key(event['content_hash'], model_router.signature(), PROMPT_VERSION), result['transcription'], summary)
+            if is_archive_enabled():
+                archive_memo(build_archive_record(event_id, event['file_name'], result, 'batch', duration_seconds=event.get('duration_seconds')))
+            delete_file_from_gcs(event['bucket_name'], event['file_name'])
+            mark_processing_completed(event_id, event['bucket_name'], event['file_name'], from_status='batch_submitted')
+            return True
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"バッチの結果の処理中にエラーが発生しました: イベントID={event_id}, {e}")
+            mark_processing_failed(event_id, str(e), from_status='batch_submitted')
+            return False
+        finally:
+            _delete_gemini_file(event)
+
+def _interactive_event_data(event):
+    """
+    イベントのドキュメントとGCSのオブジェクトから、通常の処理（interactive）で処理するCloudEventのデータを作成します。
+    """
+    from cloud_storage_service import list_gcs_files
+
+    data = next((file for file in list_gcs_files(event['bucket_name'], event['file_name']) if file['name'] == event['file_name']), None)
+    data = dict(data or {'bucket': event['bucket_name'], 'name': event['file_name'], 'metadata': {}})
+    data['metadata'] = dict(data.get('metadata') or {}, **{PROCESSING_MODE_METADATA_KEY: 'interactive'})
+    return data
+
+def requeue_interactive(event_id, job_name, reason):
+    """
+    バッチジョブの完了待ちのイベントを、通常の処理（interactive）でやり直します。
+    イベントを再試行できる失敗として記録したうえで、キューが有効な場合はキューに登録し、無効な場合はこの場で処理します。
+
+    Args:
+        event_id (str): イベントID
+        job_name (str): イベントを含んでいたジョブの名前
+        reason (str): やり直す理由
+
+    Returns:
+        bool: やり直した場合True（イベントが別のジョブに含め直されていた場合などはFalse）
+    """
+    from google.cloud import firestore
+    from main import summarize_monologue_async, QUEUE_ENABLED
+    from queue_service import enqueue_event
+    import asyncio
+
+    event = get_processing_state(event_id)
+    if event is None or event.get('batch_job') != job_name:
+        return False
+    failed_at = datetime.utcnow()
+    update = fenced_update(event_id, lambda doc_data: {
+        'status': 'failed',
+        'failed_at': failed_at,
+        'last_error': reason,
+        'next_retry_at': failed_at,
+        'gemini_file': firestore.DELETE_FIELD,
+    }, from_status='batch_submitted')
+    if update is None:
+        return False
+    _delete_gemini_file(event)
+
+    print(f"{reason}ため、通常の処理でやり直します: イベントID={event_id}")
+    with span("batch.requeue", event_id=event_id, queue=QUEUE_ENABLED):
+        try:
+            data = _interactive_event_data(event)
+            if QUEUE_ENABLED:
+                enqueue_event(event_id, data)
+            else:
+                result = asyncio.run(summarize_monologue_async(data))
+                print(f"通常の処理でやり直しました: イベントID={event_id}, 結果={result}")
+        except Exception as e:
+            # イベントは再試行時刻を過ぎた失敗として記録済みのため、backfill.py の定期実行で再処理される
+            print(f"通常の処理でのやり直しに失敗しました: イベントID={event_id}, エラー={str(e)}")
+    return True
+
+def poll_submitted_jobs():
+    """
+    完了待ちのバッチジョブの状態を確認し、終了したジョブの結果を処理します。
+
+    Returns:
+        dict: 処理件数（completed / failed / requeued / running）
+    """
+    from google.cloud import firestore
+
+    counts = {'completed': 0, 'failed': 0, 'requeued': 0, 'running': 0}
+    collection = get_firestore_client().collection(BATCH_COLLECTION_NAME)
+    for snapshot in collection.where(filter=firestore.FieldFilter('done', '==', False)).stream():
+        job_doc = snapshot.to_dict()
+        with span("batch.poll_job", job=job_doc['job_name']) as s:
+            job = get_genai_client().batches.get(name=job_doc['job_name'])
+            state = _state_name(job.state)
+            s.set(state=state, requests=len(job_doc['event_ids']))
+            if state not in TERMINAL_STATES:
+                collection.document(snapshot.id).update({'state': state})
+                counts['running'] += len(job_doc['event_ids'])
+                continue
+
+            if state in SUCCEEDED_STATES:
+                responses = list(job.dest.inlined_responses or []) if job.dest else []
+                # 結果はリクエストの順に返されるが、メタデータにイベントIDがあればそれを優先する
+                by_event_id = {}
+                for index, response in enumerate(responses):
+                    metadata = getattr(response, 'metadata', None) or {}
+                    by_event_id[metadata.get('event_id') or (job_doc['event_ids'][index] if index < len(job_doc['event_ids']) else None)] = response
+                for event_id in job_doc['event_ids']:
+                    counts['completed' if complete_batch_event(event_id, by_event_id.get(event_id), job_doc['job_name']) else 'failed'] += 1
+            else:
+                # ジョブ全体が失敗・期限切れ・取り消しで終了した場合は、メモの問題ではないため通常の処理でやり直す
+                for event_id in job_doc['event_ids']:
+                    if requeue_interactive(event_id, job_doc['job_name'], f"バッチジョブが {state} で終了しました"):
+                        counts['requeued'] += 1
+            collection.document(snapshot.id).update({'state': state, 'done': True, 'finished_at': datetime.utcnow()})
+            print(f"バッチジョブが終了しました: {job_doc['job_name']}（状態: {state}）")
+    return counts
+
+def poll_batches():
+    """
+    完了したバッチジョブの結果を処理し、登録待ちのイベントから新しいバッチジョブを作成します。
+    Cloud Schedulerから定期的に呼び出します。
+
+    Returns:
+        dict: 処理結果
+    """
+    with span("batch.poll") as s:
+        reclaimed = reclaim_stale_submissions()
+        counts = poll_submitted_jobs()
+        submitted = submit_pending_requests()
+        s.set(submitted=submitted, reclaimed=reclaimed, **counts)
+    return dict(counts, reclaimed=reclaimed, submitted_job=submitted)
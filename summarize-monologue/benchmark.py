@@ -0,0 +1,627 @@
+"""
+疑似バックエンド（fakes.py）に対してCloudEventを再生し、パイプラインの性能を計測するベンチマーク。
+実際のAPIを呼び出さないため、クォータを消費せずに並列数や設定の変更の効果を比較できます。
+
+使い方:
+    python benchmark.py --memos 50 --duplicates 3 --workers 8
+    python benchmark.py --corpus events.jsonl --gemini-latency 3 --gemini-error-rate 0.05
+    python benchmark.py --memos 5 --transcription-latency 20 --progressive   # 逐次処理の比較
+    python benchmark.py --memos 50 --queue --workers 4                       # キュー経由の処理
+    python benchmark.py --memos 20 --batch-fraction 0.5 --batch-latency 5     # バッチAPIでの処理
+    python benchmark.py --memos 30 --duration 300 --workers 16 --download --workspace-budget-mb 40   # 作業ディレクトリの予算
+    python benchmark.py --suite size-sweep --sizes 60,600,1800                # 音声の長さごとのメモリと処理時間
+    python benchmark.py --suite modes --memos 10 --duration 120 --transcription-latency 8   # 1回のリクエストと2段階の比較
+    python benchmark.py --suite signed-url --requests 200 --workers 8         # 署名付きURLの発行（認証情報の再利用の前後）
+    python benchmark.py --suite markdown --lines 1000,10000,50000              # MarkdownからNotionブロックへの変換
+
+--corpus には1行1件のCloudEventのデータ（bucket, name を含むJSON）を指定します。
+同じイベントを --duplicates 回ずつ同時に配信し、Notionのページが1件だけ作成されることを確認します。
+--queue を指定すると、配信はキューへの登録のみ行い、その後ワーカー（worker.py）が並列数 --workers で処理します。
+--batch-fraction を指定すると、その割合のメモを processing-mode=batch でアップロードし、配信後にポーリング（batch_service.poll_batches）で
+バッチジョブの作成と結果の処理を行います。
+--workspace-budget-mb を指定すると、作業ディレクトリの予算（workspace_service.py）をその値にし、予算を超えて後回しにされた配信を
+GCSトリガーの再試行と同じように --retry-delay 秒後に再配信します。予約の最大値が予算を超えないこと・作業ディレクトリが残らないことを確認します。
+--suite size-sweep は、--sizes の長さ（秒）の音声を1件ずつ、ストリーミング（STREAM_INGEST=true）と一時ファイル経由で処理し、
+最大RSS・一時ファイルの量・処理全体の時間を比較します。
+--suite modes は、同じ音声を GEMINI_PIPELINE_MODE=single（文字起こしと要約を1回のリクエスト）と two_step（文字起こしの後に要約）で処理し、
+処理時間・Geminiへのリクエスト数・トークン数を比較します。
+--suite signed-url は、アップロード用の関数（upload-monologue/main.py）の generate_signed_url に --requests 件のリクエストを並列数 --workers で送り、
+リクエストごとに認証情報の取得・トークンの更新・クライアントの生成を行う場合（before）と、それらを再利用する現在の実装（after）の
+レイテンシ（p50/p99）を比較します。まとめて発行する場合（memos）の1件あたりの時間も計測します。
+--suite markdown は、見出し・箇条書き・ToDo・インライン記法・2000文字を超える段落を含む --lines 行のMarkdownを生成し、
+convert_markdown_to_notion_blocks の変換時間（最良値）と1秒あたりの行数を計測します。
+
+出力:
+    スループット（件/分）、ステージ・スパンごとのレイテンシ（p50/p90/p99）、最初の内容がNotionに書き込まれるまでの時間、
+    ピークメモリ、作業ディレクトリの予算の使用状況、重複排除の検証結果
+"""
+import os
+
+# 結果キャッシュと音声の変換はベンチマークの計測対象から外す（環境変数で上書き可能）
+os.environ.setdefault('RESULT_CACHE_BACKEND', 'none')
+os.environ.setdefault('TRANSCODE_AUDIO', 'false')
+
+import argparse
+import contextlib
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import tracing
+from fakes import FaultProfile, install_fakes, make_wav
+from firestore_service import COLLECTION_NAME
+import main
+from main import summarize_monologue, RESULT_COMPLETED, RESULT_SKIPPED, RESULT_DEFERRED
+from workspace_service import WorkspaceManager, WorkspaceBudgetExceeded
+from trace_report import summarize_spans, print_summary
+
+BENCHMARK_BUCKET = 'benchmark-bucket'
+# 作業ディレクトリの予算を超えて後回しにされた配信の結果（再配信の対象）
+RESULT_RETRY = 'retry'
+
+def load_corpus(path, memos, duration_seconds):
+    """
+    再生するCloudEventのデータを読み込みます。ファイルを指定しない場合は合成します。
+
+    Args:
+        path (str): 1行1件のCloudEventのデータのJSONファイル
+        memos (int): 合成するイベント数
+        duration_seconds (float): 合成する音声の長さ（秒）
+
+    Returns:
+        list: (バケット名, ファイル名) のリスト
+    """
+    if path:
+        with open(path, encoding='utf-8') as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        return [(event.get('bucket', BENCHMARK_BUCKET), event['name']) for event in events]
+    return [(BENCHMARK_BUCKET, f"20250101{index:06d}_{index:08x}_ベンチマーク{index}.wav") for index in range(memos)]
+
+def _run_event(data):
+    """
+    1件のイベントをCloudEventトリガーと同じ入口から処理し、結果と所要時間を返します。
+    """
+    started_at = time.perf_counter()
+    try:
+        result = summarize_monologue(SimpleNamespace(data=data))
+    except WorkspaceBudgetExceeded:
+        # Functions Frameworkはエラーを返し、トリガーの再試行で再配信される
+        result = RESULT_RETRY
+    except Exception as e:
+        result = f"Error: {e}"
+    return data['name'], result, time.perf_counter() - started_at
+
+def _stage_records(records):
+    """
+    パイプラインの集計ログ（StageTimer.report）をステージごとのレコードに展開します。
+    最初の内容がNotionに書き込まれるまでの時間は pipeline.first_content として集計します。
+    """
+    for record in records:
+        if record.get('span') == 'pipeline':
+            for name, latency_ms in record.get('stages', {}).items():
+                yield {'span': f"stage.{name}", 'latency_ms': latency_ms, 'status': record['status']}
+            if record.get('first_content_ms') is not None:
+                yield {'span': 'pipeline.first_content', 'latency_ms': record['first_content_ms'], 'status': record['status']}
+
+def verify_deduplication(backends, objects, results):
+    """
+    重複配信の処理結果を検証します。
+
+    Args:
+        backends: install_fakesの戻り値
+        objects (list): 配置したイベントのデータ
+        results (list): (ファイル名, 結果, 所要時間) のリスト
+
+    Returns:
+        dict: 検証結果
+    """
+    titles = backends.notion.page_titles()
+    expected_titles = [os.path.splitext(data['name'])[0].split('_')[2] for data in objects]
+    duplicated_pages = sorted({title for title in titles if titles.count(title) > 1})
+    completed_names = {name for name, result, _ in results if result == RESULT_COMPLETED}
+    statuses = {}
+    for document in backends.firestore.documents(COLLECTION_NAME).values():
+        statuses[document['status']] = statuses.get(document['status'], 0) + 1
+
+    return {
+        'events': len(objects),
+        'pages_created': len(titles),
+        'duplicated_pages': duplicated_pages,
+        'missing_pages': sorted(set(expected_titles) - set(titles)),
+        # 完了が2回以上報告されたファイル（重複排除が正しければ0件）
+        'completed_more_than_once': sorted(name for name in completed_names if sum(1 for n, r, _ in results if n == name and r == RESULT_COMPLETED) > 1),
+        'firestore_statuses': statuses,
+        'gemini_files_left': len(backends.genai.files_alive),
+    }
+
+def _drain_batches(backends, batch_count, poll_interval=0.5):
+    """
+    バッチへの登録待ちのメモを1つのバッチジョブにまとめ、ジョブが終了するまでポーリングします。
+    """
+    import batch_service
+
+    # 配信が終わった時点で登録待ちのメモをすべて1つのジョブにまとめる
+    batch_service.BATCH_MIN_REQUESTS = batch_count
+    totals = {'completed': 0, 'failed': 0, 'jobs': 0, 'polls': 0}
+    while True:
+        summary = batch_service.poll_batches()
+        totals['polls'] += 1
+        totals['completed'] += summary['completed']
+        totals['failed'] += summary['failed']
+        totals['jobs'] += 1 if summary['submitted_job'] else 0
+        statuses = {document['status'] for document in backends.firestore.documents(COLLECTION_NAME).values()}
+        if not statuses & {'batch_pending', 'batch_submitting', 'batch_submitted'}:
+            break
+        time.sleep(poll_interval)
+    totals['batch_requests'] = sum(len(job.requests) for job in backends.genai.batches.jobs.values())
+    return totals
+
+def _deliver(executor, deliveries, retry_delay, max_rounds=100):
+    """
+    イベントを配信し、作業ディレクトリの予算を超えて後回しにされた配信を、すべて処理されるまで再配信します。
+
+    Returns:
+        tuple: (最終的な結果のリスト, 再配信した回数)
+    """
+    results = []
+    retried = 0
+    for _ in range(max_rounds):
+        round_results = list(executor.map(_run_event, deliveries))
+        results += [record for record in round_results if record[1] != RESULT_RETRY]
+        by_name = {data['name']: data for data in deliveries}
+        deliveries = [by_name[name] for name, result, _ in round_results if result == RESULT_RETRY]
+        if not deliveries:
+            break
+        retried += len(deliveries)
+        time.sleep(retry_delay)
+    results += [(data['name'], RESULT_RETRY, 0) for data in deliveries]
+    return results, retried
+
+def verify_workspace(manager):
+    """
+    作業ディレクトリの予約が予算を超えなかったこと、処理後に予約と作業ディレクトリが残っていないことを検証します。
+    """
+    stats = manager.stats()
+    leftover = os.listdir(manager.root) if os.path.isdir(manager.root) else []
+    stats['leftover_directories'] = len(leftover)
+    stats['ok'] = stats['peak_reserved_bytes'] <= stats['budget_bytes'] and stats['reserved_bytes'] == 0 and not leftover
+    return stats
+
+def _run_isolated(arguments, env=None):
+    """
+    ベンチマークを別のプロセスで実行し、結果（--json の出力）を返します。
+    最大RSSはプロセス全体の最大値のため、また環境変数で切り替える設定を変えるため、測定ごとにプロセスを分けます。
+    """
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--json'] + arguments,
+        capture_output=True, text=True, check=True, env=dict(os.environ, **(env or {})),
+    )
+    return json.loads(completed.stdout[completed.stdout.index('{'):completed.stdout.rindex('}') + 1])
+
+def run_size_sweep(args):
+    """
+    音声の長さ（ファイルサイズ）ごとに、ストリーミングと一時ファイル経由で1件ずつ処理し、メモリ使用量と処理時間を比較します。
+    Cloud Functionsの/tmpはメモリ上にあるため、一時ファイルの量（gcs.download のバイト数）もメモリ使用量に加えて比較します。
+
+    Args:
+        args (argparse.Namespace): コマンドライン引数
+
+    Returns:
+        dict: 音声の長さと方式ごとの計測結果
+    """
+    rows = []
+    for duration in args.sizes:
+        for mode in ('stream', 'download'):
+            report = _run_isolated([
+                '--memos', '1', '--duplicates', '1', '--workers', '1', '--duration', str(duration),
+                '--gcs-latency', str(args.gcs_latency), '--gemini-latency', str(args.gemini_latency),
+            ] + (['--download'] if mode == 'download' else []))
+            staged_mb = report['spans'].get('gcs.download', {}).get('bytes', 0) / 1024 / 1024
+            rows.append({
+                'duration_seconds': duration,
+                'file_mb': round(len(make_wav(duration)) / 1024 / 1024, 1),
+                'mode': mode,
+                'latency_ms': report['spans']['pipeline']['p50_ms'],
+                'max_rss_mb': report['max_rss_mb'],
+                'peak_traced_memory_mb': report['peak_traced_memory_mb'],
+                'staged_mb': round(staged_mb, 1),
+                # /tmp の一時ファイルはインスタンスのメモリを消費する
+                'effective_memory_mb': round(report['max_rss_mb'] + staged_mb, 1),
+            })
+
+    if args.json:
+        print(json.dumps({'size_sweep': rows}, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'duration_s':>10}{'file_mb':>9}  {'mode':<9}{'latency_ms':>11}{'max_rss_mb':>11}{'heap_mb':>9}{'tmp_mb':>8}{'rss+tmp_mb':>11}")
+        for row in rows:
+            print(f"{row['duration_seconds']:>10.0f}{row['file_mb']:>9.1f}  {row['mode']:<9}{row['latency_ms']:>11.0f}{row['max_rss_mb']:>11.1f}"
+                  f"{row['peak_traced_memory_mb']:>9.1f}{row['staged_mb']:>8.1f}{row['effective_memory_mb']:>11.1f}")
+        print("疑似GCSが音声全体をメモリ上に保持するため、最大RSSには両方式に共通してファイルサイズ分が含まれます")
+    return {'size_sweep': rows}
+
+# --suite markdown で生成するMarkdownの行（順に繰り返す）
+MARKDOWN_SAMPLE_LINES = (
+    '## 今日の振り返り',
+    '今日は **新しい機能** の設計を `notion_service.py` で進めた。[資料](https://example.com/design) も参照した。',
+    '- 午前は ~~会議~~ 資料作成、*集中できた*',
+    '- [ ] レビューの依頼を出す',
+    '- [x] テストを書く',
+    '1. 要件を整理する',
+    '> 小さく始めて、計測してから直す',
+    '---',
+    'あ' * 4500,
+)
+
+def _generate_markdown(lines):
+    """
+    --lines 行のMarkdownを MARKDOWN_SAMPLE_LINES を繰り返して生成します。
+    """
+    return '\n'.join(MARKDOWN_SAMPLE_LINES[i % len(MARKDOWN_SAMPLE_LINES)] for i in range(lines))
+
+def run_markdown_benchmark(args, repeat=5):
+    """
+    MarkdownからNotionブロックへの変換時間を、入力の行数ごとに計測します。
+
+    Args:
+        args (argparse.Namespace): コマンドライン引数
+        repeat (int): 計測の回数（最良値を採用する）
+
+    Returns:
+        dict: 行数ごとの計測結果
+    """
+    from notion_service import convert_markdown_to_notion_blocks
+
+    rows = []
+    for lines in args.lines:
+        markdown = _generate_markdown(lines)
+        timings = []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            blocks = convert_markdown_to_notion_blocks(markdown)
+            timings.append(time.perf_counter() - started_at)
+        best = min(timings)
+        rows.append({
+            'lines': lines,
+            'input_kb': round(len(markdown.encode('utf-8')) / 1024, 1),
+            'blocks': len(blocks),
+            'rich_text': sum(len(block[block['type']].get('rich_text', [])) for block in blocks),
+            'best_ms': round(best * 1000, 2),
+            'lines_per_second': round(lines / best) if best else None,
+        })
+
+    if args.json:
+        print(json.dumps({'markdown': rows}, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'lines':>8}{'input_kb':>10}{'blocks':>9}{'rich_text':>11}{'best_ms':>10}{'lines/s':>11}")
+        for row in rows:
+            print(f"{row['lines']:>8}{row['input_kb']:>10}{row['blocks']:>9}{row['rich_text']:>11}{row['best_ms']:>10}{row['lines_per_second']:>11}")
+    return {'markdown': rows}
+
+UPLOAD_FUNCTION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'upload-monologue', 'main.py')
+
+def _load_upload_function():
+    """
+    アップロード用の関数のモジュール（upload-monologue/main.py）を読み込みます（このディレクトリの main.py と名前が重なるため別名で読み込む）。
+    """
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('upload_monologue_main', UPLOAD_FUNCTION_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))] if values else 0.0
+
+def run_signed_url_benchmark(args):
+    """
+    署名付きURLの発行のレイテンシを、認証情報とクライアントをリクエストごとに作る場合（before）と再利用する場合（after）で比較します。
+    google.auth.default（メタデータサーバーへの問い合わせ）に --auth-latency 秒、トークンの更新に --token-latency 秒、
+    署名（IAMのsignBlob）に --gcs-latency 秒かかるものとします。
+
+    Args:
+        args (argparse.Namespace): コマンドライン引数
+
+    Returns:
+        dict: 方式ごとの計測結果
+    """
+    from unittest import mock
+    import flask
+    import google.auth
+    from fakes import FakeCredentials, FakeStorageClient
+
+    upload = _load_upload_function()
+    app = flask.Flask(__name__)
+    storage_profile = FaultProfile(args.gcs_latency, seed=args.seed)
+
+    def auth_default(*_args, **_kwargs):
+        time.sleep(args.auth_latency)
+        return FakeCredentials(args.token_latency), 'fake-project'
+
+    def storage_client(*_args, **_kwargs):
+        # 実際のクライアントも生成時に google.auth.default で認証情報を取得する
+        auth_default()
+        return FakeStorageClient(storage_profile)
+
+    def per_request_credentials():
+        # 変更前の実装: リクエストごとに認証情報を取得してトークンを更新する
+        credentials, _ = google.auth.default()
+        credentials.refresh(None)
+        return credentials
+
+    def send(payload):
+        started_at = time.perf_counter()
+        with app.test_request_context(method='POST', json=payload):
+            _, status, _ = upload.generate_signed_url(flask.request)
+        assert status == 200, status
+        return time.perf_counter() - started_at
+
+    def measure(payload):
+        with ThreadPoolExecutor(args.workers) as executor:
+            latencies = list(executor.map(lambda _: send(payload), range(args.requests)))
+        return {'p50_ms': round(_percentile(latencies, 50) * 1000, 1), 'p99_ms': round(_percentile(latencies, 99) * 1000, 1)}
+
+    single = {'title': 'memo', 'file_extension': 'm4a'}
+    batch = {'memos': [{'title': f"memo{i}", 'file_extension': 'm4a'} for i in range(args.batch_urls)]}
+    rows = []
+    with mock.patch.object(google.auth, 'default', auth_default), mock.patch.object(upload.storage, 'Client', storage_client):
+        with mock.patch.object(upload, 'get_credentials', per_request_credentials), \
+                mock.patch.object(upload, 'get_storage_client', lambda: upload.storage.Client()):
+            rows.append(dict(variant='before', **measure(single)))
+        rows.append(dict(variant='after', **measure(single)))
+        batch_result = measure(batch)
+        rows.append({'variant': f"after (memos={args.batch_urls})", 'p50_ms': batch_result['p50_ms'], 'p99_ms': batch_result['p99_ms'],
+                     'per_url_p50_ms': round(batch_result['p50_ms'] / args.batch_urls, 1)})
+        token_refreshes = upload._credentials.refreshes
+
+    if args.json:
+        print(json.dumps({'signed_url': rows, 'token_refreshes_after': token_refreshes}, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'variant':<18}{'p50_ms':>9}{'p99_ms':>9}{'per_url_ms':>12}")
+        for row in rows:
+            print(f"{row['variant']:<18}{row['p50_ms']:>9}{row['p99_ms']:>9}{row.get('per_url_p50_ms', row['p50_ms']):>12}")
+        print(f"再利用する場合のトークンの更新回数: {token_refreshes}回（{args.requests * 2}リクエスト）")
+    return {'signed_url': rows, 'token_refreshes_after': token_refreshes}
+
+def run_mode_comparison(args):
+    """
+    文字起こしと要約を1回のリクエストで行う場合（single）と、2段階で行う場合（two_step）の処理時間とトークン数を比較します。
+    疑似Geminiは文字起こしを含む応答に --transcription-latency 秒かかり、トークン数はリクエストと応答の文字数から求めます。
+
+    Args:
+        args (argparse.Namespace): コマンドライン引数
+
+    Returns:
+        dict: 方式ごとの計測結果
+    """
+    rows = []
+    for mode in ('single', 'two_step'):
+        report = _run_isolated([
+            '--memos', str(args.memos), '--duplicates', '1', '--workers', str(args.workers), '--duration', str(args.duration),
+            '--gemini-latency', str(args.gemini_latency), '--transcription-latency', str(args.transcription_latency),
+        ], env={'GEMINI_PIPELINE_MODE': mode})
+        pipeline = report['spans']['pipeline']
+        generate = report['spans'].get('gemini.generate_content', {})
+        memos = max(report['results']['completed'], 1)
+        rows.append({
+            'mode': mode,
+            'p50_ms': pipeline['p50_ms'],
+            'p90_ms': pipeline['p90_ms'],
+            'requests_per_memo': round(generate.get('count', 0) / memos, 2),
+            'prompt_tokens_per_memo': round(generate.get('prompt_token_count', 0) / memos),
+            'output_tokens_per_memo': round(generate.get('candidates_token_count', 0) / memos),
+            'total_tokens_per_memo': round(generate.get('total_token_count', 0) / memos),
+        })
+
+    if args.json:
+        print(json.dumps({'modes': rows}, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'mode':<10}{'p50_ms':>9}{'p90_ms':>9}{'requests':>10}{'prompt_tok':>12}{'output_tok':>12}{'total_tok':>11}  （1件あたり）")
+        for row in rows:
+            print(f"{row['mode']:<10}{row['p50_ms']:>9.0f}{row['p90_ms']:>9.0f}{row['requests_per_memo']:>10}"
+                  f"{row['prompt_tokens_per_memo']:>12}{row['output_tokens_per_memo']:>12}{row['total_tokens_per_memo']:>11}")
+        single, two_step = rows
+        if two_step['p50_ms']:
+            print(f"single は two_step に比べて p50 が {1 - single['p50_ms'] / two_step['p50_ms']:.0%} 短く、"
+                  f"トークン数は {single['total_tokens_per_memo'] / max(two_step['total_tokens_per_memo'], 1):.0%} です")
+    return {'modes': rows}
+
+def run_benchmark(args):
+    """
+    ベンチマークを実行し、結果を出力します。
+
+    Args:
+        args (argparse.Namespace): コマンドライン引数
+
+    Returns:
+        dict: 計測結果
+    """
+    if args.progressive:
+        import progressive_service
+        progressive_service.PROGRESSIVE_MODE = 'always'
+        if args.section_chars:
+            progressive_service.PROGRESSIVE_SECTION_CHARS = args.section_chars
+
+    backends = install_fakes(
+        gcs=FaultProfile(args.gcs_latency, error_rate=args.gcs_error_rate, seed=args.seed),
+        gemini=FaultProfile(args.gemini_latency, error_rate=args.gemini_error_rate, error_code=args.gemini_error_code, seed=args.seed),
+        firestore_profile=FaultProfile(args.firestore_latency, seed=args.seed),
+        notion=FaultProfile(args.notion_latency, error_rate=args.notion_error_rate, error_code=429, seed=args.seed),
+        notion_rate_limit=args.notion_rate_limit,
+        transcription_latency=args.transcription_latency,
+        batch_latency=args.batch_latency,
+    )
+    audio = make_wav(args.duration)
+    corpus = load_corpus(args.corpus, args.memos, args.duration)
+    batch_count = round(len(corpus) * args.batch_fraction)
+    objects = [
+        backends.storage.put_object(bucket, name, audio, metadata={'processing-mode': 'batch'} if index < batch_count else None)
+        for index, (bucket, name) in enumerate(corpus)
+    ]
+    # 同じイベントを連続して配信し、重複配信が同時に処理される状況を再現する
+    deliveries = [data for data in objects for _ in range(args.duplicates)]
+
+    trace_file = tempfile.NamedTemporaryFile(prefix='benchmark_trace_', suffix='.log', delete=False)
+    trace_file.close()
+    tracing.TRACE_LOG_PATH = trace_file.name
+
+    if args.download:
+        main.STREAM_INGEST = False
+    workspace_root = tempfile.mkdtemp(prefix='benchmark_workspace_')
+    main.workspace_manager = WorkspaceManager(
+        root=workspace_root,
+        budget_bytes=int(args.workspace_budget_mb * 1024 * 1024) if args.workspace_budget_mb else None,
+    )
+
+    if args.queue:
+        from queue_service import create_work_queue, set_work_queue
+        from worker import drain_queue
+        main.QUEUE_ENABLED = True
+        set_work_queue(create_work_queue(args.queue_backend))
+
+    print(f"イベント {len(objects)}件 × 配信 {args.duplicates}回 を並列数 {args.workers} で再生します" + ("（キュー経由）" if args.queue else ""))
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    log_output = open(os.devnull, 'w') if not args.verbose else None
+    with (contextlib.redirect_stdout(log_output) if log_output else contextlib.nullcontext()):
+        if args.queue:
+            # 配信（キューへの登録）はすべて同時に行い、処理はワーカーの並列数で制御する
+            with ThreadPoolExecutor(max_workers=max(args.workers, 32)) as executor:
+                list(executor.map(_run_event, deliveries))
+            queue_summary = drain_queue(concurrency=args.workers, batch_size=args.batch_size, max_seconds=float('inf'))
+        else:
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                results, retried = _deliver(executor, deliveries, args.retry_delay)
+        if batch_count:
+            batch_summary = _drain_batches(backends, batch_count)
+    elapsed = time.perf_counter() - started_at
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if log_output:
+        log_output.close()
+
+    with open(trace_file.name, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    os.remove(trace_file.name)
+    if args.queue:
+        # キュー経由の場合は、ワーカーが実行したパイプラインの結果を集計する
+        results = [(record['event_id'], record['result'], record['latency_ms'] / 1000) for record in records if record.get('span') == 'pipeline']
+
+    counts = {'completed': 0, 'skipped': 0, 'deferred': 0, 'failed': 0, 'retried': 0 if args.queue else retried}
+    for _, result, _ in results:
+        counts['completed' if result == RESULT_COMPLETED else 'skipped' if result == RESULT_SKIPPED else 'deferred' if result == RESULT_DEFERRED else 'failed'] += 1
+    if batch_count:
+        # バッチで処理したメモは、ポーリングで完了した件数を完了として数える
+        counts['completed'] += batch_summary['completed']
+        counts['failed'] += batch_summary['failed']
+
+    summary = summarize_spans(list(records) + list(_stage_records(records)))
+    dedupe = verify_deduplication(backends, objects, results)
+    workspace = verify_workspace(main.workspace_manager)
+    shutil.rmtree(workspace_root, ignore_errors=True)
+    report = {
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_per_minute': round(counts['completed'] / elapsed * 60, 2) if elapsed else 0,
+        'results': counts,
+        'peak_traced_memory_mb': round(peak_traced / 1024 / 1024, 2),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        'injected_errors': {
+            'gcs': backends.storage.profile.errors,
+            'gemini': backends.genai.profile.errors,
+            'notion': backends.notion.profile.errors,
+        },
+        'deduplication': dedupe,
+        'workspace': workspace,
+        'queue': queue_summary if args.queue else None,
+        'batch': batch_summary if batch_count else None,
+        'spans': summary,
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_summary(summary)
+        print(f"\n所要 {elapsed:.2f}秒, スループット {report['throughput_per_minute']} 件/分")
+        if 'pipeline.first_content' in summary:
+            first_content = summary['pipeline.first_content']
+            print(f"最初の内容がNotionに書き込まれるまで: p50 {first_content['p50_ms']:.0f} ms, p90 {first_content['p90_ms']:.0f} ms（逐次処理: {'有効' if args.progressive else '無効'}）")
+        print(f"結果: 完了 {counts['completed']}件, スキップ {counts['skipped']}件, バッチ処理に登録 {counts['deferred']}件, 失敗 {counts['failed']}件")
+        print(f"ピークメモリ: Pythonヒープ {report['peak_traced_memory_mb']} MB, 最大RSS {report['max_rss_mb']} MB")
+        print(f"注入したエラー: {report['injected_errors']}")
+        print(f"重複排除: {json.dumps(dedupe, ensure_ascii=False)}")
+        print(f"作業ディレクトリ: 予算 {workspace['budget_bytes'] / 1024 / 1024:.1f} MB, 予約の最大 {workspace['peak_reserved_bytes'] / 1024 / 1024:.1f} MB, "
+              f"予算超過で後回し {workspace['rejected']}回（再配信 {counts['retried']}件）, 残った作業ディレクトリ {workspace['leftover_directories']}件")
+        if args.queue:
+            wait_stats = summary.get('queue.wait', {})
+            print(f"キュー: 待ち時間 p50 {wait_stats.get('p50_ms', 0):.0f} ms, p90 {wait_stats.get('p90_ms', 0):.0f} ms, 処理結果 {queue_summary['outcomes']}, 処理後の深さ {queue_summary['queue_after']['depth']}")
+        if batch_count:
+            print(f"バッチ: ジョブ {batch_summary['jobs']}件, ポーリング {batch_summary['polls']}回, 完了 {batch_summary['completed']}件, 失敗 {batch_summary['failed']}件, "
+                  f"Geminiへのリクエスト（バッチ） {batch_summary['batch_requests']}件")
+    ok = not dedupe['duplicated_pages'] and not dedupe['completed_more_than_once']
+    print("重複排除の検証: " + ("OK" if ok else "NG（同じイベントが複数回処理されました）"))
+    print("作業ディレクトリの検証: " + ("OK" if workspace['ok'] else "NG（予約が予算を超えた、または作業ディレクトリが残っています）"))
+    report['deduplication_ok'] = ok
+    report['workspace_ok'] = workspace['ok']
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='疑似バックエンドに対してCloudEventを再生し、パイプラインの性能を計測します')
+    parser.add_argument('--suite', default='pipeline', choices=['pipeline', 'size-sweep', 'modes', 'markdown', 'signed-url'], help='実行するベンチマーク')
+    parser.add_argument('--sizes', type=lambda value: [float(size) for size in value.split(',')], default=[60, 600, 1800],
+                        help='--suite size-sweep で比較する音声の長さ（秒、カンマ区切り）')
+    parser.add_argument('--lines', type=lambda value: [int(lines) for lines in value.split(',')], default=[1000, 10000, 50000],
+                        help='--suite markdown で生成するMarkdownの行数（カンマ区切り）')
+    parser.add_argument('--requests', type=int, default=200, help='--suite signed-url で送るリクエスト数')
+    parser.add_argument('--batch-urls', type=int, default=10, help='--suite signed-url でまとめて発行する署名付きURLの数')
+    parser.add_argument('--auth-latency', type=float, default=0.05, help='--suite signed-url での google.auth.default のレイテンシ（秒）')
+    parser.add_argument('--token-latency', type=float, default=0.15, help='--suite signed-url でのアクセストークンの更新のレイテンシ（秒）')
+    parser.add_argument('--corpus', default=None, help='1行1件のCloudEventのデータ（JSON）のファイル。省略時は合成する')
+    parser.add_argument('--memos', type=int, default=20, help='合成するイベント数')
+    parser.add_argument('--duration', type=float, default=30, help='合成する音声の長さ（秒）')
+    parser.add_argument('--duplicates', type=int, default=2, help='同じイベントを配信する回数')
+    parser.add_argument('--workers', type=int, default=8, help='同時に処理するイベント数')
+    parser.add_argument('--queue', action='store_true', help='配信をキューに登録し、ワーカーで処理する（QUEUE_ENABLED=true）')
+    parser.add_argument('--queue-backend', default='memory', choices=['memory', 'sqlite'], help='--queue で使うキューの保存先')
+    parser.add_argument('--batch-size', type=int, default=10, help='--queue でワーカーが1回の取り出しで取得するジョブの最大数')
+    parser.add_argument('--batch-fraction', type=float, default=0.0, help='processing-mode=batch でアップロードするメモの割合')
+    parser.add_argument('--batch-latency', type=float, default=1.0, help='バッチジョブの作成から完了までの時間（秒）')
+    parser.add_argument('--download', action='store_true', help='ストリーミングせずに作業ディレクトリにダウンロードして処理する（STREAM_INGEST=false）')
+    parser.add_argument('--workspace-budget-mb', type=float, default=None, help='作業ディレクトリの予算（MB）。省略時はメモリの上限から求める')
+    parser.add_argument('--retry-delay', type=float, default=0.2, help='予算を超えて後回しにされた配信を再配信するまでの時間（秒）')
+    parser.add_argument('--gcs-latency', type=float, default=0.02, help='GCSの平均レイテンシ（秒）')
+    parser.add_argument('--gcs-error-rate', type=float, default=0.0, help='GCSのエラー率')
+    parser.add_argument('--gemini-latency', type=float, default=0.5, help='Geminiの平均レイテンシ（秒）')
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0, help='Geminiのエラー率')
+    parser.add_argument('--gemini-error-code', type=int, default=503, help='Geminiが返すエラーのステータスコード')
+    parser.add_argument('--transcription-latency', type=float, default=0.0, help='録音全体の文字起こしにかかる時間（秒）。Geminiのレイテンシに加算される')
+    parser.add_argument('--progressive', action='store_true', help='すべての録音を逐次処理（PROGRESSIVE_MODE=always）で処理する')
+    parser.add_argument('--section-chars', type=int, default=None, help='逐次処理で1回の要約にまとめる文字数（PROGRESSIVE_SECTION_CHARS）')
+    parser.add_argument('--firestore-latency', type=float, default=0.01, help='Firestoreの平均レイテンシ（秒）')
+    parser.add_argument('--notion-latency', type=float, default=0.1, help='Notionの平均レイテンシ（秒）')
+    parser.add_argument('--notion-error-rate', type=float, default=0.0, help='Notionが429を返す確率')
+    parser.add_argument('--notion-rate-limit', type=float, default=None, help='Notionクライアントのレート制限（リクエスト/秒）')
+    parser.add_argument('--seed', type=int, default=0, help='レイテンシとエラーの乱数のシード')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+    parser.add_argument('--verbose', action='store_true', help='パイプラインのログを表示する')
+    args = parser.parse_args()
+
+    if args.suite == 'size-sweep':
+        run_size_sweep(args)
+        raise SystemExit(0)
+    if args.suite == 'modes':
+        run_mode_comparison(args)
+        raise SystemExit(0)
+    if args.suite == 'markdown':
+        run_markdown_benchmark(args)
+        raise SystemExit(0)
+    if args.suite == 'signed-url':
+        run_signed_url_benchmark(args)
+        raise SystemExit(0)
+    report = run_benchmark(args)
+    raise SystemExit(0 if report['deduplication_ok'] and report['workspace_ok'] else 1)
@@ -0,0 +1,179 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from tracing import span
+
+# キャッシュの保存先（firestore / local / none）
+RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND', 'firestore')
+RESULT_CACHE_COLLECTION = os.environ.get('RESULT_CACHE_COLLECTION', 'monologue_result_cache')
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', '/tmp/monologue_result_cache')
+RESULT_CACHE_TTL_DAYS = int(os.environ.get('RESULT_CACHE_TTL_DAYS', 30))
+
+# キャッシュのヒット/ミス回数（インスタンス単位）。バックフィルや逐次処理のスレッドからも更新するため、ロックを取って更新する
+cache_stats = {'hit': 0, 'miss': 0}
+_cache_stats_lock = threading.Lock()
+
+def generate_cache_key(content_hash: str, model: str, prompt_version: str) -> str:
+    """
+    音声ファイルの内容ハッシュ、モデル、プロンプトのバージョンからキャッシュキーを生成
+
+    Args:
+        content_hash: GCSメタデータのMD5/CRC32C（例: "md5:xxxx"）
+        model: 使用するGeminiモデル名
+        prompt_version: プロンプトのバージョン
+
+    Returns:
+        str: キャッシュキー
+    """
+    content = f"{content_hash}|{model}|{prompt_version}"
+    return hashlib.sha256(content.encode()).hexdigest()
+
+class FirestoreResultCache:
+    """Firestoreのコレクションに結果を保存するキャッシュ"""
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+
+    @property
+    def collection(self):
+        # クライアントの生成（認証）は初回のキャッシュ参照まで遅らせる
+        from firestore_service import get_firestore_client
+        return get_firestore_client().collection(self.collection_name)
+
+    def get(self, key: str):
+        doc = self.collection.document(key).get()
+        if not doc.exists:
+            return None
+        entry = doc.to_dict()
+        # TTLポリシーによる削除は遅延することがあるため、有効期限をここでも確認する
+        if entry['expire_at'].replace(tzinfo=None) <= datetime.utcnow():
+            return None
+        return entry
+
+    def set(self, key: str, entry: dict):
+        self.collection.document(key).set(entry)
+
+class LocalFileResultCache:
+    """ローカルのディレクトリにJSONファイルとして結果を保存するキャッシュ（テスト用）"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            entry = json.load(f)
+        if datetime.fromisoformat(entry['expire_at']) <= datetime.utcnow():
+            os.remove(path)
+            return None
+        return entry
+
+    def set(self, key: str, entry: dict):
+        entry = dict(entry, created_at=entry['created_at'].isoformat(), expire_at=entry['expire_at'].isoformat())
+        with open(self._path(key), 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+
+def create_result_cache(backend: str = RESULT_CACHE_BACKEND):
+    """
+    設定に応じたキャッシュの実装を生成
+
+    Args:
+        backend: firestore / local / none
+
+    Returns:
+        キャッシュの実装。無効化されている場合はNone
+    """
+    if backend == 'firestore':
+        return FirestoreResultCache(RESULT_CACHE_COLLECTION)
+    if backend == 'local':
+        return LocalFileResultCache(RESULT_CACHE_DIR)
+    return None
+
+result_cache = create_result_cache()
+
+def set_result_cache(cache):
+    """
+    キャッシュの実装を差し替えます（テストやベンチマークで使用）。
+
+    Args:
+        cache: get/setを持つキャッシュの実装。Noneの場合はキャッシュを無効にします。
+    """
+    global result_cache
+    result_cache = cache
+
+def _count(outcome: str) -> dict:
+    """
+    キャッシュのヒット/ミス回数を数え、更新後の回数を返す
+    """
+    with _cache_stats_lock:
+        cache_stats[outcome] += 1
+        return dict(cache_stats)
+
+def get_cached_result(key: str):
+    """
+    キャッシュから文字起こしと要約の結果を取得
+
+    Args:
+        key: キャッシュキー
+
+    Returns:
+        dict: transcriptionとsummaryを含む辞書。キャッシュにない場合はNone
+    """
+    if result_cache is None:
+        return None
+
+    with span("cache.lookup") as s:
+        try:
+            entry = result_cache.get(key)
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"結果キャッシュ読み込みエラー: {e}")
+            entry = None
+        outcome = 'miss' if entry is None else 'hit'
+        stats = _count(outcome)
+        s.set(cache=outcome)
+
+    print(f"結果キャッシュ {'ヒット' if entry else 'ミス'}: キー={key} (hit={stats['hit']}, miss={stats['miss']})")
+    if entry is None:
+        return None
+    return {
+        'transcription': entry['transcription'],
+        'summary': json.loads(entry['summary']),
+    }
+
+def set_cached_result(key: str, transcription: str, summary: dict) -> bool:
+    """
+    文字起こしと要約の結果をキャッシュに保存し、TTL用の有効期限を設定
+
+    Args:
+        key: キャッシュキー
+        transcription: 文字起こし本文
+        summary: SummaryResponseの辞書
+
+    Returns:
+        bool: 保存に成功した場合True
+    """
+    if result_cache is None:
+        return False
+
+    try:
+        created_at = datetime.utcnow()
+        result_cache.set(key, {
+            'transcription': transcription,
+            'summary': json.dumps(summary, ensure_ascii=False),
+            'created_at': created_at,
+            'expire_at': created_at + timedelta(days=RESULT_CACHE_TTL_DAYS),  # TTL (Time-to-Live) ポリシー用のフィールド
+        })
+        print(f"結果キャッシュに保存: キー={key}")
+        return True
+    except Exception as e:
+        print(f"結果キャッシュ保存エラー: {e}")
+        return False
@@ -1,7 +1,54 @@
-from google.cloud import storage
 import os
+import threading
+import functools
+from tracing import span
 
-storage_client = storage.Client()
+# Cloud Storageクライアント（初回利用時に生成する。ベンチマークなどでは set_storage_client で差し替える）
+_storage_client = None
+_storage_client_lock = threading.Lock()
+
+# ストリーミング読み込み時のチャンクサイズ（256KBの倍数である必要がある）
+GCS_STREAM_CHUNK_SIZE = int(os.environ.get('GCS_STREAM_CHUNK_SIZE', 8 * 1024 * 1024))
+
+def get_storage_client():
+    """
+    Cloud Storageクライアントを取得します。初回のみ生成し、以降は再利用します。
+
+    Returns:
+        google.cloud.storage.Client: Cloud Storageクライアント
+    """
+    global _storage_client
+    if _storage_client is None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                # 読み込みに時間がかかるため、初回利用時まで遅らせる（コールドスタートの短縮）
+                from google.cloud import storage
+                _storage_client = storage.Client()
+    return _storage_client
+
+def set_storage_client(client):
+    """
+    Cloud Storageクライアントを差し替えます（疑似クライアントでのベンチマーク用）。
+
+    Args:
+        client: storage.Clientと同じインターフェースを持つクライアント。Noneの場合は次回利用時に再生成します
+    """
+    global _storage_client
+    _storage_client = client
+
+@functools.lru_cache(maxsize=None)
+def _get_stream_class():
+    """
+    GCSのオブジェクトをチャンク単位で読み込むバイナリストリームのクラスを返します。
+    Gemini Files API はバイナリモードのファイルオブジェクトを要求するため mode を明示します。
+    BlobReaderの読み込みを初回利用時まで遅らせるため、クラスは関数内で定義します。
+    """
+    from google.cloud.storage.fileio import BlobReader
+
+    class GcsAudioStream(BlobReader):
+        mode = 'rb'
+
+    return GcsAudioStream
 
 def download_file_from_gcs(bucket_name, file_name, local_file_path):
     """
@@ -15,15 +62,135 @@ def download_file_from_gcs(bucket_name, file_name, local_file_path):
     Returns:
         bool: ダウンロードが成功した場合はTrue、失敗した場合はFalse
     """
+    with span("gcs.download", file_name=file_name) as s:
+        try:
+            bucket = get_storage_client().bucket(bucket_name)
+            blob = bucket.blob(file_name)
+            blob.download_to_filename(local_file_path)
+            s.set(bytes=os.path.getsize(local_file_path))
+            print(f"GCSからファイル '{file_name}' を '{local_file_path}' にダウンロードしました。")
+            return True
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"GCSからのファイルダウンロード中にエラーが発生しました: {e}")
+            return False
+
+def open_gcs_file_stream(bucket_name, file_name, chunk_size=GCS_STREAM_CHUNK_SIZE):
+    """
+    GCSのファイルをローカルに保存せず、チャンク単位で読み込むストリームとして開きます。
+    メモリ上に保持されるのは最大でチャンク1つ分のみです。
+    
+    Args:
+        bucket_name (str): GCSバケット名
+        file_name (str): ファイル名
+        chunk_size (int): 1回のリクエストで読み込むバイト数
+        
+    Returns:
+        tuple: (ストリーム, Content-Type, ファイルサイズ)。失敗した場合はNone
+    """
     try:
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_name)
-        blob.download_to_filename(local_file_path)
-        print(f"GCSからファイル '{file_name}' を '{local_file_path}' にダウンロードしました。")
-        return True
+        bucket = get_storage_client().bucket(bucket_name)
+        blob = bucket.get_blob(file_name)
+        if blob is None:
+            print(f"GCSにファイル '{file_name}' が見つかりませんでした。")
+            return None
+        stream = _get_stream_class()(blob, chunk_size=chunk_size)
+        print(f"GCSのファイル '{file_name}' をストリームとして開きました（サイズ: {blob.size} bytes）。")
+        return stream, blob.content_type, blob.size
     except Exception as e:
-        print(f"GCSからのファイルダウンロード中にエラーが発生しました: {e}")
-        return False
+        print(f"GCSのファイルをストリームとして開く際にエラーが発生しました: {e}")
+        return None
+
+def read_gcs_file_header(bucket_name, file_name, num_bytes):
+    """
+    GCSのファイルの先頭部分だけを範囲指定で読み込みます。
+    
+    Args:
+        bucket_name (str): GCSバケット名
+        file_name (str): ファイル名
+        num_bytes (int): 読み込むバイト数
+        
+    Returns:
+        bytes: 読み込んだバイト列。失敗した場合はNone
+    """
+    with span("gcs.read_header", file_name=file_name) as s:
+        try:
+            bucket = get_storage_client().bucket(bucket_name)
+            blob = bucket.blob(file_name)
+            header = blob.download_as_bytes(start=0, end=num_bytes - 1)
+            s.set(bytes=len(header))
+            return header
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"GCSからのファイルヘッダー読み込み中にエラーが発生しました: {e}")
+            return None
+
+def upload_bytes_to_gcs(bucket_name, file_name, data, content_type='application/octet-stream'):
+    """
+    バイト列をGCSのファイルとして保存します。
+
+    Args:
+        bucket_name (str): GCSバケット名
+        file_name (str): ファイル名
+        data (bytes): 保存する内容
+        content_type (str): メディアタイプ
+
+    Returns:
+        bool: 保存が成功した場合はTrue、失敗した場合はFalse
+    """
+    with span("gcs.upload", file_name=file_name, bytes=len(data)) as s:
+        try:
+            get_storage_client().bucket(bucket_name).blob(file_name).upload_from_string(data, content_type=content_type)
+            return True
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"GCSへのファイル保存中にエラーが発生しました: {e}")
+            return False
+
+def download_bytes_from_gcs(bucket_name, file_name):
+    """
+    GCSのファイルの内容をバイト列として読み込みます（小さなファイル向け）。
+
+    Args:
+        bucket_name (str): GCSバケット名
+        file_name (str): ファイル名
+
+    Returns:
+        bytes: ファイルの内容。失敗した場合はNone
+    """
+    with span("gcs.download_bytes", file_name=file_name) as s:
+        try:
+            data = get_storage_client().bucket(bucket_name).blob(file_name).download_as_bytes()
+            s.set(bytes=len(data))
+            return data
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"GCSからのファイル読み込み中にエラーが発生しました: {e}")
+            return None
+
+def list_gcs_files(bucket_name, prefix=None):
+    """
+    GCSバケット内の指定したプレフィックスに一致するファイルを一覧で取得します。
+    
+    Args:
+        bucket_name (str): GCSバケット名
+        prefix (str): ファイル名のプレフィックス
+        
+    Returns:
+        list: CloudEventのデータと同じ形式の辞書のリスト
+    """
+    return [
+        {
+            "bucket": bucket_name,
+            "name": blob.name,
+            "size": blob.size,
+            "contentType": blob.content_type,
+            "md5Hash": blob.md5_hash,
+            "crc32c": blob.crc32c,
+            "metadata": blob.metadata or {},
+        }
+        for blob in get_storage_client().list_blobs(bucket_name, prefix=prefix)
+    ]
 
 def delete_file_from_gcs(bucket_name, file_name):
     """
@@ -36,12 +203,14 @@ def delete_file_from_gcs(bucket_name, file_name):
     Returns:
         bool: 削除が成功した場合はTrue、失敗した場合はFalse
     """
-    try:
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_name)
-        blob.delete()
-        print(f"GCSバケット '{bucket_name}' からファイル '{file_name}' を削除しました。")
-        return True
-    except Exception as e:
-        print(f"GCSからのファイル削除中にエラーが発生しました: {e}")
-        return False
\ No newline at end of file
+    with span("gcs.delete", file_name=file_name) as s:
+        try:
+            bucket = get_storage_client().bucket(bucket_name)
+            blob = bucket.blob(file_name)
+            blob.delete()
+            print(f"GCSバケット '{bucket_name}' からファイル '{file_name}' を削除しました。")
+            return True
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"GCSからのファイル削除中にエラーが発生しました: {e}")
+            return False
@@ -0,0 +1,257 @@
+"""
+アーカイブ（archive_service.py）したメモから、週次・月次のダイジェストを作成してNotionに送信する処理。
+
+期間内のメモの要約（markdown・nextActions・tags）を DIGEST_FANOUT 件ずつまとめて中間の要約を作り、
+それをさらにまとめていく木構造（map-reduce）で1つのダイジェストにします。
+中間の要約は子の内容のハッシュをキーに結果キャッシュ（cache_service.py）に保存するため、
+メモが追加されたときに作り直すのは、そのメモを含む枝（各階層の最後のまとまり）だけです。
+"""
+import os
+import json
+import hashlib
+import textwrap
+import contextvars
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from archive_service import read_archive, archive_day_prefix, ARCHIVE_BUCKET_NAME
+from cache_service import generate_cache_key, get_cached_result, set_cached_result
+from gemini_service import GeminiSession, model_router, SYSTEM_PREAMBLE, GEMINI_MAX_CONCURRENCY
+from tag_service import tag_vocabulary_prompt
+from tracing import span
+
+# 1つの中間の要約にまとめる要約の数
+DIGEST_FANOUT = int(os.environ.get('DIGEST_FANOUT', 8))
+# 作成したダイジェストを記録するコレクション（内容が変わらない場合に同じダイジェストを送信しないため）
+DIGEST_COLLECTION_NAME = os.environ.get('DIGEST_COLLECTION_NAME', 'monologue_digests')
+# ダイジェストのプロンプトのバージョン（変更した場合は中間の要約も作り直す）
+DIGEST_PROMPT_VERSION = '1'
+DIGEST_PERIODS = ('weekly', 'monthly')
+PERIOD_LABELS = {'weekly': '週次ダイジェスト', 'monthly': '月次ダイジェスト'}
+
+DIGEST_INSTRUCTION = textwrap.dedent("""
+    <goal>複数のボイスメモの要約を、期間の振り返りとして1つのメモにまとめてください。</goal>
+    <goal-detail>
+        <1>メモをまたいで繰り返し出てくる話題や、考えの変化が分かるように、話題ごとに見出し（###）を作ってください。</1>
+        <2>それぞれの話題がいつのメモで出てきたかが分かるよう、日付を残してください。</2>
+        <3>nextActionsは重複をまとめ、まだ重要と思われるものを最大5つ選んでください。</3>
+        <4>tagsは期間全体をよく表すものを最大3つ選んでください。</4>
+    </goal-detail>
+""")
+# 中間の要約（ダイジェストの一部）を作る場合と、最終的なダイジェストを作る場合のリクエスト
+PARTIAL_DIGEST_REQUEST = "上記のメモの要約を、後でほかの部分と合わせて振り返りにまとめるための中間のまとめにしてください。"
+FINAL_DIGEST_REQUEST = "上記のメモの要約を、「{label}」の振り返りとしてまとめてください。"
+
+def period_range(period, reference=None):
+    """
+    ダイジェストの対象期間を求めます。
+
+    Args:
+        period (str): weekly（月曜日から日曜日）または monthly
+        reference (date): 期間に含まれる日付。省略時は前日（定期実行で直前の期間を対象にする）
+
+    Returns:
+        tuple: (開始日, 終了日)。いずれも期間に含まれる
+    """
+    reference = reference or date.today() - timedelta(days=1)
+    if period == 'weekly':
+        start = reference - timedelta(days=reference.weekday())
+        return start, start + timedelta(days=6)
+    if period == 'monthly':
+        start = reference.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    raise ValueError(f"periodは{', '.join(DIGEST_PERIODS)}のいずれかを指定してください: {period}")
+
+def load_period_memos(start, end, bucket_name=None):
+    """
+    期間内にアーカイブされたメモを読み込みます。
+
+    メモはアーカイブされた順に並べます。新しいメモは常に末尾に加わるため、
+    木構造の各階層で作り直すのは最後のまとまりだけになります。
+
+    Args:
+        start (date): 開始日
+        end (date): 終了日
+        bucket_name (str): アーカイブのバケット
+
+    Returns:
+        list: アーカイブのレコードのリスト
+    """
+    from cloud_storage_service import list_gcs_files, download_bytes_from_gcs
+
+    bucket_name = bucket_name or ARCHIVE_BUCKET_NAME
+    if not bucket_name:
+        raise ValueError("ARCHIVE_BUCKET_NAME が設定されていません")
+    records = {}
+    day = start
+    while day <= end:
+        for file in list_gcs_files(bucket_name, archive_day_prefix(day)):
+            data = download_bytes_from_gcs(bucket_name, file['name'])
+            for record in read_archive(data) if data else []:
+                # 再処理されたメモは最後にアーカイブしたものを使う
+                if record['event_id'] not in records or record['archived_at'] > records[record['event_id']]['archived_at']:
+                    records[record['event_id']] = record
+        day += timedelta(days=1)
+    return sorted(records.values(), key=lambda record: record['archived_at'])
+
+def _hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def memo_leaf(record):
+    """
+    1件のメモの要約を、ダイジェストの入力となる葉に変換します。
+
+    Returns:
+        dict: 入力のテキスト（text）と、その内容のハッシュ（hash）
+    """
+    recorded_at = (record.get('recorded_at') or record['archived_at'])[:10]
+    text = (
+        f"<memo date=\"{recorded_at}\" title=\"{record.get('title', '')}\">\n"
+        f"{record.get('markdown', '').strip()}\n"
+        f"NextActions: {' / '.join(record.get('nextActions', []))}\n"
+        f"Tags: {', '.join(record.get('tags', []))}\n"
+        "</memo>"
+    )
+    return {'text': text, 'hash': _hash(text)}
+
+def _summary_text(summary):
+    """
+    中間の要約を、上の階層の入力となるテキストに変換します。
+    """
+    return (
+        "<partial-digest>\n"
+        f"{summary['markdown'].strip()}\n"
+        f"NextActions: {' / '.join(summary.get('nextActions', []))}\n"
+        f"Tags: {', '.join(summary.get('tags', []))}\n"
+        "</partial-digest>"
+    )
+
+class DigestBuilder:
+    """
+    メモの要約を木構造でまとめ、ダイジェストを作成する。キャッシュのヒット数とGeminiの呼び出し数を記録する。
+    """
+
+    def __init__(self, label, fanout=DIGEST_FANOUT):
+        self.label = label
+        self.fanout = max(fanout, 2)
+        self.stats = {'nodes': 0, 'cached': 0, 'generated': 0}
+
+    def _reduce(self, children, final):
+        """
+        子（葉または中間の要約）をまとめて1つの要約にします。キャッシュにあればGeminiを呼び出しません。
+
+        Args:
+            children (list): 子のリスト（text と hash を持つ辞書）
+            final (bool): 最終的なダイジェストの場合True
+
+        Returns:
+            dict: 要約（SummaryResponseの辞書）・その内容のハッシュ・キャッシュから取得したか
+        """
+        from schema import SummaryResponse
+
+        request = FINAL_DIGEST_REQUEST.format(label=self.label) if final else PARTIAL_DIGEST_REQUEST
+        content_hash = "digest:" + _hash("|".join([request] + [child['hash'] for child in children]))
+        key = generate_cache_key(content_hash, model_router.signature(), DIGEST_PROMPT_VERSION)
+        with span("digest.reduce", children=len(children), final=final) as s:
+            cached = get_cached_result(key)
+            if cached is not None:
+                summary = cached['summary']
+            else:
+                with GeminiSession() as session:
+                    response = session.generate(
+                        "digest",
+                        contents=["\n\n".join(child['text'] for child in children), request],
+                        config={
+                            'system_instruction': SYSTEM_PREAMBLE + DIGEST_INSTRUCTION + tag_vocabulary_prompt(),
+                            'response_mime_type': 'application/json',
+                            'response_schema': SummaryResponse,
+                        },
+                    )
+                summary = json.loads(response.parsed.model_dump_json())
+                set_cached_result(key, "", summary)
+            s.set(cached=cached is not None)
+        return {'summary': summary, 'text': _summary_text(summary), 'hash': key, 'cached': cached is not None}
+
+    def build(self, records):
+        """
+        メモのレコードからダイジェストを作成します。同じ階層のまとまりは並行して要約します。
+
+        Args:
+            records (list): アーカイブのレコード（アーカイブされた順）
+
+        Returns:
+            dict: ダイジェスト（SummaryResponseの辞書）と、その内容のハッシュ（hash）
+        """
+        level = [memo_leaf(record) for record in records]
+        depth = 0
+        with ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY) as executor:
+            while True:
+                final = len(level) <= self.fanout
+                groups = [level[index:index + self.fanout] for index in range(0, len(level), self.fanout)]
+                level = list(executor.map(
+                    lambda group: contextvars.copy_context().run(self._reduce, group, final),
+                    groups,
+                ))
+                depth += 1
+                cached = sum(node['cached'] for node in level)
+                self.stats['nodes'] += len(level)
+                self.stats['cached'] += cached
+                self.stats['generated'] += len(level) - cached
+                if final:
+                    break
+        self.stats['depth'] = depth
+        return dict(level[0]['summary'], hash=level[0]['hash'])
+
+def digest_file_name(label, end):
+    """
+    Notionのページのタイトルとして使うファイル名（{タイムスタンプ}_{ID}_{タイトル}）を返します。
+    """
+    return f"{end:%Y%m%d}235959_digest_{label}.md"
+
+def generate_digest(period='weekly', reference=None, force=False):
+    """
+    期間内のメモのダイジェストを作成し、Notionに送信します。
+    前回と同じメモから作成した（内容が変わらない）ダイジェストは送信せず、内容が変わった場合は前回のページをアーカイブします。
+
+    Args:
+        period (str): weekly または monthly
+        reference (date): 期間に含まれる日付。省略時は前日
+        force (bool): 内容が変わらない場合も送信する
+
+    Returns:
+        dict: 処理結果（期間・メモ数・キャッシュのヒット数・Geminiの呼び出し数・送信したか）
+    """
+    from firestore_service import get_firestore_client
+    from notion_service import send_to_notion, format_next_actions, archive_page
+
+    start, end = period_range(period, reference)
+    label = f"{PERIOD_LABELS[period]} {start.isoformat()}〜{end.isoformat()}"
+    result = {'period': period, 'start': start.isoformat(), 'end': end.isoformat(), 'memos': 0, 'sent': False}
+    with span("digest.generate", period=period) as s:
+        records = load_period_memos(start, end)
+        result['memos'] = len(records)
+        if not records:
+            print(f"{label}: 対象のメモがないため、ダイジェストを作成しません")
+            return result
+
+        builder = DigestBuilder(label)
+        digest = builder.build(records)
+        result.update(builder.stats)
+        s.set(memos=len(records), **builder.stats)
+
+        doc_ref = get_firestore_client().collection(DIGEST_COLLECTION_NAME).document(f"{period}_{start.isoformat()}")
+        previous = doc_ref.get()
+        if not force and previous.exists and previous.get('digest_hash') == digest['hash']:
+            print(f"{label}: 前回から内容が変わっていないため、送信しません")
+            return result
+
+        page_id = send_to_notion(digest_file_name(label, end), digest['markdown'], format_next_actions(digest['nextActions']), digest['tags'])
+        if not page_id:
+            raise RuntimeError("ダイジェストのNotionへの送信中にエラーが発生しました")
+        # 同じ期間の古いダイジェスト（メモが追加される前のもの）はアーカイブし、最新のものだけを残す
+        if previous.exists and previous.get('page_id'):
+            archive_page(previous.get('page_id'))
+        doc_ref.set({'digest_hash': digest['hash'], 'page_id': page_id, 'memos': len(records), 'label': label, 'sent_at': datetime.utcnow()})
+        result['sent'] = True
+    print(f"{label}: ダイジェストを送信しました（メモ {len(records)}件, 中間の要約 {builder.stats['nodes']}件のうちキャッシュ {builder.stats['cached']}件）")
+    return result
@@ -0,0 +1,993 @@
+"""
+ベンチマーク・動作確認用の疑似バックエンド（GCS・Gemini・Firestore・Notion）。
+実際のAPIを呼び出さずにプロセス内で動作し、レイテンシとエラーを注入できます。
+
+    from fakes import install_fakes, FaultProfile
+    backends = install_fakes(gcs=FaultProfile(0.05), gemini=FaultProfile(2.0, error_rate=0.05))
+"""
+import json
+import uuid
+import time
+import random
+import threading
+import hashlib
+import base64
+import struct
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from google.cloud import firestore
+
+class InjectedError(Exception):
+    """
+    疑似バックエンドが注入したエラー。HTTPのステータスコードに相当するcodeを持つ。
+    """
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+class FaultProfile:
+    """
+    疑似バックエンドの呼び出しごとのレイテンシとエラー率。
+    """
+
+    def __init__(self, latency=0.0, jitter=0.25, error_rate=0.0, error_code=503, seed=None):
+        """
+        Args:
+            latency (float): 1回の呼び出しの平均レイテンシ（秒）
+            jitter (float): レイテンシのばらつき（平均に対する割合）
+            error_rate (float): エラーを返す確率（0〜1）
+            error_code (int): 注入するエラーのステータスコード
+            seed (int): 乱数のシード
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def apply(self, operation):
+        """
+        レイテンシ分だけ待機し、エラー率に応じてInjectedErrorを送出する。
+
+        Args:
+            operation (str): 呼び出しの名前（エラーメッセージに使用）
+        """
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.latency * (1 + self.random.uniform(-self.jitter, self.jitter)))
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise InjectedError(self.error_code, f"injected failure: {operation}")
+
+def make_wav(duration_seconds, sample_rate=16000):
+    """
+    指定した長さの無音のWAV（モノラル・16bit）を生成する。
+
+    Args:
+        duration_seconds (float): 再生時間（秒）
+        sample_rate (int): サンプリングレート
+
+    Returns:
+        bytes: WAVファイルの内容
+    """
+    data_size = int(duration_seconds * sample_rate) * 2
+    header = b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE'
+    header += b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+    header += b'data' + struct.pack('<I', data_size)
+    return header + bytes(data_size)
+
+# ---- GCS
+
+class FakeBlob:
+    """
+    storage.Blobの疑似実装。内容はバケット（メモリ上の辞書）に保持する。
+    """
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def _object(self):
+        with self.bucket.client.lock:
+            entry = self.bucket.objects.get(self.name)
+        if entry is None:
+            raise FileNotFoundError(f"404 No such object: {self.bucket.name}/{self.name}")
+        return entry
+
+    @property
+    def size(self):
+        return len(self._object['data'])
+
+    @property
+    def content_type(self):
+        return self._object['content_type']
+
+    @property
+    def md5_hash(self):
+        return base64.b64encode(hashlib.md5(self._object['data']).digest()).decode()
+
+    @property
+    def crc32c(self):
+        return None
+
+    @property
+    def metadata(self):
+        return self._object['metadata']
+
+    def reload(self, **kwargs):
+        self._object
+
+    def exists(self, **kwargs):
+        with self.bucket.client.lock:
+            return self.name in self.bucket.objects
+
+    def download_as_bytes(self, start=None, end=None, **kwargs):
+        self.bucket.client.profile.apply('gcs.download_as_bytes')
+        data = self._object['data']
+        return data[start or 0:None if end is None else end + 1]
+
+    def download_to_filename(self, filename, **kwargs):
+        # 実際のクライアントと同じく、全体をメモリに読み込まずにチャンク単位で書き込む
+        self.bucket.client.profile.apply('gcs.download_to_filename')
+        data = memoryview(self._object['data'])
+        with open(filename, 'wb') as f:
+            for start in range(0, len(data), 8 * 1024 * 1024):
+                f.write(data[start:start + 8 * 1024 * 1024])
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self.bucket.client.profile.apply('gcs.upload')
+        if isinstance(data, str):
+            data = data.encode()
+        with self.bucket.client.lock:
+            self.bucket.objects[self.name] = {'data': data, 'content_type': content_type, 'metadata': {}}
+
+    def generate_signed_url(self, version=None, expiration=None, method='GET', content_type=None, headers=None, **kwargs):
+        # access_token を指定した場合、実際のクライアントはIAMのsignBlob APIで署名する（その往復をレイテンシとして注入する）
+        self.bucket.client.profile.apply('gcs.sign_blob')
+        return f"https://storage.googleapis.invalid/{self.bucket.name}/{self.name}?X-Goog-Signature={uuid.uuid4().hex}"
+
+    def delete(self, **kwargs):
+        self.bucket.client.profile.apply('gcs.delete')
+        with self.bucket.client.lock:
+            if self.bucket.objects.pop(self.name, None) is None:
+                raise FileNotFoundError(f"404 No such object: {self.bucket.name}/{self.name}")
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.objects = client.buckets.setdefault(name, {})
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name, **kwargs):
+        blob = FakeBlob(self, name)
+        return blob if blob.exists() else None
+
+class FakeStorageClient:
+    """
+    storage.Clientの疑似実装。
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile or FaultProfile()
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket_name, prefix=None, **kwargs):
+        bucket = self.bucket(bucket_name)
+        with self.lock:
+            names = sorted(name for name in bucket.objects if not prefix or name.startswith(prefix))
+        return [FakeBlob(bucket, name) for name in names]
+
+    def put_object(self, bucket_name, name, data, content_type='audio/wav', metadata=None):
+        """
+        オブジェクトを配置し、CloudEventのデータと同じ形式の辞書を返す。
+        """
+        with self.lock:
+            self.buckets.setdefault(bucket_name, {})[name] = {'data': data, 'content_type': content_type, 'metadata': metadata or {}}
+        blob = FakeBlob(self.bucket(bucket_name), name)
+        return {
+            'bucket': bucket_name,
+            'name': name,
+            'size': blob.size,
+            'contentType': content_type,
+            'md5Hash': blob.md5_hash,
+            'metadata': blob.metadata,
+        }
+
+class FakeGcsServer:
+    """
+    GCSのJSON APIの再開可能なアップロード（uploadType=resumable）を受け付ける疑似サーバー（fake-gcs-server の代わり）。
+    storage.Client の api_endpoint に url を指定すると、create_resumable_upload_session がこのサーバーにセッションを作成する。
+    セッションURLへの Content-Range 付きのPUTでチャンクを受け取り、途中の場合は308と受信済みの範囲（Range）を返す。
+    interrupt_next_chunk で、次のチャンクの途中で通信が切れた状態（一部だけ受信して503）を再現できる。
+
+        with FakeGcsServer() as server:
+            client = storage.Client(project='fake', credentials=AnonymousCredentials(), client_options={'api_endpoint': server.url})
+    """
+
+    # 最後以外のチャンクの大きさはこの倍数である必要がある
+    CHUNK_MULTIPLE = 256 * 1024
+
+    def __init__(self):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        from urllib.parse import urlsplit, parse_qs
+
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.objects = {}
+        self.interruptions = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, body=None, headers=None):
+                payload = json.dumps(body).encode() if body is not None else b''
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                parts = url.path.split('/')
+                if query.get('uploadType') != ['resumable'] or parts[1:4] != ['upload', 'storage', 'v1']:
+                    return self._reply(400, {'error': f"unsupported: POST {self.path}"})
+                resource = json.loads(self._body() or b'{}')
+                upload_id = server._start_session(
+                    bucket=parts[5], name=resource.get('name') or query.get('name', [None])[0],
+                    content_type=self.headers.get('X-Upload-Content-Type') or resource.get('contentType'),
+                    metadata=resource.get('metadata') or {}, origin=self.headers.get('Origin'),
+                )
+                self._reply(200, {}, {'Location': f"{server.url}{url.path}?uploadType=resumable&upload_id={upload_id}"})
+
+            def do_PUT(self):
+                upload_id = parse_qs(urlsplit(self.path).query).get('upload_id', [None])[0]
+                status, body, headers = server._put_chunk(upload_id, self.headers.get('Content-Range'), self._body())
+                self._reply(status, body, headers)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def _start_session(self, bucket, name, content_type, metadata, origin):
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[upload_id] = {
+                'bucket': bucket, 'name': name, 'content_type': content_type or 'application/octet-stream',
+                'metadata': metadata, 'origin': origin, 'data': bytearray(), 'interrupt': False,
+            }
+        return upload_id
+
+    def _put_chunk(self, upload_id, content_range, data):
+        """
+        Content-Range（"bytes 0-262143/*"・"bytes 262144-300000/300001"・"bytes */300001"）に従ってチャンクを受け取る。
+        """
+        with self.lock:
+            session = self.sessions.get(upload_id)
+            if session is None:
+                return 404, {'error': 'upload session not found'}, None
+            if session.get('object'):
+                return 200, session['object'], None
+            spec = (content_range or '').replace('bytes ', '', 1)
+            span_spec, _, total = spec.partition('/')
+            total = None if total in ('', '*') else int(total)
+            received = session['data']
+            if span_spec != '*':
+                start, end = (int(value) for value in span_spec.split('-'))
+                if start != len(received) or end - start + 1 != len(data):
+                    return 400, {'error': f"unexpected range {content_range} (received {len(received)} bytes)"}, None
+                is_last = total is not None and end + 1 == total
+                if not is_last and len(data) % self.CHUNK_MULTIPLE:
+                    return 400, {'error': f"chunk size must be a multiple of {self.CHUNK_MULTIPLE}"}, None
+                if session['interrupt']:
+                    # 通信が途中で切れた場合と同じく、チャンクの一部（GCSと同じく256KiBの倍数）だけを受け取って失敗を返す
+                    session['interrupt'] = False
+                    self.interruptions += 1
+                    received.extend(data[:len(data) // 2 // self.CHUNK_MULTIPLE * self.CHUNK_MULTIPLE])
+                    return 503, {'error': 'connection interrupted'}, None
+                received.extend(data)
+            if total is not None and len(received) == total:
+                session['object'] = {
+                    'bucket': session['bucket'], 'name': session['name'], 'size': str(total),
+                    'contentType': session['content_type'], 'metadata': session['metadata'],
+                }
+                self.objects[(session['bucket'], session['name'])] = dict(session['object'], data=bytes(received))
+                return 200, session['object'], None
+            return 308, None, {'Range': f"bytes=0-{len(received) - 1}"} if received else None
+
+    def interrupt_next_chunk(self):
+        """
+        すべてのセッションで、次に受け取るチャンクの途中で通信が切れた状態にする。
+        """
+        with self.lock:
+            for session in self.sessions.values():
+                session['interrupt'] = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FakeCredentials:
+    """
+    google.auth の認証情報の疑似実装。refresh でアクセストークンの取得にかかる時間だけ待機する。
+    """
+
+    def __init__(self, refresh_latency=0.0, lifetime_seconds=3600):
+        self.refresh_latency = refresh_latency
+        self.lifetime_seconds = lifetime_seconds
+        self.service_account_email = 'fake-uploader@fake-project.iam.gserviceaccount.com'
+        self.token = None
+        self.expiry = None
+        self.lock = threading.Lock()
+        self.refreshes = 0
+
+    def refresh(self, request):
+        time.sleep(self.refresh_latency)
+        with self.lock:
+            self.refreshes += 1
+            self.token = uuid.uuid4().hex
+            self.expiry = datetime.utcnow() + timedelta(seconds=self.lifetime_seconds)
+
+# ---- Gemini
+
+class _FakeFiles:
+    def __init__(self, client):
+        self.client = client
+
+    def upload(self, file=None, config=None, **kwargs):
+        self.client.profile.apply('files.upload')
+        # ストリームの場合は実際のアップロードと同じくチャンク単位で読み切る
+        size = 0
+        if isinstance(file, str):
+            with open(file, 'rb') as f:
+                while chunk := f.read(8 * 1024 * 1024):
+                    size += len(chunk)
+        else:
+            while chunk := file.read(8 * 1024 * 1024):
+                size += len(chunk)
+        mime_type = (config or {}).get('mime_type', 'audio/wav')
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        uploaded = SimpleNamespace(name=name, size_bytes=size, mime_type=mime_type, uri=f"https://fake-gemini.invalid/v1beta/{name}")
+        with self.client.lock:
+            self.client.files_alive.add(uploaded.name)
+            self.client.uploaded_bytes += size
+        return uploaded
+
+    def delete(self, name=None, **kwargs):
+        with self.client.lock:
+            self.client.files_alive.discard(name)
+
+class _FakeCaches:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model=None, config=None, **kwargs):
+        self.client.profile.apply('caches.create')
+        return SimpleNamespace(name=f"cachedContents/{uuid.uuid4().hex[:12]}", model=model)
+
+    def delete(self, name=None, **kwargs):
+        pass
+
+class _FakeModels:
+    def __init__(self, client):
+        self.client = client
+
+    def _fake_value(self, field_name, annotation):
+        if getattr(annotation, '__origin__', None) is list:
+            return [f"{field_name} {i + 1}" for i in range(2)]
+        if field_name == 'markdown':
+            return "# 疑似要約\n\n## ポイント\n- 疑似レスポンスの本文です。\n"
+        if field_name == 'transcription':
+            return self.client.transcript()
+        return f"これは{field_name}の疑似レスポンスです。" * 20
+
+    def generate_content(self, model=None, contents=None, config=None, **kwargs):
+        self.client.profile.apply('models.generate_content')
+        schema = (config or {}).get('response_schema')
+        values = {}
+        if schema is not None:
+            values = {name: self._fake_value(name, field.annotation) for name, field in schema.model_fields.items()}
+            # 文字起こしを含む応答は、録音全体の文字起こしにかかる時間だけ待つ
+            if 'transcription' in values:
+                time.sleep(self.client.transcription_latency)
+        parsed = schema(**values) if schema is not None else None
+        text = json.dumps(values, ensure_ascii=False)
+        prompt_tokens = sum(len(str(content)) for content in (contents if isinstance(contents, list) else [contents])) // 4
+        with self.client.lock:
+            self.client.requests.append(model)
+        return SimpleNamespace(
+            parsed=parsed,
+            text=text,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                cached_content_token_count=None,
+                candidates_token_count=len(text) // 4,
+                total_token_count=prompt_tokens + len(text) // 4,
+            ),
+        )
+
+    def embed_content(self, model=None, contents=None, config=None, **kwargs):
+        """
+        文字の3-gramをハッシュして次元に割り当てた疑似的な埋め込みを返す（同じ語句を含む文ほど類似度が高くなる）。
+        """
+        self.client.profile.apply('models.embed_content')
+        dimensions = (config or {}).get('output_dimensionality') or 64
+        embeddings = []
+        for text in (contents if isinstance(contents, list) else [contents]):
+            values = [0.0] * dimensions
+            for start in range(max(len(text) - 2, 1)):
+                digest = hashlib.md5(text[start:start + 3].encode()).digest()
+                values[int.from_bytes(digest[:4], 'little') % dimensions] += 1.0
+            embeddings.append(SimpleNamespace(values=values))
+        return SimpleNamespace(embeddings=embeddings)
+
+    def generate_content_stream(self, model=None, contents=None, config=None, **kwargs):
+        # 実際のAPIと同じく、エラーは最初のチャンクを受け取るときに送出する
+        def stream():
+            self.client.profile.apply('models.generate_content_stream')
+            with self.client.lock:
+                self.client.requests.append(model)
+            chunk_latency = self.client.transcription_latency / self.client.stream_chunks
+            for index in range(self.client.stream_chunks):
+                time.sleep(chunk_latency)
+                text = self.client.transcript_chunk(index)
+                last = index == self.client.stream_chunks - 1
+                yield SimpleNamespace(
+                    text=text,
+                    usage_metadata=SimpleNamespace(
+                        prompt_token_count=1000,
+                        cached_content_token_count=None,
+                        candidates_token_count=len(text) // 4 * (index + 1),
+                        total_token_count=1000 + len(text) // 4 * (index + 1),
+                    ) if last else None,
+                )
+        return stream()
+
+class _FakeBatches:
+    """
+    バッチAPIの疑似実装。ジョブは作成から batch_latency 秒後に完了し、各リクエストを generate_content で処理した結果を返す。
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.jobs = {}
+
+    def create(self, model=None, src=None, config=None, **kwargs):
+        self.client.profile.apply('batches.create')
+        job = SimpleNamespace(
+            name=f"batches/{uuid.uuid4().hex[:12]}", model=model, requests=list(src),
+            created_at=time.monotonic(), state=SimpleNamespace(name='JOB_STATE_PENDING'), dest=None,
+        )
+        with self.client.lock:
+            self.jobs[job.name] = job
+        return job
+
+    def finish(self, name, state):
+        """
+        ジョブを結果なしで終了させる（失敗・期限切れ・取り消しを再現する）。
+        """
+        job = self.jobs[name]
+        job.dest = SimpleNamespace(inlined_responses=[])
+        job.state = SimpleNamespace(name=state)
+
+    def get(self, name=None, **kwargs):
+        self.client.profile.apply('batches.get')
+        job = self.jobs[name]
+        if job.dest is None and time.monotonic() - job.created_at >= self.client.batch_latency:
+            responses = []
+            for request in job.requests:
+                response = self.client.models.generate_content(model=job.model, contents=request['contents'], config=request['config'])
+                responses.append(SimpleNamespace(response=response, error=None, metadata=request.get('metadata')))
+            job.dest = SimpleNamespace(inlined_responses=responses)
+            job.state = SimpleNamespace(name='JOB_STATE_SUCCEEDED')
+        elif job.dest is None:
+            job.state = SimpleNamespace(name='JOB_STATE_RUNNING')
+        return job
+
+class FakeGenaiClient:
+    """
+    genai.Clientの疑似実装。response_schemaのフィールドを埋めた疑似レスポンスを返す。
+    文字起こしは transcription_latency 秒かけて生成され、ストリーミングでは stream_chunks 回に分けて返す。
+    バッチジョブは batch_latency 秒後に完了する。
+    """
+
+    def __init__(self, profile=None, transcription_latency=0.0, stream_chunks=20, stream_chunk_chars=400, batch_latency=0.0):
+        self.profile = profile or FaultProfile()
+        self.transcription_latency = transcription_latency
+        self.stream_chunks = stream_chunks
+        self.stream_chunk_chars = stream_chunk_chars
+        self.batch_latency = batch_latency
+        self.lock = threading.Lock()
+        self.files_alive = set()
+        self.uploaded_bytes = 0
+        self.requests = []
+        self.files = _FakeFiles(self)
+        self.caches = _FakeCaches(self)
+        self.models = _FakeModels(self)
+        self.batches = _FakeBatches(self)
+
+    def transcript_chunk(self, index):
+        """
+        疑似的な文字起こしの index 番目の断片を返す（文の区切りを含む）。
+        """
+        sentence = f"これは{index + 1}番目の疑似的な文字起こしです。"
+        return (sentence * (self.stream_chunk_chars // len(sentence) + 1))[:self.stream_chunk_chars]
+
+    def transcript(self):
+        """
+        疑似的な文字起こし全体を返す（ストリーミングで返す断片を連結したもの）。
+        """
+        return "".join(self.transcript_chunk(index) for index in range(self.stream_chunks))
+
+# ---- Firestore
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data, reference=None):
+        self.id = doc_id
+        self._data = data
+        self.reference = reference
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data is not None else None
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    @property
+    def _store(self):
+        return self.collection.client.store
+
+    def get(self, transaction=None, **kwargs):
+        self.collection.client.profile.apply('firestore.get')
+        with self.collection.client.lock:
+            data = self._store.get((self.collection.name, self.id))
+        return FakeSnapshot(self.id, dict(data) if data is not None else None, self)
+
+    def _apply_set(self, data):
+        self._store[(self.collection.name, self.id)] = dict(data)
+
+    def _apply_update(self, data):
+        key = (self.collection.name, self.id)
+        if key not in self._store:
+            raise KeyError(f"404 No document to update: {self.collection.name}/{self.id}")
+        document = self._store[key]
+        for field, value in data.items():
+            if value is firestore.DELETE_FIELD:
+                document.pop(field, None)
+            else:
+                document[field] = value
+
+    def create(self, data, **kwargs):
+        from google.api_core.exceptions import AlreadyExists
+
+        self.collection.client.profile.apply('firestore.set')
+        with self.collection.client.lock:
+            if (self.collection.name, self.id) in self._store:
+                raise AlreadyExists(f"Document already exists: {self.collection.name}/{self.id}")
+            self._apply_set(data)
+
+    def set(self, data, **kwargs):
+        self.collection.client.profile.apply('firestore.set')
+        with self.collection.client.lock:
+            self._apply_set(data)
+
+    def update(self, data, **kwargs):
+        self.collection.client.profile.apply('firestore.update')
+        with self.collection.client.lock:
+            self._apply_update(data)
+
+    def delete(self, **kwargs):
+        with self.collection.client.lock:
+            self._store.pop((self.collection.name, self.id), None)
+
+class FakeQuery:
+    """
+    firestore.Queryの疑似実装。等号・不等号の条件、並べ替え、件数の上限、件数の集計に対応する。
+    """
+    OPERATORS = {
+        '==': lambda a, b: a == b,
+        '!=': lambda a, b: a != b,
+        '<': lambda a, b: a is not None and a < b,
+        '<=': lambda a, b: a is not None and a <= b,
+        '>': lambda a, b: a is not None and a > b,
+        '>=': lambda a, b: a is not None and a >= b,
+    }
+
+    def __init__(self, collection, filters=(), order=None, max_results=None):
+        self.collection = collection
+        self.filters = list(filters)
+        self.order = order
+        self.max_results = max_results
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return FakeQuery(self.collection, self.filters + [(field_path, op_string, value)], self.order, self.max_results)
+
+    def order_by(self, field_path, direction=None, **kwargs):
+        return FakeQuery(self.collection, self.filters, (field_path, direction == 'DESCENDING'), self.max_results)
+
+    def limit(self, count):
+        return FakeQuery(self.collection, self.filters, self.order, count)
+
+    def stream(self, transaction=None, **kwargs):
+        client = self.collection.client
+        client.profile.apply('firestore.query')
+        with client.lock:
+            documents = [
+                (doc_id, dict(data)) for (name, doc_id), data in client.store.items()
+                if name == self.collection.name and all(
+                    field in data and self.OPERATORS[op](data[field], value) for field, op, value in self.filters
+                )
+            ]
+        if self.order:
+            field, descending = self.order
+            documents = sorted((document for document in documents if field in document[1]), key=lambda document: document[1][field], reverse=descending)
+        for doc_id, data in documents[:self.max_results]:
+            yield FakeSnapshot(doc_id, data, self.collection.document(doc_id))
+
+    def count(self, **kwargs):
+        query = self
+        return SimpleNamespace(get=lambda **kwargs: [[SimpleNamespace(value=len(list(query.stream())))]])
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(self)
+        self.client = client
+        self.name = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self, doc_id or uuid.uuid4().hex)
+
+class FakeTransaction:
+    """
+    firestore.Transactionの疑似実装。@firestore.transactional から呼ばれる内部メソッドを実装する。
+    開始から確定まで疑似データベース全体のロックを保持するため、同時に実行されたトランザクションは直列化される。
+    """
+
+    def __init__(self, client, max_attempts=5):
+        self.client = client
+        self._max_attempts = max_attempts
+        self._read_only = False
+        self._id = None
+        self._writes = []
+        self._locked = False
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _begin(self, retry_id=None):
+        self.client.transaction_lock.acquire()
+        self._locked = True
+        self._id = uuid.uuid4().bytes
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _release(self):
+        if self._locked:
+            self._locked = False
+            self.client.transaction_lock.release()
+
+    def _commit(self):
+        try:
+            self.client.profile.apply('firestore.commit')
+            with self.client.lock:
+                for method, doc_ref, data in self._writes:
+                    getattr(doc_ref, method)(data)
+            return []
+        finally:
+            self._clean_up()
+            self._release()
+
+    def _rollback(self):
+        self._clean_up()
+        self._release()
+
+    def set(self, doc_ref, data, **kwargs):
+        self._writes.append(('_apply_set', doc_ref, data))
+
+    def update(self, doc_ref, data, **kwargs):
+        self._writes.append(('_apply_update', doc_ref, data))
+
+class FakeFirestoreClient:
+    """
+    firestore.Clientの疑似実装。ドキュメントはメモリ上の辞書に保持する。
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile or FaultProfile()
+        self.store = {}
+        self.lock = threading.RLock()
+        self.transaction_lock = threading.Lock()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def documents(self, collection_name):
+        """
+        コレクション内のドキュメントをすべて返す（結果の検証用）。
+        """
+        with self.lock:
+            return {doc_id: dict(data) for (name, doc_id), data in self.store.items() if name == collection_name}
+
+# ---- Notion
+
+class FakeNotionResponse:
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self._body = body
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return json.dumps(self._body, ensure_ascii=False)
+
+    def json(self):
+        return self._body
+
+class FakeNotionSession:
+    """
+    requests.Sessionの疑似実装。Notion APIのページ作成・更新、ブロック追加、データベースの取得を受け付ける。
+    NotionClientに渡すことで、レート制限や再試行の処理はそのまま実行される。
+    タグ（Tagsのmulti_select）の選択肢は、実際のAPIと同じくページで使われたときに追加される。
+    """
+
+    def __init__(self, profile=None, tag_options=None):
+        self.profile = profile or FaultProfile()
+        self.headers = {}
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.tag_options = list(tag_options or [])
+        self.database_reads = 0
+
+    def _add_tag_options(self, properties):
+        for option in properties.get('Tags', {}).get('multi_select', []):
+            if option['name'] not in self.tag_options:
+                self.tag_options.append(option['name'])
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def request(self, method, url, json=None, timeout=None, **kwargs):
+        try:
+            self.profile.apply(f"notion {method}")
+        except InjectedError as e:
+            return FakeNotionResponse(e.code, {'object': 'error', 'message': str(e)}, {'Retry-After': '0.1'} if e.code == 429 else None)
+
+        path = url.split('/v1/', 1)[-1] if '/v1/' in url else url.rsplit('/', 1)[-1]
+        return self.handle(method, path, json)
+
+    def handle(self, method, path, json):
+        """
+        Notion APIのリクエストを処理してレスポンスを返す（FakeNotionServer からも使用する）。
+
+        Args:
+            method (str): HTTPメソッド
+            path (str): /v1/ からのパス（例: "blocks/<id>/children"）
+            json (dict): リクエストボディ
+
+        Returns:
+            FakeNotionResponse: レスポンス
+        """
+        with self.lock:
+            if method == 'POST' and path.endswith('pages'):
+                page_id = uuid.uuid4().hex
+                self.pages[page_id] = {'properties': json['properties'], 'children': list(json.get('children', []))}
+                self._add_tag_options(json['properties'])
+                return FakeNotionResponse(200, {'object': 'page', 'id': page_id})
+            if method == 'PATCH' and path.startswith('blocks/') and path.endswith('/children'):
+                page_id = path.split('/')[1]
+                if page_id not in self.pages:
+                    return FakeNotionResponse(404, {'object': 'error', 'message': 'block not found'})
+                self.pages[page_id]['children'].extend(json['children'])
+                return FakeNotionResponse(200, {'object': 'list', 'results': []})
+            if method == 'PATCH' and path.startswith('pages/'):
+                page_id = path.split('/')[1]
+                if page_id not in self.pages:
+                    return FakeNotionResponse(404, {'object': 'error', 'message': 'page not found'})
+                self.pages[page_id]['properties'].update(json.get('properties', {}))
+                self._add_tag_options(json.get('properties', {}))
+                if 'archived' in json:
+                    self.pages[page_id]['archived'] = json['archived']
+                return FakeNotionResponse(200, {'object': 'page', 'id': page_id})
+            if method == 'GET' and path.startswith('databases/'):
+                self.database_reads += 1
+                options = [{'name': name} for name in self.tag_options]
+                return FakeNotionResponse(200, {'object': 'database', 'properties': {'Tags': {'type': 'multi_select', 'multi_select': {'options': options}}}})
+        return FakeNotionResponse(400, {'object': 'error', 'message': f"unsupported: {method} {path}"})
+
+    def page_titles(self):
+        """
+        作成されたページ（アーカイブ済みを除く）のタイトルの一覧を返す（重複作成の検証用）。
+        """
+        with self.lock:
+            return [page['properties']['Title']['title'][0]['text']['content'] for page in self.pages.values() if not page.get('archived')]
+
+    def page_tags(self):
+        """
+        作成されたページ（アーカイブ済みを除く）のタグの一覧を返す（タグの正規化の検証用）。
+        """
+        with self.lock:
+            return [[option['name'] for option in page['properties'].get('Tags', {}).get('multi_select', [])] for page in self.pages.values() if not page.get('archived')]
+
+class FakeNotionServer:
+    """
+    Notion APIの疑似サーバー。ローカルのポートでHTTPを受け付け、FakeNotionSession と同じ処理でページを保持する。
+    NotionClientを本番と同じ requests.Session で接続し、チャンク分割・再試行・Retry-After の処理を実際のHTTPで確認する。
+    script で、次に受け付けるリクエストに返すエラー（ステータスコードとヘッダー）を順に指定できる。
+    delay_next で、次のリクエストを処理した後に応答を遅らせる（処理済みのリクエストがクライアント側でタイムアウトした状態）。
+
+        with FakeNotionServer() as server:
+            server.script('PATCH blocks', 503, 503)
+            client = NotionClient('key', base_url=server.url)
+    """
+
+    def __init__(self, tag_options=None):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        self.backend = FakeNotionSession(tag_options=tag_options)
+        self.lock = threading.Lock()
+        self.scripted = []
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length)) if length else None
+                path = self.path.split('/v1/', 1)[-1]
+                response = server._respond(self.command, path, payload)
+                body = response.text.encode('utf-8')
+                try:
+                    self.send_response(response.status_code)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    for name, value in response.headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # クライアントがタイムアウトして切断した場合（delay_next）
+                    pass
+
+            do_GET = do_POST = do_PATCH = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def script(self, operation, *status_codes, retry_after=None):
+        """
+        operation（"POST pages" や "PATCH blocks" のようなメソッドとパスの先頭）に一致する次のリクエストに、指定したステータスコードを順に返す。
+
+        Args:
+            operation (str): メソッドとパスの先頭
+            status_codes (int): 返すステータスコード（1つにつき1リクエスト）
+            retry_after (float): 429/503に付けるRetry-Afterヘッダーの秒数
+        """
+        headers = {'Retry-After': str(retry_after)} if retry_after is not None else {}
+        with self.lock:
+            self.scripted.extend((operation, code, headers, 0) for code in status_codes)
+
+    def delay_next(self, operation, seconds):
+        """
+        operation に一致する次のリクエストを通常どおり処理し、応答を seconds 秒遅らせる。
+
+        Args:
+            operation (str): メソッドとパスの先頭
+            seconds (float): 応答を遅らせる秒数
+        """
+        with self.lock:
+            self.scripted.append((operation, None, {}, seconds))
+
+    def _respond(self, method, path, payload):
+        operation = f"{method} {path}"
+        with self.lock:
+            scripted = next((entry for entry in self.scripted if operation.startswith(entry[0])), None)
+            if scripted:
+                self.scripted.remove(scripted)
+        if scripted and scripted[1] is not None:
+            response = FakeNotionResponse(scripted[1], {'object': 'error', 'message': f"scripted failure: {operation}"}, scripted[2])
+        else:
+            response = self.backend.handle(method, path, payload)
+        with self.lock:
+            self.requests.append({
+                'time': time.monotonic(),
+                'operation': f"{method} {path.split('/')[0]}",
+                'children': len((payload or {}).get('children', [])),
+                'status_code': response.status_code,
+            })
+        if scripted and scripted[3]:
+            time.sleep(scripted[3])
+        return response
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# ---- 差し替え
+
+def install_fakes(gcs=None, gemini=None, firestore_profile=None, notion=None, notion_rate_limit=None, transcription_latency=0.0, batch_latency=0.0):
+    """
+    各サービスのクライアントを疑似バックエンドに差し替える。
+
+    Args:
+        gcs (FaultProfile): GCSのレイテンシとエラー率
+        gemini (FaultProfile): Geminiのレイテンシとエラー率
+        firestore_profile (FaultProfile): Firestoreのレイテンシとエラー率
+        notion (FaultProfile): Notionのレイテンシとエラー率
+        notion_rate_limit (float): Notionクライアントのレート制限（リクエスト/秒）。省略時は本番と同じ設定
+        transcription_latency (float): 録音全体の文字起こしにかかる時間（秒）
+        batch_latency (float): バッチジョブの作成から完了までの時間（秒）
+
+    Returns:
+        SimpleNamespace: 差し替えた疑似バックエンド（storage, genai, firestore, notion）
+    """
+    from cloud_storage_service import set_storage_client
+    from gemini_service import set_genai_client
+    from firestore_service import set_firestore_client
+    from notion_service import set_notion_client, NotionClient, TokenBucket
+
+    backends = SimpleNamespace(
+        storage=FakeStorageClient(gcs),
+        genai=FakeGenaiClient(gemini, transcription_latency=transcription_latency, batch_latency=batch_latency),
+        firestore=FakeFirestoreClient(firestore_profile),
+        notion=FakeNotionSession(notion),
+    )
+    set_storage_client(backends.storage)
+    set_genai_client(backends.genai)
+    set_firestore_client(backends.firestore)
+    rate_limiter = TokenBucket(notion_rate_limit) if notion_rate_limit else None
+    set_notion_client(NotionClient('fake-notion-api-key', base_url='https://fake-notion.invalid/v1', rate_limiter=rate_limiter, session=backends.notion))
+    return backends
@@ -1,116 +1,523 @@
 import os
-from google.cloud import firestore
+import time
 import hashlib
+import threading
+import contextvars
 from datetime import datetime, timedelta
+from tracing import span
 
-db = firestore.Client()
 COLLECTION_NAME = os.environ.get('COLLECTION_NAME', 'firestore_collection_name')
+# 処理中のリース期間（この期間ハートビートが途絶えた処理は異常終了したとみなし、引き継ぐ）
+LEASE_SECONDS = int(os.environ.get('LEASE_SECONDS', 360))
+# 失敗した処理を再試行する最大回数と、再試行までの待機時間の基準値（試行ごとに倍増）
+MAX_ATTEMPTS = int(os.environ.get('MAX_ATTEMPTS', 5))
+RETRY_BACKOFF_SECONDS = int(os.environ.get('RETRY_BACKOFF_SECONDS', 60))
+# Pub/Subの最大メッセージ保持期間（デフォルト7日）を考慮し、少し余裕を持たせて10日後に設定
+RETENTION_DAYS = 10
+
+# Firestoreクライアント（初回利用時に生成する。ベンチマークなどでは set_firestore_client で差し替える）
+_db = None
+_db_lock = threading.Lock()
+
+def get_firestore_client():
+    """
+    Firestoreクライアントを取得します。初回のみ生成し、以降は再利用します。
+
+    Returns:
+        google.cloud.firestore.Client: Firestoreクライアント
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                # 読み込みに時間がかかるため、初回利用時まで遅らせる（コールドスタートの短縮）
+                from google.cloud import firestore
+                _db = firestore.Client()
+    return _db
+
+def set_firestore_client(client):
+    """
+    Firestoreクライアントを差し替えます（疑似クライアントでのベンチマーク用）。
+
+    Args:
+        client: firestore.Clientと同じインターフェースを持つクライアント。Noneの場合は次回利用時に再生成します
+    """
+    global _db
+    _db = client
 
 def generate_event_id(bucket_name: str, file_name: str, event_time: str = None) -> str:
     """
     イベントの一意識別子を生成
-    
+
     Args:
         bucket_name: GCSバケット名
         file_name: ファイル名
         event_time: イベント時刻（任意）
-    
+
     Returns:
         str: 生成されたイベントID
     """
     content = f"{bucket_name}/{file_name}"
     if event_time:
         content += f"/{event_time}"
-    
+
     return hashlib.md5(content.encode()).hexdigest()
 
-@firestore.transactional
-def _try_start_processing_transaction(transaction, doc_ref: firestore.DocumentReference, bucket_name: str, file_name: str) -> bool:
+class LeaseLost(Exception):
+    """
+    リースの期限が切れた、または他の処理に引き継がれたため、このイベントの処理を続けられないことを表す例外。
+    """
+
+def _as_naive_utc(value):
+    """
+    Firestoreから取得したタイムゾーン付きの時刻を、比較用にタイムゾーンなしのUTCに変換
+    """
+    return value.replace(tzinfo=None) if value is not None else None
+
+def _transactional(func):
+    """
+    関数を@firestore.transactionalでラップして返す（firestoreの読み込みを初回利用時まで遅らせるため、呼び出し時にラップする）
+
+    Args:
+        func: 第1引数にトランザクションを受け取る関数
+
+    Returns:
+        トランザクション内で関数を実行し、競合時は再試行する呼び出し可能オブジェクト
+    """
+    from google.cloud import firestore
+    return firestore.transactional(func)
+
+def _lease_until(doc_data: dict) -> datetime:
+    """
+    処理中のドキュメントのリースの期限（リースの記録がない古いドキュメントは開始時刻から求める）
+    """
+    return _as_naive_utc(doc_data.get('lease_until')) or _as_naive_utc(doc_data['started_at']) + timedelta(seconds=LEASE_SECONDS)
+
+def is_abandoned(doc_data: dict, now: datetime) -> bool:
+    """
+    最大試行回数の処理がリースの期限までに終わらず、これ以上引き継げない状態かを判定
+
+    Args:
+        doc_data: イベントのドキュメント
+        now: 現在時刻（UTC）
+
+    Returns:
+        bool: 失敗として記録すべき場合True
+    """
+    return doc_data.get('status') == 'processing' and doc_data.get('attempts', 1) >= MAX_ATTEMPTS and _lease_until(doc_data) <= now
+
+def is_claimable(doc_data: dict, now: datetime) -> bool:
+    """
+    記録されている処理状況から、この処理を開始（引き継ぎ）できるかを判定
+
+    Args:
+        doc_data: イベントのドキュメント
+        now: 現在時刻（UTC）
+
+    Returns:
+        bool: 開始できる場合True
+    """
+    status = doc_data.get('status')
+    if status == 'completed':
+        return False
+
+    attempts = doc_data.get('attempts', 1)
+    if status == 'processing':
+        return _lease_until(doc_data) <= now and attempts < MAX_ATTEMPTS
+
+    if status == 'failed':
+        next_retry_at = _as_naive_utc(doc_data.get('next_retry_at'))
+        return attempts < MAX_ATTEMPTS and (next_retry_at is None or next_retry_at <= now)
+
+    return False
+
+def _try_start_processing_transaction(transaction, doc_ref, bucket_name: str, file_name: str, lease_owner: str) -> bool:
     """
     トランザクション内でアトミックに処理開始をマーク
-    
+    リースが切れた処理や、再試行時刻を過ぎた失敗済みの処理は引き継ぐ
+
     Args:
         transaction: Firestoreトランザクション
         doc_ref: ドキュメント参照
         bucket_name: GCSバケット名
         file_name: ファイル名
-    
+        lease_owner: リースの所有者を識別するID
+
     Returns:
         bool: 処理開始に成功した場合True、既に処理済み/処理中の場合False
     """
     # トランザクション内でドキュメントの存在確認
     doc = doc_ref.get(transaction=transaction)
-    
+    now = datetime.utcnow()
+    attempts = 1
+
     if doc.exists:
-        print(f"イベントは既に処理済みまたは処理中です: {doc_ref.id}")
-        return False
-    
+        doc_data = doc.to_dict()
+        if is_abandoned(doc_data, now):
+            # 最後の試行が異常終了したまま処理中として残らないよう、失敗として記録する（TTLで削除される）
+            transaction.update(doc_ref, {
+                'status': 'failed',
+                'failed_at': now,
+                'last_error': f"最大試行回数({MAX_ATTEMPTS})の処理がリースの期限までに終わりませんでした",
+                'expire_at': now + timedelta(days=RETENTION_DAYS),
+            })
+            print(f"リースの期限が切れた最後の試行を失敗として記録しました: {doc_ref.id}")
+            return False
+        if not is_claimable(doc_data, now):
+            print(f"イベントは既に処理済みまたは処理中です: {doc_ref.id} (ステータス: {doc_data.get('status')})")
+            return False
+        attempts = doc_data.get('attempts', 1) + 1
+        print(f"リース切れ・失敗済みの処理を引き継ぎます: {doc_ref.id} ({attempts}回目, 前回のステータス: {doc_data.get('status')})")
+
     # 未処理の場合、処理開始ステータスで作成
     doc_data = {
         'bucket_name': bucket_name,
         'file_name': file_name,
-        'started_at': datetime.utcnow(),
-        'status': 'processing'
+        'started_at': now,
+        'status': 'processing',
+        'attempts': attempts,
+        'lease_owner': lease_owner,
+        'lease_until': now + timedelta(seconds=LEASE_SECONDS)
     }
     transaction.set(doc_ref, doc_data)
     print(f"処理開始をマーク: {doc_ref.id}")
     return True
 
-def try_start_processing(event_id: str, bucket_name: str, file_name: str) -> bool:
+def try_start_processing(event_id: str, bucket_name: str, file_name: str, lease_owner: str = None) -> bool:
     """
     イベント処理の開始を試行（重複実行防止）
-    
+
     Args:
         event_id: イベントID
         bucket_name: GCSバケット名
         file_name: ファイル名
-    
+        lease_owner: リースの所有者を識別するID（ハートビートで使用）
+
     Returns:
         bool: 処理開始に成功した場合True、重複実行の場合False
     """
-    try:
-        doc_ref = db.collection(COLLECTION_NAME).document(event_id)
-        transaction = db.transaction()
-        
-        # トランザクション内でアトミックに処理開始をマーク
-        return _try_start_processing_transaction(transaction, doc_ref, bucket_name, file_name)
-        
-    except Exception as e:
-        print(f"処理開始試行エラー: {e}")
-        print(f"コレクション名: {COLLECTION_NAME}, イベントID: {event_id}")
+    with span("firestore.claim") as s:
+        try:
+            db = get_firestore_client()
+            doc_ref = db.collection(COLLECTION_NAME).document(event_id)
+            transaction = db.transaction()
+
+            # トランザクション内でアトミックに処理開始をマーク
+            claimed = _transactional(_try_start_processing_transaction)(transaction, doc_ref, bucket_name, file_name, lease_owner)
+            s.set(claimed=claimed)
+            return claimed
+
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"処理開始試行エラー: {e}")
+            print(f"コレクション名: {COLLECTION_NAME}, イベントID: {event_id}")
+            return False
+
+def is_event_claimable(event_id: str) -> bool:
+    """
+    イベントが未処理、またはリース切れ・再試行待ちを過ぎた状態かを確認（トランザクション外の事前確認用）
+
+    Args:
+        event_id: イベントID
+
+    Returns:
+        bool: 処理を開始できる見込みがある場合True
+    """
+    doc = get_firestore_client().collection(COLLECTION_NAME).document(event_id).get()
+    if not doc.exists:
+        return True
+    return is_claimable(doc.to_dict(), datetime.utcnow())
+
+def get_processing_state(event_id: str):
+    """
+    イベントの処理状況を取得（キューのワーカーが再試行の要否を判断するために使用）
+
+    Args:
+        event_id: イベントID
+
+    Returns:
+        dict: イベントのドキュメント。未処理の場合はNone
+    """
+    doc = get_firestore_client().collection(COLLECTION_NAME).document(event_id).get()
+    return doc.to_dict() if doc.exists else None
+
+def _extend_lease_transaction(transaction, doc_ref, lease_owner: str) -> bool:
+    """
+    トランザクション内でリースの期限を延長
+
+    Args:
+        transaction: Firestoreトランザクション
+        doc_ref: ドキュメント参照
+        lease_owner: リースの所有者を識別するID
+
+    Returns:
+        bool: 延長に成功した場合True、他の処理に引き継がれていた場合False
+    """
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists:
         return False
+    doc_data = doc.to_dict()
+    if doc_data.get('status') != 'processing' or doc_data.get('lease_owner') != lease_owner:
+        return False
+    transaction.update(doc_ref, {'lease_until': datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)})
+    return True
 
-def mark_processing_completed(event_id: str, bucket_name: str, file_name: str) -> bool:
+def extend_lease(event_id: str, lease_owner: str) -> bool:
+    """
+    処理中のイベントのリースを延長（ハートビート）
+
+    Args:
+        event_id: イベントID
+        lease_owner: リースの所有者を識別するID
+
+    Returns:
+        bool: 延長に成功した場合True、他の処理に引き継がれていた場合False、エラーで確認できなかった場合None
+    """
+    with span("firestore.extend_lease") as s:
+        try:
+            db = get_firestore_client()
+            doc_ref = db.collection(COLLECTION_NAME).document(event_id)
+            extended = _transactional(_extend_lease_transaction)(db.transaction(), doc_ref, lease_owner)
+            s.set(extended=extended)
+            return extended
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"リース延長エラー: {e}")
+            return None
+
+class LeaseHeartbeat:
+    """
+    処理中にバックグラウンドでリースを定期的に延長するコンテキストマネージャー
+    リースを失った（他の処理に引き継がれた、または延長できないまま期限を過ぎた）場合は lost を設定し、
+    Notionへの書き込みや処理完了の記録の前に check で確認できるようにする
+    """
+
+    def __init__(self, event_id: str, lease_owner: str, interval_seconds: float = LEASE_SECONDS / 3):
+        self.event_id = event_id
+        self.lease_owner = lease_owner
+        self.interval_seconds = interval_seconds
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+        # 最後に延長できたリースの期限（このインスタンスの時計で判定する）
+        self.lease_deadline = time.monotonic() + LEASE_SECONDS
+        # スパンにイベントIDを引き継ぐため、作成時のコンテキストでスレッドを実行する
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True)
+
+    def _extend(self):
+        """
+        リースを延長し、結果に応じて期限と lost を更新します。
+        """
+        requested_at = time.monotonic()
+        extended = extend_lease(self.event_id, self.lease_owner)
+        if extended:
+            self.lease_deadline = requested_at + LEASE_SECONDS
+        elif extended is False:
+            print(f"警告: イベント {self.event_id} のリースが他の処理に引き継がれました")
+            self.lost.set()
+        else:
+            print(f"警告: イベント {self.event_id} のリースを延長できませんでした")
+
+    def _run(self):
+        while not self.lost.is_set() and not self.stopped.wait(self.interval_seconds):
+            self._extend()
+
+    def check(self):
+        """
+        Notionへの書き込みなどの取り消せない処理の前に、リースを延長して保持していることを確認します。
+        Firestoreに接続できない場合は、最後に延長できたリースの期限内であれば続行します。
+
+        Raises:
+            LeaseLost: リースが他の処理に引き継がれた、または期限を過ぎた場合
+        """
+        if not self.lost.is_set():
+            self._extend()
+        if self.lost.is_set() or time.monotonic() >= self.lease_deadline:
+            self.lost.set()
+            raise LeaseLost(f"イベント {self.event_id} のリースを失ったため、処理を中断します")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+def _fenced_update_transaction(transaction, doc_ref, build_update, lease_owner: str, from_status: str):
+    """
+    トランザクション内で、イベントの状態が from_status でリースの所有者が lease_owner の場合のみ更新
+
+    Args:
+        transaction: Firestoreトランザクション
+        doc_ref: ドキュメント参照
+        build_update: 現在のドキュメントを受け取り、更新内容を返す関数
+        lease_owner: リースの所有者を識別するID（Noneの場合は確認しない）
+        from_status: 更新を許可する状態
+
+    Returns:
+        dict: 更新内容。状態または所有者が一致しない場合None
+    """
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        return None
+    doc_data = doc.to_dict()
+    if doc_data.get('status') != from_status or (lease_owner is not None and doc_data.get('lease_owner') != lease_owner):
+        return None
+    update = build_update(doc_data)
+    transaction.update(doc_ref, update)
+    return update
+
+def fenced_update(event_id: str, build_update, lease_owner: str = None, from_status: str = 'processing'):
+    """
+    リースを保持している場合のみイベントのドキュメントを更新（リースが切れた後に引き継いだ処理の状態を上書きしないため）
+
+    Args:
+        event_id: イベントID
+        build_update: 現在のドキュメントを受け取り、更新内容を返す関数
+        lease_owner: リースの所有者を識別するID（Noneの場合は状態のみ確認する）
+        from_status: 更新を許可する状態
+
+    Returns:
+        dict: 更新内容。状態または所有者が一致しない場合None
+    """
+    db = get_firestore_client()
+    doc_ref = db.collection(COLLECTION_NAME).document(event_id)
+    return _transactional(_fenced_update_transaction)(db.transaction(), doc_ref, build_update, lease_owner, from_status)
+
+def mark_processing_completed(event_id: str, bucket_name: str, file_name: str, lease_owner: str = None, from_status: str = 'processing') -> bool:
     """
     イベント処理の完了を記録し、TTL用の有効期限を設定します。
-    
+    状態が from_status でない場合や、リースが他の処理に引き継がれていた場合は記録しません。
+
     Args:
         event_id: イベントID
         bucket_name: GCSバケット名
         file_name: ファイル名
-    
-    Returns:
-        bool: 成功した場合True、失敗した場合False
-    """
-    try:
-        doc_ref = db.collection(COLLECTION_NAME).document(event_id)
-
-        # Pub/Subの最大メッセージ保持期間（デフォルト7日）を考慮し、少し余裕を持たせて10日後に設定
-        # この期間を過ぎたドキュメントは重複実行防止の役目を終えたと判断できます。
-        retention_days = 10
-        completion_time = datetime.utcnow()
-        expire_at_time = completion_time + timedelta(days=retention_days)
-
-        # 部分更新で完了ステータスと有効期限を記録
-        doc_ref.update({
-            'completed_at': completion_time,
-            'status': 'completed',
-            'expire_at': expire_at_time  # TTL (Time-to-Live) ポリシー用のフィールド
-        })
-        print(f"処理完了を記録: コレクション='{COLLECTION_NAME}', ドキュメントID='{event_id}'")
-        print(f"ドキュメントは {expire_at_time.isoformat()} ごろに自動削除されます。")
-        return True
-    except Exception as e:
-        print(f"処理完了記録エラー: {e}")
-        print(f"コレクション名: {COLLECTION_NAME}, イベントID: {event_id}")
-        return False
\ No newline at end of file
+        lease_owner: リースの所有者を識別するID（Noneの場合は確認しない）
+        from_status: 完了として記録できる状態（バッチ処理の場合は batch_submitted）
+
+    Returns:
+        bool: 成功した場合True、失敗した場合・リースを失っていた場合False
+    """
+    with span("firestore.complete") as s:
+        try:
+            from google.cloud import firestore
+
+            # この期間を過ぎたドキュメントは重複実行防止の役目を終えたと判断できます。
+            completion_time = datetime.utcnow()
+            expire_at_time = completion_time + timedelta(days=RETENTION_DAYS)
+
+            # 部分更新で完了ステータスと有効期限を記録
+            update = fenced_update(event_id, lambda doc_data: {
+                'completed_at': completion_time,
+                'status': 'completed',
+                'lease_until': firestore.DELETE_FIELD,
+                'expire_at': expire_at_time  # TTL (Time-to-Live) ポリシー用のフィールド
+            }, lease_owner, from_status)
+            if update is None:
+                s.set(error="lease lost")
+                print(f"警告: イベント {event_id} は {from_status} ではない、またはリースが他の処理に引き継がれたため、処理完了を記録しません")
+                return False
+            print(f"処理完了を記録: コレクション='{COLLECTION_NAME}', ドキュメントID='{event_id}'")
+            print(f"ドキュメントは {expire_at_time.isoformat()} ごろに自動削除されます。")
+            return True
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"処理完了記録エラー: {e}")
+            print(f"コレクション名: {COLLECTION_NAME}, イベントID: {event_id}")
+            return False
+
+def mark_processing_failed(event_id: str, error: str, lease_owner: str = None, from_status: str = 'processing', retryable: bool = True) -> bool:
+    """
+    イベント処理の失敗を記録し、試行回数に応じた次回の再試行時刻を設定します。
+    最大試行回数に達した場合や retryable が False の場合は再試行せず、TTL用の有効期限を設定します。
+    状態が from_status でない場合や、リースが他の処理に引き継がれていた場合は記録しません。
+
+    Args:
+        event_id: イベントID
+        error: エラー内容
+        lease_owner: リースの所有者を識別するID（Noneの場合は確認しない）
+        from_status: 失敗として記録できる状態（バッチ処理の場合は batch_submitted）
+        retryable: Falseの場合は残りの試行回数にかかわらず再試行しない（再試行しても成功しない失敗）
+
+    Returns:
+        bool: 成功した場合True、失敗した場合・リースを失っていた場合False
+    """
+    with span("firestore.failed") as s:
+        try:
+            from google.cloud import firestore
+            failed_at = datetime.utcnow()
+
+            def build_update(doc_data):
+                attempts = doc_data.get('attempts', 1)
+                if not retryable:
+                    # 再試行の対象から外すため、試行回数を上限まで進める
+                    attempts = max(attempts, MAX_ATTEMPTS)
+                update = {
+                    'failed_at': failed_at,
+                    'status': 'failed',
+                    'last_error': error,
+                    'lease_until': firestore.DELETE_FIELD,
+                }
+                if attempts < MAX_ATTEMPTS:
+                    # 指数バックオフで次回の再試行時刻を設定
+                    update['next_retry_at'] = failed_at + timedelta(seconds=RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1))
+                else:
+                    update['expire_at'] = failed_at + timedelta(days=RETENTION_DAYS)
+                return dict(update, attempts=attempts)
+
+            update = fenced_update(event_id, build_update, lease_owner, from_status)
+            if update is None:
+                s.set(error="lease lost")
+                print(f"警告: イベント {event_id} は {from_status} ではない、またはリースが他の処理に引き継がれたため、処理失敗を記録しません")
+                return False
+            attempts = update['attempts']
+            if 'next_retry_at' in update:
+                print(f"処理失敗を記録: イベントID={event_id}, 試行回数={attempts}, 次回の再試行={update['next_retry_at'].isoformat()}")
+            elif not retryable:
+                print(f"処理失敗を記録: イベントID={event_id}, 再試行しても成功しないため再試行しません")
+            else:
+                print(f"処理失敗を記録: イベントID={event_id}, 最大試行回数({MAX_ATTEMPTS})に達したため再試行しません")
+            s.set(attempts=attempts)
+            return True
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"処理失敗記録エラー: {e}")
+            print(f"コレクション名: {COLLECTION_NAME}, イベントID: {event_id}")
+            return False
+
+def release_processing(event_id: str, reason: str, lease_owner: str = None) -> bool:
+    """
+    処理を開始したイベントを、試行回数を消費せずにすぐ再試行できる状態に戻します。
+    作業ディレクトリの予算超過など、メモの内容とは関係なく処理を後回しにする場合に使用します。
+    リースが他の処理に引き継がれていた場合は戻しません。
+
+    Args:
+        event_id: イベントID
+        reason: 後回しにする理由
+        lease_owner: リースの所有者を識別するID（Noneの場合は確認しない）
+
+    Returns:
+        bool: 戻した場合True、失敗した場合・リースを失っていた場合False
+    """
+    with span("firestore.release"):
+        try:
+            from google.cloud import firestore
+            released_at = datetime.utcnow()
+            update = fenced_update(event_id, lambda doc_data: {
+                'status': 'failed',
+                'failed_at': released_at,
+                'last_error': reason,
+                'next_retry_at': released_at,
+                # 処理開始で増やした試行回数を元に戻す
+                'attempts': doc_data.get('attempts', 1) - 1,
+                'lease_until': firestore.DELETE_FIELD,
+            }, lease_owner)
+            if update is None:
+                print(f"警告: イベント {event_id} のリースが他の処理に引き継がれたため、処理を戻しません")
+                return False
+            print(f"処理を後回しにするため、処理開始の記録を戻しました: イベントID={event_id}, 試行回数={update['attempts']}")
+            return True
+        except Exception as e:
+            print(f"処理開始の記録を戻す際にエラーが発生しました: {e}")
+            return False
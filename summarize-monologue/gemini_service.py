@@ -1,133 +1,1023 @@
 # process_audio/gemini_client.py
-from google import genai
 import os
 import json
 import textwrap
-from schema import TranscriptionResponse, SummaryResponse
+import difflib
+import time
+import threading
+import contextvars
+import contextlib
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from cache_service import generate_cache_key, get_cached_result, set_cached_result
+from rate_limit import TokenBucket
+from tag_service import tag_vocabulary_prompt
+from tracing import span, emit
+from audio_service import cut_audio_segment, detect_silences
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', 'gemini_api_key')
 GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash')
+# プロンプトを変更した場合は更新する（結果キャッシュのキーに含まれる）
+PROMPT_VERSION = '3'
 
-genai_client = genai.Client(api_key=GEMINI_API_KEY)
+# インスタンス内でGeminiに同時に送るリクエスト数の上限（バッチ処理やバースト時のクォータ超過を防ぐ）
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 4))
 
-def transcribe_and_summarize(file_path):
+# Geminiクライアント（初回利用時に生成する。ベンチマークなどでは set_genai_client で差し替える）
+_genai_client = None
+_genai_client_lock = threading.Lock()
+gemini_semaphore = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+def get_genai_client():
     """
-    Gemini APIを使用して音声ファイルを文字起こしし、要約します。
+    Geminiクライアントを取得します。初回のみ生成し、以降は再利用します。
+
+    Returns:
+        genai.Client: Geminiクライアント。
+    """
+    global _genai_client
+    if _genai_client is None:
+        with _genai_client_lock:
+            if _genai_client is None:
+                # google-genaiとスキーマ（pydantic）の読み込みは重いため、初回利用時まで遅らせる（重複イベントでは読み込まない）
+                from google import genai
+                _genai_client = genai.Client(api_key=GEMINI_API_KEY)
+    return _genai_client
+
+def set_genai_client(client):
+    """
+    Geminiクライアントを差し替えます（疑似クライアントでのベンチマーク用）。
 
     Args:
-        file_path (str): 音声ファイルのパス。
+        client: genai.Clientと同じインターフェースを持つクライアント。Noneの場合は次回利用時に再生成します。
+    """
+    global _genai_client
+    _genai_client = client
+
+def upload_audio_stream(stream, mime_type):
+    """
+    ストリームから読み込んだ音声データをGemini Files APIにレジューム可能アップロードします。
+    ストリームはチャンク単位で読み込まれるため、ファイル全体をメモリやディスクに展開しません。
+
+    Args:
+        stream (io.IOBase): バイナリモードの読み込みストリーム。
+        mime_type (str): 音声データのMIMEタイプ。
 
     Returns:
-        dict: 文字起こしと要約の結果を含む辞書。
+        types.File: アップロードされたファイル。失敗した場合はNone。
+    """
+    with span("gemini.upload", mime_type=mime_type, streaming=True) as s:
+        try:
+            audio_file = get_genai_client().files.upload(file=stream, config={'mime_type': mime_type})
+            s.set(bytes=getattr(audio_file, 'size_bytes', None))
+            print(f"音声データをストリーミングでGeminiにアップロードしました: {audio_file.name}")
+            return audio_file
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"Geminiへのストリーミングアップロード中にエラーが発生しました: {e}")
+            return None
+
+# 長い録音を区間に分割して並列に文字起こしする際の設定
+TRANSCRIPTION_SEGMENT_SECONDS = int(os.environ.get('TRANSCRIPTION_SEGMENT_SECONDS', 600))
+TRANSCRIPTION_OVERLAP_SECONDS = int(os.environ.get('TRANSCRIPTION_OVERLAP_SECONDS', 15))
+TRANSCRIPTION_MAX_WORKERS = int(os.environ.get('TRANSCRIPTION_MAX_WORKERS', 4))
+# 区間の終わりを、この秒数だけ手前までの範囲にある無音の位置に寄せる（発話の途中で区切らないため）
+TRANSCRIPTION_SILENCE_SEARCH_SECONDS = int(os.environ.get('TRANSCRIPTION_SILENCE_SEARCH_SECONDS', 60))
+# 重なり区間の重複除去で比較する文字数と、重複とみなす最小一致文字数
+STITCH_WINDOW_CHARS = 800
+STITCH_MIN_MATCH_CHARS = 8
+
+# コンテキストキャッシュを作成する文字起こしの最小文字数（これより短い場合はキャッシュの最小トークン数に満たない）
+CONTEXT_CACHE_MIN_CHARS = int(os.environ.get('CONTEXT_CACHE_MIN_CHARS', 2000))
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get('CONTEXT_CACHE_TTL_SECONDS', 600))
+# 要約リクエストの最大試行回数（再試行時はアップロード済みのファイルとキャッシュを再利用する）
+SUMMARY_MAX_ATTEMPTS = int(os.environ.get('SUMMARY_MAX_ATTEMPTS', 2))
+
+# 文字起こしと要約の実行方法（auto / single / two_step）
+# single は1回のリクエストで文字起こしと要約を同時に行い、two_step は文字起こしの後に要約する
+GEMINI_PIPELINE_MODE = os.environ.get('GEMINI_PIPELINE_MODE', 'auto')
+# auto の場合に single を選ぶ録音の長さの上限（秒）
+SINGLE_CALL_MAX_SECONDS = int(os.environ.get('SINGLE_CALL_MAX_SECONDS', 300))
+
+# ステージごとに使うモデルの優先順（カンマ区切り）。先頭のモデルが混雑・障害で使えない場合は次のモデルに切り替える
+# 短い録音の文字起こし・要約（1回のリクエスト）と文字起こしは軽量なモデル、長い録音の要約は高性能なモデルを優先する
+GEMINI_SHORT_MODELS = os.environ.get('GEMINI_SHORT_MODELS', f"gemini-2.5-flash-lite,{GEMINI_MODEL}")
+GEMINI_TRANSCRIPTION_MODELS = os.environ.get('GEMINI_TRANSCRIPTION_MODELS', f"gemini-2.5-flash-lite,{GEMINI_MODEL}")
+GEMINI_SUMMARY_MODELS = os.environ.get('GEMINI_SUMMARY_MODELS', f"{GEMINI_MODEL},gemini-2.5-flash-lite")
+GEMINI_LONG_SUMMARY_MODELS = os.environ.get('GEMINI_LONG_SUMMARY_MODELS', f"gemini-2.5-pro,{GEMINI_MODEL}")
+# 長い録音の要約とみなす録音の長さ（秒）
+LONG_MEMO_SECONDS = int(os.environ.get('LONG_MEMO_SECONDS', 1800))
+# 429/5xxの場合に同じモデルで再試行する回数と、待機時間の基準値（試行ごとに倍増し、ジッターを加える）
+GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', 2))
+GEMINI_RETRY_BASE_SECONDS = float(os.environ.get('GEMINI_RETRY_BASE_SECONDS', 2))
+GEMINI_RETRY_MAX_SECONDS = 60
+# モデルごとの1分あたりのリクエスト数の上限（0の場合は制限しない）
+GEMINI_REQUESTS_PER_MINUTE = float(os.environ.get('GEMINI_REQUESTS_PER_MINUTE', 0))
+# 再試行・フォールバックの対象とするステータスコード（404はモデルが存在しない・廃止された場合）
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+FAILOVER_STATUS_CODES = RETRYABLE_STATUS_CODES + (404,)
+
+# 文字起こしと要約で共通のシステム指示
+SYSTEM_PREAMBLE = textwrap.dedent("""
+    <premise>この音声は独り言で考え事をしているボイスメモです。話題が突然変わったり、元の話題に戻ったりします。何か正解を出したいというよりは無数に浮かぶアイディアを言い連ねています。</premise>
+""")
+
+TRANSCRIPTION_PROMPT = textwrap.dedent("""
+    <goal>ボイスメモの内容を正確に文字に起こしてください。</goal>
+    <role>あなたは音声文字起こしの専門家で、話し言葉を正確にテキストに変換することが得意です。</role>
+    <goal-detail>
+        <1>音声内容をできるだけ正確に文字に起こしてください。</1>
+        <2>「ええと」や「あーー」などの言い淀みは除去して構いません。</2>
+        <3>話し手の感情や語調のニュアンスをできるだけ残すようにしてください。</3>
+        <4>文脈を無くさないように、話し言葉の自然な流れを維持してください。</4>
+    </goal-detail>
+    <output-format>
+    純粋な文字起こしのテキストを出力してください。
+    ```json
+    {
+        "transcription": "文字起こしの内容をここに記載"
+    }
+    ```
+    </output-format>
+    <instructions>
+        <step1>ボイスメモを日本語で純粋に文字起こししてください。</step1>
+        <step2>「ええと」や「あーー」など言葉に詰まっている部分を削除して、聞きやすい文章にしてください。</step2>
+        <step3>話の流れや文脈、感情表現はそのまま保持してください。</step3>
+        <step4>整形や要約はせず、元の発言内容をそのまま文字に起こしてください。</step4>
+    </instructions>
+""")
+
+# 要約の指示（文字起こしと一緒にコンテキストキャッシュに格納する）
+SUMMARY_INSTRUCTION = textwrap.dedent("""
+    <goal>文字起こしされたボイスメモの内容を整理して、きれいなメモにまとめてください。</goal>
+    <role>あなたはソクラテスの弟子なみの聞き上手で、独り言のメモから情報が整理されたメモを作成することが得意です。</role>
+    <goal-detail>
+        <1>話題ごとに見出し（###）を作って、情報の順番を整理してください。話している順番に関わらず、設定した見出しに内容を足していってください。</1>
+        <2>感情や心情を省略、要約せずに、できるだけニュアンスを残すようにしてください。</2>
+        <3>箇条書きのようにきれいにまとめないでください。話の文脈を無くさないように、話し言葉口調のままの文章でまとめてください。</3>
+        <4>整理はしますが、情報の要約はしないでください。内容の本質は保持してください。</4>
+        <5>全体を見て「〇〇する！」「〇〇してみようかな」「〇〇興味ある」みたいに次の行動をするべきものを next-actionsにまとめてください。</5>
+    </goal-detail>
+    <output-format>
+    Notionに適したMarkdown形式で出力してください。
+    見出しは細かく作成することを意識し、1つの見出しに対して、最大でも150文字以内くらいにまとめてください。
+    ```json
+    {
+        "markdown": "### 話題1\\n内容1\\n内容2\\n### 話題2\\n内容1\\n内容2\\n### 話題3\\n内容1\\n内容2\\n...(いくつでも)",
+        "nextActions": ["やること1", "やること2", "やること3"],
+        "tags": ["タグ1", "タグ2", "タグ3"]
+    }
+    ```
+    </output-format>
+    <instructions>
+        <step1>このボイスメモを日本語で純粋に文字起こししてください。</step1>
+        <step2>「ええと」や「あーー」など言葉に詰まっている部分などを削除して、きれいな文章にしてください。</step2>
+        <step3>文章の中から話題（トピックス）を任意の数選定して、題名（タイトル）をつけ、マークダウンで見出し（###）を作ってください。タイトルはその話題の中での気づきや、結論などを短い文章にしたものを設定。イメージはインタビュー記事の段落ごとについているタイトルのような感じ。</step3>
+        <step4>考え事の内容をできるだけ削らないようにして、各見出しの中にまとめてください。</step4>
+        <step5>step4までの内容をまとめて、1つのMarkdownを出力してください。</step5>
+        <step6>整理した内容の話題の中から「タグ」を最大3つ重要な順に生成してください。何についての話題なのか簡単に特定できるように具体的かつ短い単語にしてください。（例：プログラミング、英語、恋愛、AI、転職...）具体的な内容が分かりづらいものはやめて。</step6>
+    </instructions>
+""")
+
+# 文字起こしと要約を1回で行う場合のリクエスト（要約の指示はシステム指示として渡す）
+SINGLE_CALL_PROMPT = textwrap.dedent("""
+    <task>
+        <step1>まず、ボイスメモを日本語で純粋に文字起こしして transcription に出力してください。</step1>
+        <step2>「ええと」や「あーー」などの言い淀みは除去し、話の流れや文脈、感情表現はそのまま保持してください。</step2>
+        <step3>次に、その文字起こしを指示に従って整理し、markdown・nextActions・tags に出力してください。</step3>
+    </task>
+""")
+
+# キャッシュ済みのコンテキストに対して送る要約リクエスト（差分のみ）
+SUMMARY_REQUEST = "上記の文字起こしを、指示に従って整理されたメモにまとめてください。"
+
+# 文字起こしを逐次受け取る場合のリクエスト（JSONではなくテキストのまま出力させる）
+STREAMING_TRANSCRIPTION_PROMPT = TRANSCRIPTION_PROMPT.split('<output-format>')[0] + textwrap.dedent("""
+    <output-format>文字起こしのテキストのみを出力してください。JSONやコードブロックで囲まないでください。</output-format>
+""")
+
+# 長い録音の文字起こしを区切りごとに要約する場合のリクエスト
+SECTION_SUMMARY_REQUEST = "上記は長いボイスメモの一部の文字起こしです。この部分だけを、指示に従って整理されたメモにまとめてください。"
+
+def _format_timestamp(seconds):
+    """
+    秒数をGeminiが音声の位置指定に使うMM:SS形式に変換します。
+
+    Args:
+        seconds (float): 秒数。
+
+    Returns:
+        str: MM:SS形式の文字列。
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+def plan_transcription_segments(duration_seconds, segment_seconds=TRANSCRIPTION_SEGMENT_SECONDS, overlap_seconds=TRANSCRIPTION_OVERLAP_SECONDS,
+                                silences=None, search_seconds=TRANSCRIPTION_SILENCE_SEARCH_SECONDS):
+    """
+    録音全体を、前後が少し重なる文字起こし区間に分割します。
+    無音の区間が指定された場合は、各区間の終わりを search_seconds 手前までにある無音の中央に寄せます。
+
+    Args:
+        duration_seconds (float): 録音の長さ（秒）。
+        segment_seconds (int): 1区間の長さ（秒）。
+        overlap_seconds (int): 隣り合う区間の重なり（秒）。
+        silences (list): 無音の区間（(開始秒, 終了秒) のタプル）のリスト。
+        search_seconds (int): 無音を探す、本来の区間の終わりから手前への範囲（秒）。
+
+    Returns:
+        list: (開始秒, 終了秒) のタプルのリスト。
+    """
+    midpoints = sorted((silence_start + silence_end) / 2 for silence_start, silence_end in silences or [])
+    segments = []
+    start = 0
+    while start < duration_seconds:
+        end = min(start + segment_seconds, duration_seconds)
+        if end < duration_seconds:
+            # 本来の終わりに最も近い無音で区切る（区間が重なりより短くならない範囲で）
+            candidates = [point for point in midpoints if max(end - search_seconds, start + overlap_seconds) < point <= end]
+            if candidates:
+                end = candidates[-1]
+        segments.append((start, end))
+        if end >= duration_seconds:
+            break
+        start = end - overlap_seconds
+    return segments
+
+def stitch_transcriptions(pieces):
+    """
+    重なりのある区間ごとの文字起こしを連結し、重なり部分の重複を取り除きます。
+    前の区間の末尾と次の区間の先頭で最も長く一致する部分を境目として繋ぎます。
+
+    Args:
+        pieces (list): 区間順に並んだ文字起こしのリスト。
+
+    Returns:
+        str: 連結された文字起こし。
+    """
+    stitched = ""
+    for piece in pieces:
+        piece = piece.strip()
+        if not stitched:
+            stitched = piece
+            continue
+
+        overlap = _find_overlap(stitched, piece)
+        if overlap:
+            stitched = stitched[:overlap[0]] + piece[overlap[1]:]
+        else:
+            stitched = f"{stitched}\n{piece}"
+    return stitched
+
+def _find_overlap(previous, piece):
+    """
+    前の区間の末尾と次の区間の先頭で最も長く一致する部分を探します。
+
+    Args:
+        previous (str): 前の区間までの文字起こし。
+        piece (str): 次の区間の文字起こし。
+
+    Returns:
+        tuple: (previous での一致の開始位置, piece での一致の開始位置, 一致した文字数)。一致が短い場合はNone。
+    """
+    tail_offset = max(len(previous) - STITCH_WINDOW_CHARS, 0)
+    tail = previous[tail_offset:]
+    head = piece[:STITCH_WINDOW_CHARS]
+    match = difflib.SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(0, len(tail), 0, len(head))
+    if match.size < STITCH_MIN_MATCH_CHARS:
+        return None
+    return tail_offset + match.a, match.b, match.size
+
+def trim_overlap(previous, piece):
+    """
+    次の区間の文字起こしから、前の区間と重なる部分までを取り除きます（逐次受け取る文字起こし用）。
+    前の区間の文字起こしは送信済みのため変更せず、次の区間の一致した部分より後ろだけを返します。
+
+    Args:
+        previous (str): 前の区間までの文字起こし（末尾の STITCH_WINDOW_CHARS 文字があればよい）。
+        piece (str): 次の区間の文字起こしの先頭。
+
+    Returns:
+        str: 前の区間の後ろに続ける文字起こし。
+    """
+    overlap = _find_overlap(previous, piece)
+    if overlap is None:
+        return f"\n{piece.lstrip()}"
+    return piece[overlap[1] + overlap[2]:]
+
+def _parse_transcription(transcription_response):
+    """
+    文字起こしのレスポンスから文字起こし本文を取り出します。
+
+    Args:
+        transcription_response: generate_contentのレスポンス。
+
+    Returns:
+        str: 文字起こし本文。
     """
     try:
-        # ファイルをアップロード
-        audio_file = genai_client.files.upload(file=file_path)
-        
-        # 文字起こしリクエスト
-        transcription_prompt = """
-            <goal>ボイスメモの内容を正確に文字に起こしてください。</goal>
-            <role>あなたは音声文字起こしの専門家で、話し言葉を正確にテキストに変換することが得意です。</role>
-            <premise>この音声は独り言で考え事をしているボイスメモです。話題が突然変わったり、元の話題に戻ったりします。何か正解を出したいというよりは無数に浮かぶアイディアを言い連ねています。</premise>
-            <goal-detail>
-                <1>音声内容をできるだけ正確に文字に起こしてください。</1>
-                <2>「ええと」や「あーー」などの言い淀みは除去して構いません。</2>
-                <3>話し手の感情や語調のニュアンスをできるだけ残すようにしてください。</3>
-                <4>文脈を無くさないように、話し言葉の自然な流れを維持してください。</4>
-            </goal-detail>
-            <output-format>
-            純粋な文字起こしのテキストを出力してください。
-            ```json
-            {
-                "transcription": "文字起こしの内容をここに記載"
-            }
-            ```
-            </output-format>
-            <instructions>
-                <step1>ボイスメモを日本語で純粋に文字起こししてください。</step1>
-                <step2>「ええと」や「あーー」など言葉に詰まっている部分を削除して、聞きやすい文章にしてください。</step2>
-                <step3>話の流れや文脈、感情表現はそのまま保持してください。</step3>
-                <step4>整形や要約はせず、元の発言内容をそのまま文字に起こしてください。</step4>
-            </instructions>
-        """
-
-        wrapped_transcription_prompt = textwrap.dedent(transcription_prompt)
-
-        transcription_response = genai_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[wrapped_transcription_prompt, audio_file],
+        transcription_response_parsed = transcription_response.parsed
+        transcription_response_dict = json.loads(transcription_response_parsed.model_dump_json(indent=2))
+        return transcription_response_dict['transcription']
+    except:
+        return transcription_response.text
+
+def select_pipeline_mode(duration_seconds):
+    """
+    録音の長さから文字起こしと要約の実行方法を選びます。
+    短い録音は1回のリクエストで処理し、長い録音や長さが分からない場合は2段階で処理します。
+
+    Args:
+        duration_seconds (float): 録音の長さ（秒）。
+
+    Returns:
+        str: "single" または "two_step"。
+    """
+    if GEMINI_PIPELINE_MODE in ('single', 'two_step'):
+        return GEMINI_PIPELINE_MODE
+    if duration_seconds and duration_seconds <= SINGLE_CALL_MAX_SECONDS:
+        return 'single'
+    return 'two_step'
+
+def _usage_to_dict(usage_metadata):
+    """
+    レスポンスのusage_metadataから記録するトークン数を取り出します。
+
+    Args:
+        usage_metadata: generate_contentのレスポンスのusage_metadata。
+
+    Returns:
+        dict: トークン数の辞書。
+    """
+    if usage_metadata is None:
+        return {}
+    return {
+        'prompt_token_count': usage_metadata.prompt_token_count,
+        'cached_content_token_count': usage_metadata.cached_content_token_count,
+        'candidates_token_count': usage_metadata.candidates_token_count,
+        'total_token_count': usage_metadata.total_token_count,
+    }
+
+class GeminiUnavailableError(Exception):
+    """
+    すべてのモデルで再試行しても混雑・障害が解消しなかったことを表す例外。
+    処理を失敗として記録し、後で再試行させるために送出する（エラーのページは作成しない）。
+    """
+
+def _status_code(error):
+    """
+    例外からHTTPのステータスコードを取り出します（google.genai.errors.APIErrorはcodeを持つ）。
+
+    Args:
+        error (Exception): 例外。
+
+    Returns:
+        int: ステータスコード。取り出せない場合はNone。
+    """
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+class ModelRouter:
+    """
+    ステージと録音の長さからモデルの優先順を選び、429/5xxの再試行とモデルの切り替えを行うクラス。
+    ルーティングの結果・再試行回数・切り替え回数はインスタンス内で集計し、構造化ログとして出力します。
+    """
+
+    def __init__(self, chains, long_memo_seconds=LONG_MEMO_SECONDS, max_retries=GEMINI_MAX_RETRIES,
+                 retry_base_seconds=GEMINI_RETRY_BASE_SECONDS, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE):
+        """
+        Args:
+            chains (dict): ルート名（short / transcription / summary / long_summary）ごとのモデルの優先順。
+            long_memo_seconds (int): 長い録音とみなす長さ（秒）。
+            max_retries (int): 同じモデルで再試行する回数。
+            retry_base_seconds (float): 再試行までの待機時間の基準値（秒）。
+            requests_per_minute (float): モデルごとの1分あたりのリクエスト数の上限（0の場合は制限しない）。
+        """
+        self.chains = chains
+        self.long_memo_seconds = long_memo_seconds
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.requests_per_minute = requests_per_minute
+        self.rate_limiters = {}
+        self.lock = threading.Lock()
+        self.metrics = Counter()
+
+    def signature(self):
+        """
+        ルーティングの設定を表す文字列を返します（結果キャッシュのキーに含める）。
+        """
+        return ';'.join(f"{route}={','.join(models)}" for route, models in sorted(self.chains.items()))
+
+    def route(self, stage, duration_seconds=None):
+        """
+        ステージと録音の長さからルートとモデルの優先順を選びます。
+
+        Args:
+            stage (str): ステージ名（区間ごとの文字起こしは "transcription[00:10:00]" の形式）。
+            duration_seconds (float): 録音の長さ（秒）。
+
+        Returns:
+            tuple: (ルート名, モデルの優先順のリスト)
+        """
+        stage = stage.split('[')[0]
+        if stage == 'transcription_and_summary':
+            route = 'short'
+        elif stage in ('transcription', 'transcription_stream'):
+            route = 'transcription'
+        elif stage == 'summary_section':
+            # 長い録音でも、区切りごとの要約は短い文字起こしが対象のため通常の要約と同じモデルを使う
+            route = 'summary'
+        elif duration_seconds and duration_seconds >= self.long_memo_seconds:
+            route = 'long_summary'
+        else:
+            route = 'summary'
+        return route, self.chains[route]
+
+    def _acquire(self, model):
+        """
+        モデルごとのレート制限のトークンを取得します。
+        """
+        if not self.requests_per_minute:
+            return
+        with self.lock:
+            limiter = self.rate_limiters.setdefault(model, TokenBucket(self.requests_per_minute / 60, capacity=max(1, self.requests_per_minute / 60)))
+        limiter.acquire()
+
+    def _retry_wait(self, attempt):
+        """
+        再試行までの待機時間（指数バックオフ + ジッター）を求めます。
+        """
+        return min(self.retry_base_seconds * 2 ** attempt, GEMINI_RETRY_MAX_SECONDS) * (0.5 + random.random() / 2)
+
+    def _count(self, *key):
+        with self.lock:
+            self.metrics[key] += 1
+
+    def call(self, stage, duration_seconds, request):
+        """
+        優先順にモデルを試し、429/5xxの場合は待機して再試行、再試行しても失敗した場合は次のモデルに切り替えます。
+
+        Args:
+            stage (str): ステージ名。
+            duration_seconds (float): 録音の長さ（秒）。
+            request (callable): モデル名を受け取りリクエストを実行する関数。
+
+        Returns:
+            tuple: (レスポンス, 使用したモデル, 再試行回数)
+
+        Raises:
+            GeminiUnavailableError: すべてのモデルで混雑・障害が続いた場合。
+        """
+        route, models = self.route(stage, duration_seconds)
+        retries = 0
+        last_error = None
+        for index, model in enumerate(models):
+            if index > 0:
+                self._count('failover', route, models[index - 1], model)
+                print(f"Geminiのモデルを切り替えます: {models[index - 1]} -> {model} (ステージ: {stage}, 理由: {last_error})")
+            for attempt in range(self.max_retries + 1):
+                self._acquire(model)
+                try:
+                    response = request(model)
+                    self._count('route', route, model)
+                    return response, model, retries
+                except Exception as e:
+                    code = _status_code(e)
+                    if code not in FAILOVER_STATUS_CODES:
+                        raise
+                    last_error = e
+                    self._count('error', model, code)
+                    # 404（モデルが存在しない）は再試行しても解消しないため、すぐに次のモデルに切り替える
+                    if code == 404 or attempt == self.max_retries:
+                        break
+                    retries += 1
+                    self._count('retry', model)
+                    wait_seconds = self._retry_wait(attempt)
+                    print(f"Geminiからステータスコード={code}が返されたため {wait_seconds:.1f}秒後に再試行します (モデル: {model})")
+                    time.sleep(wait_seconds)
+        self._count('exhausted', route)
+        raise GeminiUnavailableError(f"すべてのモデル（{', '.join(models)}）で {stage} に失敗しました: {last_error}") from last_error
+
+    def retry(self, operation, func):
+        """
+        モデルに依存しない操作（ファイルのアップロードなど）を、429/5xxの場合に待機して再試行します。
+
+        Args:
+            operation (str): 操作の名前（ログと集計に使用）。
+            func (callable): 実行する関数。
+
+        Returns:
+            関数の戻り値。
+
+        Raises:
+            GeminiUnavailableError: 再試行しても混雑・障害が解消しなかった場合。
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return func()
+            except Exception as e:
+                code = _status_code(e)
+                if code not in RETRYABLE_STATUS_CODES:
+                    raise
+                self._count('error', operation, code)
+                if attempt == self.max_retries:
+                    self._count('exhausted', operation)
+                    raise GeminiUnavailableError(f"{operation} に失敗しました: {e}") from e
+                self._count('retry', operation)
+                wait_seconds = self._retry_wait(attempt)
+                print(f"Geminiからステータスコード={code}が返されたため {wait_seconds:.1f}秒後に再試行します ({operation})")
+                time.sleep(wait_seconds)
+
+    def report(self):
+        """
+        ルーティング・再試行・切り替えの回数を構造化ログとして出力し、その内容を返します。
+
+        Returns:
+            dict: 種類ごとの回数（キーは "route:summary:gemini-2.5-flash" の形式）。
+        """
+        with self.lock:
+            counts = {':'.join(str(part) for part in key): count for key, count in self.metrics.items()}
+        emit({'message': "gemini router metrics", 'span': "gemini.router", 'counts': counts})
+        return counts
+
+def _parse_model_chain(value):
+    return [model.strip() for model in value.split(',') if model.strip()]
+
+model_router = ModelRouter({
+    'short': _parse_model_chain(GEMINI_SHORT_MODELS),
+    'transcription': _parse_model_chain(GEMINI_TRANSCRIPTION_MODELS),
+    'summary': _parse_model_chain(GEMINI_SUMMARY_MODELS),
+    'long_summary': _parse_model_chain(GEMINI_LONG_SUMMARY_MODELS),
+})
+
+class GeminiSession:
+    """
+    1つのボイスメモの処理で使うGeminiのファイルとコンテキストキャッシュを管理するクラス。
+    アップロードしたファイルは再試行で再利用し、終了時に削除します。区間ごとの文字起こしでは、区間の音声を切り出してアップロードします。
+    """
+
+    def __init__(self, file_path=None, audio_file=None, duration_seconds=None):
+        """
+        Args:
+            file_path (str): 音声ファイルのパス。
+            audio_file (types.File): アップロード済みのファイル。指定された場合はfile_pathのアップロードを省略します。
+            duration_seconds (float): 録音の長さ（秒）。モデルの選択に使用します。
+        """
+        self.file_path = file_path
+        self.audio_file = audio_file
+        self.duration_seconds = duration_seconds
+        self.cached_content = None
+        self.cached_content_model = None
+        self.stage_metrics = []
+        self._summary_system_instruction = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def summary_system_instruction(self):
+        """
+        要約のシステム指示を返します。Notionのデータベースの既存のタグを末尾に加え、タグの表記ゆれを抑えます。
+        既存のタグは変わることがあるため、共通部分の後ろに置き、セッション内では同じ指示を使います。
+
+        Returns:
+            str: 要約のシステム指示。
+        """
+        if self._summary_system_instruction is None:
+            self._summary_system_instruction = SYSTEM_PREAMBLE + SUMMARY_INSTRUCTION + tag_vocabulary_prompt()
+        return self._summary_system_instruction
+
+    def get_audio_file(self):
+        """
+        アップロード済みのファイルを返します。未アップロードの場合のみアップロードします。
+
+        Returns:
+            types.File: アップロード済みの音声ファイル。
+        """
+        if self.audio_file is None:
+            with span("gemini.upload", streaming=False, bytes=os.path.getsize(self.file_path)):
+                self.audio_file = model_router.retry('files.upload', lambda: get_genai_client().files.upload(file=self.file_path))
+        return self.audio_file
+
+    def generate(self, stage, contents, config, uncached_request=None):
+        """
+        ルーターが選んだモデルでgenerate_contentを実行し、ステージごとのレイテンシとトークン数を記録します。
+        429/5xxの場合は再試行し、解消しない場合は次のモデルに切り替えます。
+
+        Args:
+            stage (str): ステージ名。
+            contents: リクエストの内容。
+            config (dict): リクエストの設定。
+            uncached_request (tuple): コンテキストキャッシュを使わない場合の (contents, config)。
+                キャッシュを作成したモデルとは別のモデルに切り替えた場合に使用します。
+
+        Returns:
+            レスポンス。
+        """
+        def request(model):
+            request_contents, request_config = contents, config
+            if 'cached_content' in config and model != self.cached_content_model:
+                # コンテキストキャッシュはモデルごとに作成されるため、切り替え先のモデルでは使えない
+                request_contents, request_config = uncached_request
+            with gemini_semaphore:
+                return get_genai_client().models.generate_content(model=model, contents=request_contents, config=request_config)
+
+        route, _ = model_router.route(stage, self.duration_seconds)
+        with span("gemini.generate_content", stage=stage, route=route, cached=self.cached_content is not None) as s:
+            start = time.perf_counter()
+            response, model, retries = model_router.call(stage, self.duration_seconds, request)
+            usage = _usage_to_dict(response.usage_metadata)
+            s.set(model=model, retries=retries, **usage)
+        self.stage_metrics.append(dict(stage=stage, model=model, retries=retries, latency=round(time.perf_counter() - start, 3), **usage))
+        return response
+
+    def can_segment(self):
+        """
+        音声を区間に切り出せるか（ローカルに音声ファイルがあるか）を返します。
+        """
+        return bool(self.file_path) and os.path.exists(self.file_path)
+
+    def plan_segments(self, duration_seconds):
+        """
+        録音を文字起こしの区間に分割します。区間の境目はできるだけ無音の位置に寄せます。
+
+        Args:
+            duration_seconds (float): 録音の長さ（秒）。
+
+        Returns:
+            list: (開始秒, 終了秒) のタプルのリスト。
+        """
+        with span("audio.detect_silences") as s:
+            silences = detect_silences(self.file_path)
+            s.set(silences=len(silences))
+        return plan_transcription_segments(duration_seconds, silences=silences)
+
+    @contextlib.contextmanager
+    def segment_file(self, index, segment):
+        """
+        音声の区間を切り出してGeminiにアップロードし、使い終わったら切り出したファイルとアップロードしたファイルを削除します。
+
+        Args:
+            index (int): 区間の番号。
+            segment (tuple): (開始秒, 終了秒)。
+
+        Yields:
+            types.File: 区間の音声のファイル。
+        """
+        root, extension = os.path.splitext(self.file_path)
+        piece_path = f"{root}.part{index}{extension}"
+        uploaded = None
+        try:
+            with span("audio.cut_segment", start=segment[0], end=segment[1]) as s:
+                cut_audio_segment(self.file_path, piece_path, *segment)
+                s.set(bytes=os.path.getsize(piece_path))
+            with span("gemini.upload", streaming=False, bytes=os.path.getsize(piece_path)):
+                uploaded = model_router.retry('files.upload', lambda: get_genai_client().files.upload(file=piece_path))
+            yield uploaded
+        finally:
+            if uploaded is not None:
+                try:
+                    get_genai_client().files.delete(name=uploaded.name)
+                except Exception as e:
+                    print(f"Geminiからの区間のファイル削除中にエラーが発生しました: {e}")
+            if os.path.exists(piece_path):
+                os.remove(piece_path)
+
+    def transcribe(self, segment=None, index=0):
+        """
+        音声ファイル全体、または指定された区間を文字起こしします。
+        区間を指定した場合は、その区間だけを切り出した音声をアップロードして文字起こしします。
+
+        Args:
+            segment (tuple): (開始秒, 終了秒)。Noneの場合はファイル全体。
+            index (int): 区間の番号（切り出したファイルの名前に使用）。
+
+        Returns:
+            str: 文字起こし本文。
+        """
+        from schema import TranscriptionResponse
+
+        def request(audio_file, stage):
+            return self.generate(
+                stage,
+                contents=[TRANSCRIPTION_PROMPT, audio_file],
+                config={
+                    'system_instruction': SYSTEM_PREAMBLE,
+                    'response_mime_type': 'application/json',
+                    'response_schema': TranscriptionResponse,
+                },
+            )
+
+        if segment is None:
+            return _parse_transcription(request(self.get_audio_file(), "transcription"))
+        with self.segment_file(index, segment) as audio_file:
+            return _parse_transcription(request(audio_file, f"transcription[{_format_timestamp(segment[0])}]"))
+
+    def transcribe_segmented(self, duration_seconds):
+        """
+        長い録音を重なりのある区間に分割し、区間ごとに切り出した音声をスレッドプールで並列に文字起こしして連結します。
+        各リクエストは区間の音声だけを処理するため、処理時間は録音の長さではなく、区間数と並列数の比で決まります。
+
+        Args:
+            duration_seconds (float): 録音の長さ（秒）。
+
+        Returns:
+            str: 連結された文字起こし。
+        """
+        segments = self.plan_segments(duration_seconds)
+        print(f"{len(segments)}区間に分割して文字起こしします（並列数: {TRANSCRIPTION_MAX_WORKERS}）")
+        with ThreadPoolExecutor(max_workers=TRANSCRIPTION_MAX_WORKERS) as executor:
+            # スパンにイベントIDを引き継ぐため、呼び出し元のコンテキストで各区間を実行する
+            pieces = list(executor.map(
+                lambda indexed: contextvars.copy_context().run(self.transcribe, indexed[1], indexed[0]), enumerate(segments),
+            ))
+        return stitch_transcriptions(pieces)
+
+    def transcribe_stream(self, segment=None, index=0):
+        """
+        generate_content_streamで文字起こしを行い、受け取ったテキストを順次返します。
+        最初のチャンクを受け取るまでに429/5xxが返された場合は、ルーターが再試行・モデルの切り替えを行います。
+
+        Args:
+            segment (tuple): (開始秒, 終了秒)。指定した場合は区間の音声だけを切り出して文字起こしします。
+            index (int): 区間の番号（切り出したファイルの名前に使用）。
+
+        Yields:
+            str: 文字起こしのテキストの断片。
+        """
+        if segment is not None:
+            with self.segment_file(index, segment) as audio_file:
+                yield from self._transcribe_stream(audio_file)
+        else:
+            yield from self._transcribe_stream(self.get_audio_file())
+
+    def transcribe_stream_segmented(self, duration_seconds):
+        """
+        長い録音を区間に分割し、区間の順に切り出した音声をストリーミングで文字起こしします。
+        1回のリクエストの出力は区間の長さ分だけになるため、出力トークンの上限で文字起こしが途切れません。
+        区間の重なりで重複する部分は、次の区間の先頭を STITCH_WINDOW_CHARS 文字受け取った時点で取り除きます。
+
+        Args:
+            duration_seconds (float): 録音の長さ（秒）。
+
+        Yields:
+            str: 文字起こしのテキストの断片。
+        """
+        segments = self.plan_segments(duration_seconds)
+        print(f"{len(segments)}区間に分割してストリーミングで文字起こしします")
+        tail = ""
+        for index, segment in enumerate(segments):
+            head = "" if index else None
+            for text in self.transcribe_stream(segment, index):
+                if head is not None:
+                    head += text
+                    if len(head) < STITCH_WINDOW_CHARS:
+                        continue
+                    text, head = trim_overlap(tail, head), None
+                if text:
+                    tail = (tail + text)[-STITCH_WINDOW_CHARS:]
+                    yield text
+            if head:
+                text = trim_overlap(tail, head)
+                tail = (tail + text)[-STITCH_WINDOW_CHARS:]
+                yield text
+
+    def _transcribe_stream(self, audio_file):
+        """
+        transcribe_streamの本体。指定したファイルをストリーミングで文字起こしします。
+        """
+        def request(model):
+            with gemini_semaphore:
+                stream = get_genai_client().models.generate_content_stream(
+                    model=model,
+                    contents=[STREAMING_TRANSCRIPTION_PROMPT, audio_file],
+                    config={'system_instruction': SYSTEM_PREAMBLE},
+                )
+                # エラーは最初のチャンクの受信時に返されるため、ここまでをルーターの再試行の対象にする
+                return next(stream, None), stream
+
+        with span("gemini.generate_content_stream", stage="transcription_stream") as s:
+            start = time.perf_counter()
+            (first_chunk, stream), model, retries = model_router.call("transcription_stream", self.duration_seconds, request)
+            s.set(model=model, retries=retries, first_chunk_ms=round((time.perf_counter() - start) * 1000, 1))
+            chunk = first_chunk
+            chunks = 0
+            while chunk is not None:
+                chunks += 1
+                if chunk.text:
+                    yield chunk.text
+                usage = chunk.usage_metadata
+                chunk = next(stream, None)
+            usage = _usage_to_dict(usage) if chunks else {}
+            s.set(chunks=chunks, **usage)
+        self.stage_metrics.append(dict(stage="transcription_stream", model=model, retries=retries, latency=round(time.perf_counter() - start, 3), **usage))
+
+    def summarize_section(self, section):
+        """
+        長い録音の文字起こしの一部を要約します。
+
+        Args:
+            section (str): 文字起こしの一部。
+
+        Returns:
+            dict: SummaryResponseの辞書。
+        """
+        from schema import SummaryResponse
+
+        response = self.generate(
+            "summary_section",
+            contents=[f"<transcription>\n{section}\n</transcription>", SECTION_SUMMARY_REQUEST],
             config={
+                'system_instruction': self.summary_system_instruction(),
                 'response_mime_type': 'application/json',
-                'response_schema': TranscriptionResponse,
+                'response_schema': SummaryResponse,
             },
         )
-        try:
-            transcription_response_parsed: TranscriptionResponse = transcription_response.parsed
-            transcription_response_dict = json.loads(transcription_response_parsed.model_dump_json(indent=2))
-            transcription = transcription_response_dict['transcription']
-        except:
-            transcription = transcription_response.text
-    except Exception as e: # エラーが発生した場合
-        print(f"文字起こし中にエラーが発生しました: {e}")
-        return {
-            "markdown": f"# 文字起こしエラー\n\n処理中にエラーが発生しました: {str(e)}",
-            "tags": ["文字起こしエラー"]
-        }
-    
-    try:        
-        # 要約リクエスト
-        summary_prompt = f"""
-            <goal>文字起こしされたボイスメモの内容を整理して、きれいなメモにまとめてください。</goal>
-            <role>あなたはソクラテスの弟子なみの聞き上手で、独り言のメモから情報が整理されたメモを作成することが得意です。</role>
-            <premise>この文字起こしは独り言で考え事をしているボイスメモです。話題が突然変わったり、元の話題に戻ったりします。何か正解を出したいというよりは無数に浮かぶアイディアを言い連ねています。</premise>
-            <goal-detail>
-                <1>話題ごとに見出し（###）を作って、情報の順番を整理してください。話している順番に関わらず、設定した見出しに内容を足していってください。</1>
-                <2>感情や心情を省略、要約せずに、できるだけニュアンスを残すようにしてください。</2>
-                <3>箇条書きのようにきれいにまとめないでください。話の文脈を無くさないように、話し言葉口調のままの文章でまとめてください。</3>
-                <4>整理はしますが、情報の要約はしないでください。内容の本質は保持してください。</4>
-                <5>全体を見て「〇〇する！」「〇〇してみようかな」「〇〇興味ある」みたいに次の行動をするべきものを next-actionsにまとめてください。</5>
-            </goal-detail>
-            <output-format>
-            Notionに適したMarkdown形式で出力してください。
-            見出しは細かく作成することを意識し、1つの見出しに対して、最大でも150文字以内くらいにまとめてください。
-            ```json
-            {{
-                "markdown": "### 話題1\\n内容1\\n内容2\\n### 話題2\\n内容1\\n内容2\\n### 話題3\\n内容1\\n内容2\\n...(いくつでも)",
-                "nextActions": ["やること1", "やること2", "やること3"],
-                "tags": ["タグ1", "タグ2", "タグ3"]
-            }}
-            ```
-            </output-format>
-            <instructions>
-                <step1>このボイスメモを日本語で純粋に文字起こししてください。</step1>
-                <step2>「ええと」や「あーー」など言葉に詰まっている部分などを削除して、きれいな文章にしてください。</step2>
-                <step3>文章の中から話題（トピックス）を任意の数選定して、題名（タイトル）をつけ、マークダウンで見出し（###）を作ってください。タイトルはその話題の中での気づきや、結論などを短い文章にしたものを設定。イメージはインタビュー記事の段落ごとについているタイトルのような感じ。</step3>
-                <step4>考え事の内容をできるだけ削らないようにして、各見出しの中にまとめてください。</step4>
-                <step5>step4までの内容をまとめて、1つのMarkdownを出力してください。</step5>
-                <step6>整理した内容の話題の中から「タグ」を最大3つ重要な順に生成してください。何についての話題なのか簡単に特定できるように具体的かつ短い単語にしてください。（例：プログラミング、英語、恋愛、AI、転職...）具体的な内容が分かりづらいものはやめて。</step6>
-            </instructions>
-            <transcription>
-                {transcription}
-            </transcription>
-        """
-        wrapped_summary_prompt = textwrap.dedent(summary_prompt)
-        summary_response = genai_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=wrapped_summary_prompt,
+        response_parsed: SummaryResponse = response.parsed
+        return json.loads(response_parsed.model_dump_json(indent=2))
+
+    def transcribe_and_summarize_single(self):
+        """
+        1回のリクエストで文字起こしと要約を同時に行います。
+
+        Returns:
+            dict: TranscriptionSummaryResponseの辞書。
+        """
+        from schema import TranscriptionSummaryResponse
+
+        response = self.generate(
+            "transcription_and_summary",
+            contents=[SINGLE_CALL_PROMPT, self.get_audio_file()],
             config={
+                'system_instruction': self.summary_system_instruction(),
                 'response_mime_type': 'application/json',
-                'response_schema': SummaryResponse,
+                'response_schema': TranscriptionSummaryResponse,
             },
         )
-        
-        response_parsed: SummaryResponse = summary_response.parsed
-        response_dict = json.loads(response_parsed.model_dump_json(indent=2))
-
-        return response_dict
-    
-    except Exception as e: # エラーが発生した場合
-        print(f"文字起こしまたは要約中にエラーが発生しました: {e}")
-        return {
-            "markdown": f"# 要約エラー\n\n処理中にエラーが発生しました: {str(e)}",
-            "tags": ["要約エラー"]
-        }
\ No newline at end of file
+        response_parsed: TranscriptionSummaryResponse = response.parsed
+        return json.loads(response_parsed.model_dump_json(indent=2))
+
+    def cache_transcription(self, transcription):
+        """
+        共通のシステム指示・要約の指示・文字起こしをコンテキストキャッシュに格納します。
+        文字起こしが短くキャッシュの最小トークン数に満たない場合や、作成に失敗した場合はキャッシュを使いません。
+
+        Args:
+            transcription (str): 文字起こし本文。
+
+        Returns:
+            types.CachedContent: 作成したキャッシュ。作成しなかった場合はNone。
+        """
+        if self.cached_content is not None or len(transcription) < CONTEXT_CACHE_MIN_CHARS:
+            return self.cached_content
+        try:
+            # キャッシュは要約で最初に試すモデル用に作成する
+            model = model_router.route('summary', self.duration_seconds)[1][0]
+            self.cached_content = get_genai_client().caches.create(
+                model=model,
+                config={
+                    'system_instruction': self.summary_system_instruction(),
+                    'contents': [f"<transcription>\n{transcription}\n</transcription>"],
+                    'ttl': f"{CONTEXT_CACHE_TTL_SECONDS}s",
+                },
+            )
+            self.cached_content_model = model
+            print(f"文字起こしをコンテキストキャッシュに格納しました: {self.cached_content.name} (モデル: {model})")
+        except Exception as e:
+            print(f"コンテキストキャッシュの作成に失敗したため、文字起こしをリクエストに含めます: {e}")
+        return self.cached_content
+
+    def summarize(self, transcription):
+        """
+        文字起こしを整理されたメモにまとめます。
+        キャッシュがある場合は、要約リクエストとして差分のみを送信します。
+
+        Args:
+            transcription (str): 文字起こし本文。
+
+        Returns:
+            dict: SummaryResponseの辞書。
+        """
+        from schema import SummaryResponse
+
+        for attempt in range(1, SUMMARY_MAX_ATTEMPTS + 1):
+            try:
+                response_config = {'response_mime_type': 'application/json', 'response_schema': SummaryResponse}
+                uncached_request = (
+                    [f"<transcription>\n{transcription}\n</transcription>", SUMMARY_REQUEST],
+                    dict(response_config, system_instruction=self.summary_system_instruction()),
+                )
+                cached_content = self.cache_transcription(transcription)
+                if cached_content is not None:
+                    contents, config = SUMMARY_REQUEST, dict(response_config, cached_content=cached_content.name)
+                else:
+                    contents, config = uncached_request
+
+                summary_response = self.generate("summary", contents=contents, config=config, uncached_request=uncached_request)
+                response_parsed: SummaryResponse = summary_response.parsed
+                return json.loads(response_parsed.model_dump_json(indent=2))
+            except GeminiUnavailableError:
+                # ルーターがすべてのモデルで再試行済みのため、ここでは再試行しない
+                raise
+            except Exception as e:
+                if attempt == SUMMARY_MAX_ATTEMPTS:
+                    raise
+                print(f"要約に失敗したため再試行します（{attempt}/{SUMMARY_MAX_ATTEMPTS}）: {e}")
+
+    def close(self):
+        """
+        作成したコンテキストキャッシュとアップロードしたファイルを削除します。
+        """
+        if self.cached_content is not None:
+            try:
+                get_genai_client().caches.delete(name=self.cached_content.name)
+            except Exception as e:
+                print(f"コンテキストキャッシュの削除中にエラーが発生しました: {e}")
+            self.cached_content = None
+        if self.audio_file is not None:
+            try:
+                get_genai_client().files.delete(name=self.audio_file.name)
+                print(f"Geminiからファイルを削除しました: {self.audio_file.name}")
+            except Exception as e:
+                print(f"Geminiからのファイル削除中にエラーが発生しました: {e}")
+            self.audio_file = None
+
+def get_cached_summary(content_hash):
+    """
+    同じ音声・モデル・プロンプトで処理済みの結果をキャッシュから取得します。
+
+    Args:
+        content_hash (str): 音声ファイルの内容ハッシュ（例: "md5:xxxx"）。
+
+    Returns:
+        dict: transcribe_and_summarizeと同じ形式の辞書。キャッシュにない場合はNone。
+    """
+    if not content_hash:
+        return None
+    cached = get_cached_result(generate_cache_key(content_hash, model_router.signature(), PROMPT_VERSION))
+    if cached is None:
+        return None
+    return dict(cached['summary'], transcription=cached['transcription'])
+
+def transcribe_and_summarize(file_path, audio_file=None, duration_seconds=None, content_hash=None):
+    """
+    Gemini APIを使用して音声ファイルを文字起こしし、要約します。
+
+    Args:
+        file_path (str): 音声ファイルのパス。
+        audio_file (types.File): アップロード済みのファイル。指定された場合はfile_pathのアップロードを省略します。
+        duration_seconds (float): 録音の長さ（秒）。区間の長さを超える場合は分割して並列に文字起こしします。
+        content_hash (str): 音声ファイルの内容ハッシュ。指定された場合は成功した結果をキャッシュに保存します。
+
+    Returns:
+        dict: 文字起こしと要約の結果を含む辞書。
+    """
+    try:
+        with GeminiSession(file_path, audio_file=audio_file, duration_seconds=duration_seconds) as session:
+            return _transcribe_and_summarize(session, duration_seconds, content_hash)
+    finally:
+        model_router.report()
+
+def _transcribe_and_summarize(session, duration_seconds, content_hash):
+    """
+    transcribe_and_summarizeの本体。
+
+    Args:
+        session (GeminiSession): 音声ファイルのセッション。
+        duration_seconds (float): 録音の長さ（秒）。
+        content_hash (str): 音声ファイルの内容ハッシュ。
+
+    Returns:
+        dict: 文字起こしと要約の結果を含む辞書。
+
+    Raises:
+        GeminiUnavailableError: すべてのモデルで混雑・障害が続いた場合。
+        Exception: 文字起こし・要約に失敗した場合。エラーのページは作成せず、呼び出し元が処理の失敗として記録して後で再試行する。
+    """
+    # 短い録音は1回のリクエストで処理（失敗した場合は2段階の処理にフォールバック）
+    if select_pipeline_mode(duration_seconds) == 'single':
+        try:
+            response_dict = session.transcribe_and_summarize_single()
+            transcription = response_dict.pop('transcription')
+            if content_hash:
+                set_cached_result(generate_cache_key(content_hash, model_router.signature(), PROMPT_VERSION), transcription, response_dict)
+            return dict(response_dict, transcription=transcription)
+        except GeminiUnavailableError:
+            raise
+        except Exception as e:
+            print(f"1回のリクエストでの文字起こしと要約に失敗したため、2段階で処理します: {e}")
+
+    # 文字起こしリクエスト（長い録音は区間に分割して並列実行）
+    if duration_seconds and duration_seconds > TRANSCRIPTION_SEGMENT_SECONDS and session.can_segment():
+        transcription = session.transcribe_segmented(duration_seconds)
+    else:
+        transcription = session.transcribe()
+
+    # 要約リクエスト
+    response_dict = session.summarize(transcription)
+    if content_hash:
+        set_cached_result(generate_cache_key(content_hash, model_router.signature(), PROMPT_VERSION), transcription, response_dict)
+    return dict(response_dict, transcription=transcription)
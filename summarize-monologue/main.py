@@ -1,72 +1,501 @@
 import functions_framework
 import os
 import json
-from cloud_storage_service import download_file_from_gcs, delete_file_from_gcs
-from gemini_service import transcribe_and_summarize
-from notion_service import send_to_notion
-from firestore_service import generate_event_id, try_start_processing, mark_processing_completed
+import time
+import asyncio
+import uuid
+from cloud_storage_service import download_file_from_gcs, delete_file_from_gcs, open_gcs_file_stream, read_gcs_file_header
+from audio_service import get_audio_duration, AUDIO_HEADER_BYTES, TRANSCODE_AUDIO, is_transcoding_available, get_transcoded_path, transcode_stream
+from gemini_service import transcribe_and_summarize, upload_audio_stream, get_cached_summary, TRANSCRIPTION_SEGMENT_SECONDS
+from firestore_service import generate_event_id, try_start_processing, mark_processing_completed, mark_processing_failed, release_processing, LeaseHeartbeat, LeaseLost
+from queue_service import enqueue_event
+from tag_service import get_tag_options
+from batch_service import processing_mode, defer_to_batch
+from archive_service import is_archive_enabled, build_archive_record, archive_memo
+from workspace_service import workspace_manager, reservation_bytes, WorkspaceBudgetExceeded, WorkspaceTooLarge
+from tracing import current_event_id, emit
 
 BUCKET_NAME = os.environ.get('BUCKET_NAME', 'gcs_bucket_name')
+# GCSからGeminiへ一時ファイルを経由せずにストリーミングでアップロードするか
+STREAM_INGEST = os.environ.get('STREAM_INGEST', 'true').lower() == 'true'
+# GCSトリガーではジョブをキューに登録するだけにし、処理はワーカー（drain_work_queue）で行うか
+QUEUE_ENABLED = os.environ.get('QUEUE_ENABLED', 'false').lower() == 'true'
+
+# 処理結果のメッセージ
+RESULT_COMPLETED = "処理が正常に完了しました"
+RESULT_SKIPPED = "Event already processed or in progress"
+RESULT_ENQUEUED = "キューに登録しました"
+RESULT_DEFERRED = "バッチ処理に登録しました"
+RESULT_TOO_LARGE = "音声ファイルが作業ディレクトリの予算より大きいため処理できません"
+
+class StageTimer:
+    """
+    パイプラインの各ステージをスレッドで実行し、開始時刻と所要時間を記録するクラス
+    """
+
+    def __init__(self, event_id):
+        self.event_id = event_id
+        self.started_at = time.perf_counter()
+        self.stages = []
+        self.first_content_at = None
+
+    def mark_first_content(self):
+        """
+        最初の内容がNotionに書き込まれた時刻を記録します（2回目以降の呼び出しは無視します）。
+        """
+        if self.first_content_at is None:
+            self.first_content_at = time.perf_counter() - self.started_at
+
+    async def run(self, name, func, *args, **kwargs):
+        """
+        ブロッキングな処理をスレッドで実行し、所要時間を記録します。
+
+        Args:
+            name (str): ステージ名
+            func (callable): 実行する関数
+
+        Returns:
+            関数の戻り値
+        """
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            self.stages.append((name, start - self.started_at, end - start))
+
+    def report(self, result=None):
+        """
+        ステージごとの所要時間と、逐次実行した場合との差（クリティカルパスの短縮分）を出力します。
+        集計用に、同じ内容を1件の構造化ログとしても出力します。
+
+        Args:
+            result (str): 処理結果のメッセージ
+        """
+        wall_time = time.perf_counter() - self.started_at
+        sequential_time = sum(duration for _, _, duration in self.stages)
+        for name, offset, duration in sorted(self.stages, key=lambda stage: stage[1]):
+            print(f"ステージ {name}: 開始 +{offset:.3f}秒, 所要 {duration:.3f}秒 (イベントID: {self.event_id})")
+        print(f"全体 {wall_time:.3f}秒 / 逐次実行時 {sequential_time:.3f}秒 (短縮 {sequential_time - wall_time:.3f}秒)")
+        emit({
+            'message': "pipeline summary",
+            'span': "pipeline",
+            'event_id': self.event_id,
+            'status': 'ok' if result in (RESULT_COMPLETED, RESULT_SKIPPED, RESULT_DEFERRED) else 'error',
+            'result': result,
+            'latency_ms': round(wall_time * 1000, 1),
+            'sequential_ms': round(sequential_time * 1000, 1),
+            'first_content_ms': round(self.first_content_at * 1000, 1) if self.first_content_at is not None else None,
+            'stages': {name: round(duration * 1000, 1) for name, _, duration in self.stages},
+        })
+
+def stream_file_from_gcs_to_gemini(bucket_name, file_name):
+    """
+    GCSの音声ファイルを/tmpに保存せず、ストリームのままGeminiにアップロードします。
+    Cloud Functionsの/tmpはメモリ上にあるため、長い録音でもメモリ使用量をチャンクサイズ程度に抑えられます。
+
+    Args:
+        bucket_name (str): GCSバケット名
+        file_name (str): ファイル名
+
+    Returns:
+        types.File: アップロードされたファイル。失敗した場合はNone
+    """
+    opened = open_gcs_file_stream(bucket_name, file_name)
+    if opened is None:
+        return None
+
+    stream, content_type, _ = opened
+    try:
+        return upload_audio_stream(stream, content_type or 'audio/aiff')
+    finally:
+        stream.close()
+
+def transcode_file_from_gcs(bucket_name, file_name, output_path):
+    """
+    GCSの音声ファイルをストリームのままffmpegに流し込み、モノラル・16kHzのOpusに変換します。
+    変換前後のバイト数と、録音1分あたりの削減量を出力します。
+
+    Args:
+        bucket_name (str): GCSバケット名
+        file_name (str): ファイル名
+        output_path (str): 変換後の音声ファイルの保存先
+
+    Returns:
+        dict: 変換結果（バイト数・再生時間・所要時間）。失敗した場合はNone
+    """
+    opened = open_gcs_file_stream(bucket_name, file_name)
+    if opened is None:
+        return None
+
+    stream, _, _ = opened
+    try:
+        stats = transcode_stream(stream, output_path)
+    except Exception as e:
+        print(f"音声の変換中にエラーが発生しました: {e}")
+        return None
+    finally:
+        stream.close()
+
+    minutes = (stats['duration_seconds'] or 0) / 60
+    per_minute = f", 1分あたり {(stats['input_bytes'] - stats['output_bytes']) / minutes / 1024:.0f}KB削減" if minutes else ""
+    print(
+        f"音声を変換しました: {stats['input_bytes']} bytes → {stats['output_bytes']} bytes"
+        f" ({stats['input_bytes'] / max(stats['output_bytes'], 1):.1f}分の1{per_minute}, 所要 {stats['elapsed_seconds']:.2f}秒)"
+    )
+    return stats
+
+def remove_local_file(local_file_path):
+    """
+    一時ファイル（変換後のファイルを含む）が存在する場合に削除します。
+
+    Args:
+        local_file_path (str): 一時ファイルのパス
+    """
+    for path in (local_file_path, get_transcoded_path(local_file_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+async def _skip():
+    """
+    asyncio.gatherで実行しないステージの代わりに使うNoneを返すコルーチン
+    """
+    return None
 
 @functions_framework.cloud_event
 def summarize_monologue(cloud_event):
     """
     GCSへのファイルアップロードをトリガーに音声ファイルを処理する関数
-    
+    Functions Frameworkから呼び出される同期関数で、処理本体は非同期パイプラインで実行します。
+
     Args:
         cloud_event: CloudEventのオブジェクト
     """
-    data = cloud_event.data
+    if QUEUE_ENABLED:
+        data = cloud_event.data
+        enqueue_event(generate_event_id(data["bucket"], data["name"]), data)
+        return RESULT_ENQUEUED
+    return asyncio.run(summarize_monologue_async(cloud_event.data))
+
+@functions_framework.http
+def drain_work_queue(request):
+    """
+    キューに登録されたジョブを処理するワーカーの関数（Cloud Schedulerから定期的に呼び出す）
+
+    Args:
+        request: HTTPリクエスト
+
+    Returns:
+        tuple: 処理件数とキューの深さのJSON、ステータスコード、ヘッダー
+    """
+    from worker import drain_queue
+    summary = drain_queue()
+    return json.dumps(summary, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+
+@functions_framework.http
+def poll_gemini_batches(request):
+    """
+    Geminiのバッチジョブの完了を確認して結果をNotionに送信し、登録待ちのメモから新しいバッチジョブを作成する関数
+    （Cloud Schedulerから定期的に呼び出す）
+
+    Args:
+        request: HTTPリクエスト
+
+    Returns:
+        tuple: 処理結果のJSON、ステータスコード、ヘッダー
+    """
+    from batch_service import poll_batches
+    summary = poll_batches()
+    return json.dumps(summary, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+
+@functions_framework.http
+def generate_digest(request):
+    """
+    アーカイブしたメモから週次・月次のダイジェストを作成してNotionに送信する関数（Cloud Schedulerから定期的に呼び出す）
+    クエリパラメータ period（weekly / monthly）と date（期間に含まれる日付。省略時は前日）で対象期間を指定します。
+
+    Args:
+        request: HTTPリクエスト
+
+    Returns:
+        tuple: 処理結果のJSON、ステータスコード、ヘッダー
+    """
+    from datetime import date
+    from digest_service import generate_digest as build_and_send_digest, DIGEST_PERIODS
+
+    period = request.args.get('period', 'weekly')
+    if period not in DIGEST_PERIODS:
+        return json.dumps({'error': f"periodは{', '.join(DIGEST_PERIODS)}のいずれかを指定してください"}, ensure_ascii=False), 400, {'Content-Type': 'application/json'}
+    try:
+        reference = date.fromisoformat(request.args['date']) if request.args.get('date') else None
+    except ValueError:
+        return json.dumps({'error': "dateはYYYY-MM-DD形式で指定してください"}, ensure_ascii=False), 400, {'Content-Type': 'application/json'}
+    summary = build_and_send_digest(period, reference, force=request.args.get('force') == 'true')
+    return json.dumps(summary, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+
+async def _process_claimed_event(timer, data, event_id, lease, workspace, local_file_path, content_hash, result_json, header, downloaded):
+    """
+    処理開始を記録した後の文字起こし・要約・Notionへの送信・後片付けを行います。
+    Notionへの書き込みとバッチ処理への登録の前にリースを確認し、他の処理に引き継がれていた場合は LeaseLost を送出します。
+
+    Args:
+        timer (StageTimer): ステージの計測
+        data (dict): CloudEventのデータ
+        event_id (str): イベントID
+        lease (LeaseHeartbeat): リースのハートビート
+        workspace (Workspace): イベントの作業ディレクトリ
+        local_file_path (str): 一時ファイルのパス（作業ディレクトリ内）
+        content_hash (str): 音声ファイルの内容ハッシュ
+        result_json (dict): キャッシュから取得した結果。キャッシュにない場合はNone
+        header (bytes): 音声ファイルのヘッダー
+        downloaded (bool): 一時ファイルにダウンロード済みかどうか
+
+    Returns:
+        str: 処理結果のメッセージ
+    """
     bucket_name = data["bucket"]
     file_name = data["name"]
-    
+    duration_seconds = None
+    source = 'cache'
+
+    # 2. キャッシュになければ、音声ファイルをGeminiにアップロードして文字起こしと要約を実行
+    if result_json is None:
+        # 要約のプロンプトに含める既存のタグを、アップロードと並行して取得しておく（キャッシュの期限内であれば取得しない）
+        tag_prefetch = asyncio.create_task(timer.run("tag_options", get_tag_options))
+        duration_seconds = get_audio_duration(header) if header else None
+        print(f"録音の長さ: {duration_seconds} 秒")
+        audio_file = None
+        audio_path = local_file_path
+        # 長い録音は区間ごとに音声を切り出して文字起こしするため、ストリーミングせずに一時ファイルに保存する
+        needs_segments = bool(duration_seconds and duration_seconds > TRANSCRIPTION_SEGMENT_SECONDS)
+
+        # 非圧縮の音声はそのままだと大きいため、変換して転送量を減らす（失敗した場合は元の音声を使う）
+        transcoded = None
+        if TRANSCODE_AUDIO and is_transcoding_available():
+            transcoded = await timer.run("transcode", transcode_file_from_gcs, bucket_name, file_name, get_transcoded_path(local_file_path))
+        if transcoded is not None:
+            audio_path = get_transcoded_path(local_file_path)
+            duration_seconds = transcoded['duration_seconds'] or duration_seconds
+        elif STREAM_INGEST and not needs_segments:
+            audio_file = await timer.run("gemini_stream_upload", stream_file_from_gcs_to_gemini, bucket_name, file_name)
+
+        if transcoded is None and audio_file is None and not downloaded:
+            if needs_segments:
+                print("長い録音は区間ごとに切り出して文字起こしするため、一時ファイル経由で処理します")
+            elif STREAM_INGEST:
+                print("ストリーミングでのアップロードに失敗したため、一時ファイル経由で処理します")
+            # ストリーミング分しか予約していない場合は、ファイル全体の容量を追加で予約する
+            # （予算の空きが足りない場合は例外で再試行し、予算そのものを超える場合は再試行しない失敗として記録する）
+            try:
+                workspace.ensure(reservation_bytes(data.get("size")))
+            except (WorkspaceBudgetExceeded, WorkspaceTooLarge):
+                await tag_prefetch
+                raise
+            if not await timer.run("gcs_download", download_file_from_gcs, bucket_name, file_name, local_file_path):
+                await tag_prefetch
+                return "ファイルのダウンロード中にエラーが発生しました"
+        await tag_prefetch
+
+        # アップロード時に processing-mode=batch が指定されたメモは、Geminiのバッチジョブでまとめて処理する
+        if processing_mode(data) == 'batch':
+            lease.check()
+            await timer.run(
+                "batch_defer", defer_to_batch,
+                event_id, audio_path, audio_file=audio_file, duration_seconds=duration_seconds, content_hash=content_hash,
+                lease_owner=lease.lease_owner,
+            )
+            remove_local_file(local_file_path)
+            return RESULT_DEFERRED
+
+        # 長い録音は、文字起こしを逐次受け取りながら区切りごとに要約してNotionに追加する
+        # （Notionのモジュールを読み込むため、重複イベントでは読み込まないようここで読み込む）
+        from progressive_service import use_progressive, progressive_transcribe_and_summarize
+        if use_progressive(duration_seconds):
+            lease.check()
+            # 失敗した場合は途中まで作成したページをアーカイブして例外を送出するため、再試行時に最初からやり直す
+            result_json = await timer.run(
+                "gemini_progressive", progressive_transcribe_and_summarize,
+                file_name, audio_path, audio_file=audio_file, duration_seconds=duration_seconds,
+                content_hash=content_hash, on_first_content=timer.mark_first_content,
+            )
+            archive_record = _archive_record(timer, event_id, file_name, result_json, 'progressive', duration_seconds)
+            return await _finish_event(timer, event_id, lease, bucket_name, file_name, local_file_path, archive_record)
+
+        source = 'interactive'
+        result_json = await timer.run(
+            "gemini_transcribe_and_summarize", transcribe_and_summarize,
+            audio_path, audio_file=audio_file, duration_seconds=duration_seconds, content_hash=content_hash,
+        )
+
+    markdown_content = result_json["markdown"]
+    next_action_list = result_json.get("nextActions", [])
+    tags = result_json["tags"]
+
+    # 3. Notionに結果を送信（重複イベントでは読み込まないよう、ここで読み込む）
+    from notion_service import send_to_notion, format_next_actions
+    next_action_markdown = format_next_actions(next_action_list)
+    # リースが切れて他の処理に引き継がれていた場合は、同じメモのページを重複して作成しない
+    lease.check()
+    if not await timer.run("notion_send", send_to_notion, file_name, markdown_content, next_action_markdown, tags):
+        remove_local_file(local_file_path)
+        return "Notionへの送信中にエラーが発生しました"
+    timer.mark_first_content()
+
+    archive_record = _archive_record(timer, event_id, file_name, result_json, source, duration_seconds)
+    return await _finish_event(timer, event_id, lease, bucket_name, file_name, local_file_path, archive_record)
+
+def _archive_record(timer, event_id, file_name, result_json, source, duration_seconds):
+    """
+    アーカイブが有効な場合に、ここまでのステージの所要時間を含むアーカイブのレコードを作成します。
+
+    Returns:
+        dict: アーカイブのレコード。アーカイブが無効な場合はNone
+    """
+    if not is_archive_enabled():
+        return None
+    timings = {name: round(duration * 1000, 1) for name, _, duration in timer.stages}
+    return build_archive_record(event_id, file_name, result_json, source, timings=timings, duration_seconds=duration_seconds)
+
+async def _finish_event(timer, event_id, lease, bucket_name, file_name, local_file_path, archive_record=None):
+    """
+    Notionへの送信が終わったイベントの後処理（GCSのファイル削除・一時ファイルの削除・アーカイブ・処理完了の記録）を行います。
+
+    Args:
+        timer (StageTimer): ステージの計測
+        event_id (str): イベントID
+        lease (LeaseHeartbeat): リースのハートビート
+        bucket_name (str): バケット名
+        file_name (str): ファイル名
+        local_file_path (str): 一時ファイルのパス
+        archive_record (dict): アーカイブのレコード。Noneの場合はアーカイブしない
+
+    Returns:
+        str: 処理結果のメッセージ
+    """
+    # 4. GCSからのファイル削除・一時ファイルの削除・アーカイブ・処理完了の記録は互いに独立しているため並行して実行
+    # （リースを失っていた場合は、引き継いだ処理が使うGCSのファイルを削除しない）
+    lease.check()
+    _, _, _, completed = await asyncio.gather(
+        timer.run("gcs_delete", delete_file_from_gcs, bucket_name, file_name),
+        timer.run("tmp_cleanup", remove_local_file, local_file_path),
+        timer.run("archive", archive_memo, archive_record) if archive_record else _skip(),
+        timer.run("firestore_complete", mark_processing_completed, event_id, bucket_name, file_name, lease.lease_owner),
+    )
+    if not completed:
+        print(f"警告: イベント {event_id} の処理完了記録に失敗しました")
+    else:
+        print(f"処理完了記録成功: イベントID={event_id}")
+
+    return RESULT_COMPLETED
+
+async def summarize_monologue_async(data):
+    """
+    音声ファイルの処理パイプライン。互いに依存しないステージは並行して実行します。
+
+    Args:
+        data (dict): CloudEventのデータ
+
+    Returns:
+        str: 処理結果のメッセージ
+    """
+    bucket_name = data["bucket"]
+    file_name = data["name"]
+
     # 重複実行防止: Firestoreトランザクションを使用してアトミックに処理開始をマーク
     event_id = generate_event_id(bucket_name, file_name)
+    # 以降のスパン（スレッドで実行するステージを含む）にイベントIDを付与する
+    current_event_id.set(event_id)
+    lease_owner = uuid.uuid4().hex
     print(f"生成されたイベントID: {event_id} (バケット: {bucket_name}, ファイル: {file_name})")
-    
-    # トランザクション内で処理開始を試行（重複実行防止）
-    if not try_start_processing(event_id, bucket_name, file_name):
-        print(f"イベント {event_id} は既に処理済みまたは処理中です処理をスキップします")
-        return "Event already processed or in progress"
-    
-    print(f"新規処理開始: ファイル名={file_name}, バケット名={bucket_name}, イベントID={event_id}")
-
-    local_file_path = f"/tmp/{file_name}"
-    
+
+    timer = StageTimer(event_id)
+    # 処理開始の記録より前に、イベントごとの作業ディレクトリの容量を予約する。予算を超える場合は例外を送出し、
+    # トリガー（またはワーカー）の再試行で後から処理する（処理中として記録しないため、リースの期限を待たずに再試行できる）
+    streaming = STREAM_INGEST and not (TRANSCODE_AUDIO and is_transcoding_available())
     try:
-        # 1. GCSから音声ファイルをダウンロード
-        if not download_file_from_gcs(bucket_name, file_name, local_file_path):
-            return "ファイルのダウンロード中にエラーが発生しました"
-        
-        # 2. Gemini APIで文字起こしと要約を実行
-        result_json = transcribe_and_summarize(local_file_path)
-        markdown_content = result_json["markdown"]
-        next_action_list = result_json.get("nextActions", [])
-        next_action_markdown = "### NextActions\n" + "\n".join([f"- {action}" for action in next_action_list]) if next_action_list else ""
-        tags = result_json["tags"]
-
-        # 3. Notionに結果を送信
-        if not send_to_notion(file_name, markdown_content, next_action_markdown, tags):
-            return "Notionへの送信中にエラーが発生しました"
-        
-        # 4. GCSからファイルを削除
-        delete_file_from_gcs(bucket_name, file_name)
-        
-        # 5. 一時ファイルの削除
-        if os.path.exists(local_file_path):
-            os.remove(local_file_path)
-        
-        # 6. 処理完了をFirestoreに記録
-        if not mark_processing_completed(event_id, bucket_name, file_name):
-            print(f"警告: イベント {event_id} の処理完了記録に失敗しました")
-        else:
-            print(f"処理完了記録成功: イベントID={event_id}")
-        
-        return "処理が正常に完了しました"
-        
-    except Exception as e:
-        print(f"音声処理中にエラーが発生しました: {e}")
-        # エラーが発生した場合でも一時ファイルを削除
-        if os.path.exists(local_file_path):
-            os.remove(local_file_path)
-        return f"Error: {str(e)}"
\ No newline at end of file
+        workspace = workspace_manager.reserve(event_id, reservation_bytes(data.get("size"), streaming=streaming))
+    except WorkspaceTooLarge as e:
+        # 再試行しても処理できないため、例外は送出しない（WORKSPACE_BUDGET_BYTES を増やして再アップロードする）
+        print(f"{RESULT_TOO_LARGE}: {e}")
+        timer.report(RESULT_TOO_LARGE)
+        return RESULT_TOO_LARGE
+    except WorkspaceBudgetExceeded as e:
+        print(f"作業ディレクトリの予算を超えるため、処理を後回しにします: {e}")
+        raise
+
+    with workspace:
+        local_file_path = workspace.path(file_name)
+        # GCSメタデータの内容ハッシュ（同じ音声の再アップロードを検出するために使用）
+        content_hash = f"md5:{data['md5Hash']}" if data.get("md5Hash") else (f"crc32c:{data['crc32c']}" if data.get("crc32c") else None)
+        claimed = False
+        result = None
+
+        try:
+            # 1. 処理開始の記録と並行して、キャッシュの確認・ヘッダーの読み込み・（ストリーミングしない場合は）ダウンロードを行う
+            # ほかのステージが例外を送出しても処理開始の記録の結果を受け取れるよう、例外は戻り値として受け取る
+            claim_result, result_json, header, downloaded = await asyncio.gather(
+                timer.run("firestore_claim", try_start_processing, event_id, bucket_name, file_name, lease_owner),
+                timer.run("cache_lookup", get_cached_summary, content_hash),
+                timer.run("read_header", read_gcs_file_header, bucket_name, file_name, AUDIO_HEADER_BYTES),
+                _skip() if STREAM_INGEST else timer.run("gcs_download", download_file_from_gcs, bucket_name, file_name, local_file_path),
+                return_exceptions=True,
+            )
+            claimed = claim_result is True
+            # 処理開始を記録した後にほかのステージが失敗した場合は、下の except で失敗として記録する
+            for stage_result in (claim_result, result_json, header, downloaded):
+                if isinstance(stage_result, Exception):
+                    raise stage_result
+
+            # トランザクション内で処理開始を試行（重複実行防止）
+            if not claimed:
+                print(f"イベント {event_id} は既に処理済みまたは処理中です処理をスキップします")
+                remove_local_file(local_file_path)
+                result = RESULT_SKIPPED
+                return result
+
+            print(f"新規処理開始: ファイル名={file_name}, バケット名={bucket_name}, イベントID={event_id}")
+
+            # 処理中は定期的にリースを延長し、異常終了した場合は他のインスタンスが引き継げるようにする
+            with LeaseHeartbeat(event_id, lease_owner) as lease:
+                result = await _process_claimed_event(timer, data, event_id, lease, workspace, local_file_path, content_hash, result_json, header, downloaded)
+
+            if result not in (RESULT_COMPLETED, RESULT_DEFERRED):
+                await timer.run("firestore_failed", mark_processing_failed, event_id, result, lease_owner)
+            return result
+
+        except LeaseLost as e:
+            # 引き継いだ処理の状態を上書きしないよう、失敗としては記録しない
+            print(f"{e}（イベントは他の処理が引き継いでいます）")
+            result = RESULT_SKIPPED
+            return result
+
+        except WorkspaceBudgetExceeded as e:
+            # 処理開始を記録した後に追加の予約が予算を超えた場合も、試行回数を消費せずに戻して再試行で後から処理する
+            print(f"作業ディレクトリの予算を超えるため、処理を後回しにします: {e}")
+            remove_local_file(local_file_path)
+            if claimed:
+                release_processing(event_id, str(e), lease_owner)
+            result = f"Error: {str(e)}"
+            raise
+
+        except WorkspaceTooLarge as e:
+            # 処理開始を記録した後にファイル全体の予約が予算そのものを超えた場合は、再試行しても処理できないため
+            # 試行回数を消費し尽くさないよう、すぐに再試行しない失敗として記録する（処理開始前と同じく例外は送出しない）
+            print(f"{RESULT_TOO_LARGE}: {e}")
+            remove_local_file(local_file_path)
+            if claimed:
+                mark_processing_failed(event_id, RESULT_TOO_LARGE, lease_owner, retryable=False)
+            result = RESULT_TOO_LARGE
+            return result
+
+        except Exception as e:
+            print(f"音声処理中にエラーが発生しました: {e}")
+            # エラーが発生した場合でも一時ファイルを削除
+            remove_local_file(local_file_path)
+            if claimed:
+                mark_processing_failed(event_id, str(e), lease_owner)
+            result = f"Error: {str(e)}"
+            return result
+
+        finally:
+            timer.report(result)
@@ -1,13 +1,374 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import re
+import time
+import random
+import threading
+from tracing import span
+from rate_limit import TokenBucket
+from tag_service import normalize_tags, NOTION_TAG_PROPERTY
 
 NOTION_API_KEY = os.environ.get('NOTION_API_KEY', 'your_notion_api_key')
 NOTION_DATABASE_ID = os.environ.get('NOTION_DATABASE_ID', 'your_notion_database_id')
+# ローカルの疑似Notionサーバーに向ける場合に変更する
+NOTION_API_BASE_URL = os.environ.get('NOTION_API_BASE_URL', 'https://api.notion.com/v1')
+NOTION_VERSION = "2022-06-28"
+# 1回のリクエストで送信できるchildrenの上限（Notion APIの制限）
+NOTION_MAX_CHILDREN = 100
+# Notion APIのレート制限（平均3リクエスト/秒）
+NOTION_RATE_LIMIT_PER_SECOND = float(os.environ.get('NOTION_RATE_LIMIT_PER_SECOND', 3))
+NOTION_MAX_RETRIES = int(os.environ.get('NOTION_MAX_RETRIES', 5))
+# 同時に送信中にできるリクエスト数の上限
+NOTION_MAX_CONCURRENCY = int(os.environ.get('NOTION_MAX_CONCURRENCY', 2))
+NOTION_TIMEOUT_SECONDS = 30
+# 再試行の対象とするステータスコード
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# 冪等でないリクエスト（ページの作成）を再試行するステータスコード（Notionがリクエストを処理していないことが確実なもの）
+NON_IDEMPOTENT_RETRYABLE_STATUS_CODES = (429,)
+
+def _never_sent(error):
+    """
+    接続エラーが、リクエストを送信する前（接続の確立時）に発生したものかを判定する。
+
+    Args:
+        error (requests.RequestException): 接続エラー
+
+    Returns:
+        bool: 接続を確立できなかった場合True（読み込みのタイムアウトや送信後の切断はFalse）
+    """
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.Timeout):
+        return False
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+class NotionClient:
+    """
+    Notion APIのクライアント。コネクションを再利用し、レート制限と再試行を行う。
+    """
+
+    def __init__(self, api_key, base_url=NOTION_API_BASE_URL, rate_limiter=None, max_retries=NOTION_MAX_RETRIES, session=None,
+                 timeout_seconds=NOTION_TIMEOUT_SECONDS):
+        """
+        Args:
+            api_key (str): NotionのAPIキー
+            base_url (str): Notion APIのベースURL
+            rate_limiter (TokenBucket): レート制限。省略時はNOTION_RATE_LIMIT_PER_SECONDで作成
+            max_retries (int): 429/5xxの場合の最大再試行回数
+            session (requests.Session): HTTPセッション。省略時は作成する（疑似サーバーでのベンチマーク用）
+            timeout_seconds (float): 1回のリクエストのタイムアウト（秒）
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout_seconds = timeout_seconds
+        self.rate_limiter = rate_limiter or TokenBucket(NOTION_RATE_LIMIT_PER_SECOND)
+        self.max_retries = max_retries
+        self.semaphore = threading.BoundedSemaphore(NOTION_MAX_CONCURRENCY)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+        self.session = session
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Notion-Version": NOTION_VERSION
+        })
+
+    def _get_retry_wait(self, response, attempt):
+        """
+        再試行までの待機時間を求める。Retry-Afterヘッダーがあればそれに従う。
+
+        Args:
+            response (requests.Response): レスポンス。接続エラーの場合はNone
+            attempt (int): 試行回数（0始まり）
+
+        Returns:
+            float: 待機時間（秒）
+        """
+        if response is not None and response.headers.get('Retry-After'):
+            try:
+                return float(response.headers['Retry-After'])
+            except ValueError:
+                pass
+        # 指数バックオフ + ジッター
+        return min(2 ** attempt, 30) * (0.5 + random.random() / 2)
+
+    def request(self, method, path, payload=None, idempotent=True):
+        """
+        Notion APIにリクエストを送信する。429/5xxと接続エラーの場合は待機して再試行する。
+        冪等でないリクエストは、Notionが処理していないことが確実な場合（429と、接続を確立できなかった場合）だけ再試行する。
+        タイムアウトや5xxの場合は処理済みの可能性があり、再試行すると同じページが重複して作成されるため。
+
+        Args:
+            method (str): HTTPメソッド
+            path (str): ベースURLからのパス（例: "pages"）
+            payload (dict): リクエストボディ
+            idempotent (bool): 同じリクエストを繰り返しても結果が変わらない場合True
+
+        Returns:
+            requests.Response: 最後のレスポンス
+        """
+        url = f"{self.base_url}/{path}"
+        retryable_status_codes = RETRYABLE_STATUS_CODES if idempotent else NON_IDEMPOTENT_RETRYABLE_STATUS_CODES
+        # ページIDなどを含めずにエンドポイント単位で集計できるよう、パスの先頭だけを記録する
+        with span("notion.request", method=method, endpoint=path.split('/')[0], payload_bytes=len(json.dumps(payload)) if payload else 0) as s:
+            for attempt in range(self.max_retries + 1):
+                s.set(retries=attempt)
+                self.rate_limiter.acquire()
+                try:
+                    with self.semaphore:
+                        response = self.session.request(method, url, json=payload, timeout=self.timeout_seconds)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt == self.max_retries or not (idempotent or _never_sent(e)):
+                        raise
+                    wait_seconds = self._get_retry_wait(None, attempt)
+                    print(f"Notionへの接続に失敗したため {wait_seconds:.1f}秒後に再試行します: {e}")
+                    time.sleep(wait_seconds)
+                    continue
+
+                if response.status_code not in retryable_status_codes or attempt == self.max_retries:
+                    s.set(status_code=response.status_code)
+                    if response.status_code >= 400:
+                        s.set(error=f"HTTP {response.status_code}")
+                    return response
+
+                wait_seconds = self._get_retry_wait(response, attempt)
+                print(f"Notionからステータスコード={response.status_code}が返されたため {wait_seconds:.1f}秒後に再試行します")
+                time.sleep(wait_seconds)
+
+    def create_page(self, parent, properties, children):
+        """
+        ページを作成する。
+
+        Args:
+            parent (dict): 親（データベース等）
+            properties (dict): ページのプロパティ
+            children (list): ページに含めるブロック（最大NOTION_MAX_CHILDREN個）
+
+        Returns:
+            requests.Response: レスポンス
+        """
+        return self.request("POST", "pages", {
+            "parent": parent,
+            "properties": properties,
+            "children": children
+        }, idempotent=False)
+
+    def append_block_children(self, block_id, children):
+        """
+        ブロック（ページ）の末尾に子ブロックを追加する。
+
+        Args:
+            block_id (str): 追加先のブロックID
+            children (list): 追加するブロック（最大NOTION_MAX_CHILDREN個）
+
+        Returns:
+            requests.Response: レスポンス
+        """
+        return self.request("PATCH", f"blocks/{block_id}/children", {"children": children})
+
+    def update_page(self, page_id, properties=None, archived=None):
+        """
+        ページのプロパティを更新する、またはページをアーカイブする。
+
+        Args:
+            page_id (str): ページID
+            properties (dict): 更新するプロパティ
+            archived (bool): Trueの場合はページをアーカイブする
+
+        Returns:
+            requests.Response: レスポンス
+        """
+        payload = {}
+        if properties is not None:
+            payload["properties"] = properties
+        if archived is not None:
+            payload["archived"] = archived
+        return self.request("PATCH", f"pages/{page_id}", payload)
+
+    def retrieve_database(self, database_id):
+        """
+        データベースのスキーマ（プロパティと選択肢）を取得する。
+
+        Args:
+            database_id (str): データベースID
+
+        Returns:
+            requests.Response: レスポンス
+        """
+        return self.request("GET", f"databases/{database_id}")
+
+# Notionクライアント（初回利用時に生成する。ベンチマークなどでは set_notion_client で差し替える）
+_notion_client = None
+_notion_client_lock = threading.Lock()
+
+def get_notion_client():
+    """
+    Notionクライアントを取得する。初回のみ生成し、以降は再利用する。
+
+    Returns:
+        NotionClient: Notionクライアント
+    """
+    global _notion_client
+    if _notion_client is None:
+        with _notion_client_lock:
+            if _notion_client is None:
+                _notion_client = NotionClient(NOTION_API_KEY)
+    return _notion_client
+
+def set_notion_client(client):
+    """
+    Notionクライアントを差し替える（疑似サーバーでのベンチマーク用）。
+
+    Args:
+        client (NotionClient): Notionクライアント。Noneの場合は次回利用時に再生成する
+    """
+    global _notion_client
+    _notion_client = client
+
+def chunk_blocks(blocks, size=NOTION_MAX_CHILDREN):
+    """
+    ブロックのリストをNotion APIの上限に収まるように分割します。
+
+    Args:
+        blocks (list): Notionブロックのリスト
+        size (int): 1つのまとまりに含めるブロック数
+
+    Returns:
+        list: 分割されたブロックのリストのリスト
+    """
+    return [blocks[i:i + size] for i in range(0, len(blocks), size)]
+
+# rich_textの1要素に含められる最大文字数（Notion APIの制限）
+NOTION_MAX_TEXT_LENGTH = 2000
+
+# 行頭の記法からブロックの種類を判定する正規表現（マッチしたグループ名でハンドラーを選ぶ）
+BLOCK_PATTERN = re.compile(
+    r'^(?:(?P<heading>#{1,4})\s+'
+    r'|(?P<to_do>[-*+]\s+\[(?P<checked>[ xX])\]\s+)'
+    r'|(?P<bulleted>[-*+]\s+)'
+    r'|(?P<numbered>\d+[.)]\s+)'
+    r'|(?P<quote>>\s?)'
+    r'|(?P<divider>(?:-{3,}|\*{3,}|_{3,})$))'
+)
+
+# インライン記法（太字・コード・リンク・取り消し線・斜体）
+INLINE_PATTERN = re.compile(
+    r'\*\*(?P<bold>.+?)\*\*'
+    r'|`(?P<code>[^`]+)`'
+    r'|\[(?P<link_text>[^\]]+)\]\((?P<link_url>[^)\s]+)\)'
+    r'|~~(?P<strikethrough>.+?)~~'
+    r'|(?<![*\w])[*_](?P<italic>[^*_]+)[*_](?![*\w])'
+)
+
+# リンクとして送信するURL（それ以外のURLはNotionがリクエスト全体を400で拒否するため、元の記法のまま本文にする）
+LINK_URL_PATTERN = re.compile(r'^https?://')
+
+# インライン記法ごとの装飾（各rich_textで共有する）
+INLINE_ANNOTATIONS = {
+    'bold': {"bold": True},
+    'code': {"code": True},
+    'strikethrough': {"strikethrough": True},
+    'italic': {"italic": True},
+}
+
+# Notionの見出しは3段階まで（####以下はheading_3として扱う）
+HEADING_TYPES = {1: "heading_1", 2: "heading_2", 3: "heading_3", 4: "heading_3"}
+
+DIVIDER_BLOCK = {
+    "object": "block",
+    "type": "divider",
+    "divider": {}
+}
+
+def _text(content, annotations=None, link=None):
+    """
+    テキストをNotionの文字数制限に収まるrich_text要素のリストに変換します。
+
+    Args:
+        content (str): テキスト
+        annotations (dict): 装飾（太字など）
+        link (str): リンク先URL
+
+    Returns:
+        list: rich_text要素のリスト
+    """
+    rich_text = []
+    for i in range(0, len(content), NOTION_MAX_TEXT_LENGTH):
+        text = {"content": content[i:i + NOTION_MAX_TEXT_LENGTH]}
+        if link:
+            text["link"] = {"url": link}
+        element = {"type": "text", "text": text}
+        if annotations:
+            element["annotations"] = annotations
+        rich_text.append(element)
+    return rich_text
+
+def parse_inline_markdown(text):
+    """
+    インラインのMarkdown記法をNotionのrich_textに変換します。
+
+    Args:
+        text (str): 1行分のテキスト
+
+    Returns:
+        list: rich_text要素のリスト
+    """
+    rich_text = []
+    position = 0
+    for match in INLINE_PATTERN.finditer(text):
+        if match.start() > position:
+            rich_text.extend(_text(text[position:match.start()]))
+        kind = match.lastgroup
+        if kind == 'link_url':
+            if LINK_URL_PATTERN.match(match.group('link_url')):
+                rich_text.extend(_text(match.group('link_text'), link=match.group('link_url')))
+            else:
+                rich_text.extend(_text(match.group(0)))
+        else:
+            rich_text.extend(_text(match.group(kind), INLINE_ANNOTATIONS[kind]))
+        position = match.end()
+    if position < len(text):
+        rich_text.extend(_text(text[position:]))
+    return rich_text
+
+def _block(block_type, text, **properties):
+    """
+    rich_textを持つNotionブロックを作成します。
+
+    Args:
+        block_type (str): ブロックの種類
+        text (str): ブロックの本文（インライン記法を含む）
+        properties: ブロック固有のプロパティ（to_doのcheckedなど）
+
+    Returns:
+        dict: Notionブロック
+    """
+    return {
+        "object": "block",
+        "type": block_type,
+        block_type: {"rich_text": parse_inline_markdown(text), **properties}
+    }
+
+# 判定したブロックの種類ごとの変換処理
+BLOCK_HANDLERS = {
+    'heading': lambda match, text: _block(HEADING_TYPES[len(match.group('heading'))], text),
+    'to_do': lambda match, text: _block("to_do", text, checked=match.group('checked') != ' '),
+    'bulleted': lambda match, text: _block("bulleted_list_item", text),
+    'numbered': lambda match, text: _block("numbered_list_item", text),
+    'quote': lambda match, text: _block("quote", text),
+    'divider': lambda match, text: DIVIDER_BLOCK,
+}
 
 def convert_markdown_to_notion_blocks(markdown_content):
     """
     Markdown形式のコンテンツをNotionブロック形式に変換します。
+    見出し・箇条書き・番号付きリスト・ToDo・引用・区切り線と、太字・斜体・コード・リンクに対応しています。
     
     Args:
         markdown_content (str): Markdown形式のテキスト
@@ -16,82 +377,134 @@ def convert_markdown_to_notion_blocks(markdown_content):
         list: Notionブロックのリスト。
     """
     blocks = []
-    lines = markdown_content.split('\n')
-    
-    for line in lines:
+    for line in markdown_content.split('\n'):
         line = line.strip()
-        
         if not line:
             continue
 
-        # 見出しの判定と変換
-        if line.startswith('#### '):
-            # heading_4
-            blocks.append({
-                "object": "block",
-                "type": "heading_4",
-                "heading_4": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": line[5:]
-                            } # "#### "を除去
-                        }
-                    ]
-                }
-            })
-        elif line.startswith('### '):
-            # heading_3
-            blocks.append({
-                "object": "block",
-                "type": "heading_3", 
-                "heading_3": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": line[4:]
-                            } # "### "を除去
-                        }
-                    ]
-                }
-            })
-        elif line.startswith('## '):
-            # heading_2
-            blocks.append({
-                "object": "block",
-                "type": "heading_2",
-                "heading_2": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": line[3:]
-                            } # "## "を除去
-                        }
-                    ]
-                }
-            })
-        else:
+        match = BLOCK_PATTERN.match(line)
+        if match is None:
             # 通常のテキストは段落として扱う
-            blocks.append({
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": line
-                            } # 行の内容をそのまま使用
-                        }
-                    ]
-                }
-            })
+            blocks.append(_block("paragraph", line))
+        else:
+            blocks.append(BLOCK_HANDLERS[match.lastgroup](match, line[match.end():]))
 
     return blocks
 
+def memo_title(file_name):
+    """
+    ファイル名（{タイムスタンプ}_{ID}_{タイトル}.{拡張子}）からメモのタイトルを取得します。
+
+    Args:
+        file_name (str): 処理対象のファイル名。
+
+    Returns:
+        str: メモのタイトル。
+    """
+    base_name = os.path.splitext(file_name)[0]
+    parts = base_name.split("_")
+    return parts[2]
+
+def _build_page_properties(file_name, tags):
+    """
+    ファイル名とタグからページのプロパティを作成します。
+
+    Args:
+        file_name (str): 処理対象のファイル名。タイトル抽出に使用されます。
+        tags (list): 関連するタグのリスト。
+
+    Returns:
+        dict: ページのプロパティ。
+    """
+    title = memo_title(file_name)
+
+    return {
+        "Title": {
+            "title": [
+                {
+                    "text": {
+                        "content": title
+                    }
+                }
+            ]
+        },
+        NOTION_TAG_PROPERTY: _tags_property(tags)
+    }
+
+def _tags_property(tags):
+    """
+    タグのプロパティを作成します。タグは既存のタグに対応付けて正規化します。
+
+    Args:
+        tags (list): 関連するタグのリスト。
+
+    Returns:
+        dict: multi_selectのプロパティ。
+    """
+    return {"multi_select": [{"name": tag} for tag in normalize_tags(tags)]}
+
+def append_blocks(page_id, blocks):
+    """
+    ページの末尾にブロックを追加します。childrenの上限を超える場合は分割して送信します。
+
+    Args:
+        page_id (str): 追加先のページID。
+        blocks (list): 追加するブロック。
+
+    Returns:
+        int: 送信したリクエスト数。失敗した場合はNone。
+    """
+    chunks = chunk_blocks(blocks)
+    for chunk in chunks:
+        response = get_notion_client().append_block_children(page_id, chunk)
+        if response.status_code != 200:
+            print(f"Notionへのブロック追加中にエラーが発生しました: ステータスコード={response.status_code}, レスポンス={response.text}")
+            return None
+    return len(chunks)
+
+def create_notion_page(file_name, blocks, tags):
+    """
+    ページを作成します。childrenの上限を超える場合は、最初のまとまりでページを作成し、残りを追記します。
+
+    Args:
+        file_name (str): 処理対象のファイル名。タイトル抽出に使用されます。
+        blocks (list): ページに含めるブロック。
+        tags (list): 関連するタグのリスト。
+
+    Returns:
+        tuple: (ページID, 送信したリクエスト数)。失敗した場合はNone（作成したページはアーカイブする）。
+    """
+    parent = {
+        "database_id": NOTION_DATABASE_ID
+    }
+    chunks = chunk_blocks(blocks) or [[]]
+    response = get_notion_client().create_page(parent, _build_page_properties(file_name, tags), chunks[0])
+    if response.status_code != 200:
+        print(f"Notionへの送信中にエラーが発生しました: ステータスコード={response.status_code}, レスポンス={response.text}")
+        return None
+
+    page_id = response.json()["id"]
+    requests_sent = append_blocks(page_id, blocks[len(chunks[0]):])
+    if requests_sent is None:
+        # 再試行で同じメモのページがもう1つ作成されないよう、途中までのページを残さない
+        archive_page(page_id)
+        return None
+    return page_id, 1 + requests_sent
+
+def format_next_actions(next_actions):
+    """
+    次の行動のリストをNotionのチェックリストのMarkdownに変換します。
+
+    Args:
+        next_actions (list): 次の行動のリスト。
+
+    Returns:
+        str: Markdown形式のコンテンツ。次の行動がない場合は空文字列。
+    """
+    if not next_actions:
+        return ""
+    return "### NextActions\n" + "\n".join(f"- [ ] {action}" for action in next_actions)
+
 def send_to_notion(file_name, markdown_content, next_action_markdown, tags):
     """
     Notion APIを使用して、文字起こしと要約をNotionデータベースに送信します。
@@ -103,67 +516,82 @@ def send_to_notion(file_name, markdown_content, next_action_markdown, tags):
         tags (list): 関連するタグのリスト。
         
     Returns:
-        bool: 送信が成功した場合はTrue、失敗した場合はFalse。
+        str: 送信が成功した場合は作成したページのID、失敗した場合はNone。
     """
-    try:
-        # ファイル名からタイトルを取得
-        base_name = os.path.splitext(file_name)[0]
-        parts = base_name.split("_")
-        title = parts[2]
+    with span("notion.send") as s:
+        try:
+            # マークダウンをNotionブロックに変換
+            children = convert_markdown_to_notion_blocks(markdown_content) # 本文コンテンツをNotionブロックに変換
 
-        notion_endpoint = "https://api.notion.com/v1/pages"
+            # NextActionがある場合は区切りと共に追加
+            if next_action_markdown:
+                children.append(DIVIDER_BLOCK)
+                next_action_blocks = convert_markdown_to_notion_blocks(next_action_markdown) # NextActionコンテンツをNotionブロックに変換
+                children.extend(next_action_blocks)
 
-        headers = {
-            "Authorization": f"Bearer {NOTION_API_KEY}",
-            "Content-Type": "application/json",
-            "Notion-Version": "2022-06-28"
-        }
-        
-        # マークダウンをNotionブロックに変換
-        content_blocks = convert_markdown_to_notion_blocks(markdown_content) # 本文コンテンツをNotionブロックに変換
-        
-        # Notionに送信するデータ構造を作成
-        data = {
-            "parent": {
-                "database_id": NOTION_DATABASE_ID
-            },
-            "properties": {
-                "Title": {
-                    "title": [
-                        {
-                            "text": {
-                                "content": title
-                            }
-                        }
-                    ]
-                },
-                "Tags": {
-                    "multi_select": [{"name": tag} for tag in tags]
-                }
-            },
-            "children": content_blocks
-        }
+            created = create_notion_page(file_name, children, tags)
+            if created is None:
+                s.set(error="ページの作成に失敗しました")
+                return None
 
-        # NextActionがある場合は区切りと共に追加
-        if next_action_markdown:
-            data["children"].append(
-                {
-                    "object": "block",
-                    "type": "divider",
-                    "divider": {}
-                }
-            )
-            next_action_blocks = convert_markdown_to_notion_blocks(next_action_markdown) # NextActionコンテンツをNotionブロックに変換
-            data["children"].extend(next_action_blocks)
+            page_id, requests_sent = created
+            s.set(blocks=len(children), requests=requests_sent)
+            print(f"Notionへの送信に成功しました。（ブロック数: {len(children)}, リクエスト数: {requests_sent}）")
+            return page_id
+        except Exception as e:
+            s.set(error=str(e))
+            print(f"Notionへの送信中に例外が発生しました: {e}")
+            return None
 
-        response = requests.post(notion_endpoint, headers=headers, json=data)
+def append_markdown_to_page(page_id, markdown_content):
+    """
+    作成済みのページの末尾にMarkdownの内容を追加します（処理中のページに要約を順次追加する場合に使用）。
 
-        if response.status_code == 200:
-            print(f"Notionへの送信に成功しました。")
-            return True
-        else:
-            print(f"Notionへの送信中にエラーが発生しました: ステータスコード={response.status_code}, レスポンス={response.text}")
+    Args:
+        page_id (str): 追加先のページID。
+        markdown_content (str): Markdown形式のコンテンツ。
+
+    Returns:
+        bool: 追加に成功した場合はTrue。
+    """
+    with span("notion.append") as s:
+        blocks = convert_markdown_to_notion_blocks(markdown_content)
+        requests_sent = append_blocks(page_id, blocks)
+        if requests_sent is None:
+            s.set(error="ブロックの追加に失敗しました")
             return False
-    except Exception as e:
-        print(f"Notionへの送信中に例外が発生しました: {e}")
-        return False
\ No newline at end of file
+        s.set(blocks=len(blocks), requests=requests_sent)
+        return True
+
+def update_page_tags(page_id, tags):
+    """
+    ページのタグを更新します。
+
+    Args:
+        page_id (str): ページID。
+        tags (list): 関連するタグのリスト。
+
+    Returns:
+        bool: 更新に成功した場合はTrue。
+    """
+    response = get_notion_client().update_page(page_id, {NOTION_TAG_PROPERTY: _tags_property(tags)})
+    if response.status_code != 200:
+        print(f"Notionのタグ更新中にエラーが発生しました: ステータスコード={response.status_code}, レスポンス={response.text}")
+        return False
+    return True
+
+def archive_page(page_id):
+    """
+    ページをアーカイブ（削除）します。途中で失敗した処理のページや、作り直した古いダイジェストを片付けるために使用します。
+
+    Args:
+        page_id (str): ページID。
+
+    Returns:
+        bool: アーカイブに成功した場合はTrue。
+    """
+    response = get_notion_client().update_page(page_id, archived=True)
+    if response.status_code != 200:
+        print(f"Notionのページのアーカイブ中にエラーが発生しました: ステータスコード={response.status_code}, レスポンス={response.text}")
+        return False
+    return True
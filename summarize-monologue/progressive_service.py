@@ -0,0 +1,207 @@
+"""
+長い録音の文字起こしを逐次受け取りながら、区切りごとに要約してNotionのページに順次追加する処理。
+最初の区切りの要約ができた時点でページを作成するため、録音全体の処理が終わるのを待たずに内容を確認できます。
+"""
+import os
+import re
+import contextvars
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from gemini_service import GeminiSession, model_router, PROMPT_VERSION, TRANSCRIPTION_SEGMENT_SECONDS
+from cache_service import generate_cache_key, set_cached_result
+from notion_service import create_notion_page, append_blocks, append_markdown_to_page, update_page_tags, archive_page, convert_markdown_to_notion_blocks, format_next_actions, DIVIDER_BLOCK
+from tracing import span
+
+# 逐次処理を使うか（off / auto / always）。auto の場合は PROGRESSIVE_MIN_SECONDS 以上の録音で使う
+PROGRESSIVE_MODE = os.environ.get('PROGRESSIVE_MODE', 'off')
+PROGRESSIVE_MIN_SECONDS = int(os.environ.get('PROGRESSIVE_MIN_SECONDS', 900))
+# 1回の要約にまとめる文字起こしの文字数の目安（文の区切りで分割する）
+PROGRESSIVE_SECTION_CHARS = int(os.environ.get('PROGRESSIVE_SECTION_CHARS', 4000))
+# 区切りごとの要約を並行して実行する数
+PROGRESSIVE_MAX_WORKERS = 2
+# 最終的なメモに残すタグとNextActionsの数
+MAX_TAGS = 3
+MAX_NEXT_ACTIONS = 5
+SENTENCE_END_PATTERN = re.compile(r'[。！？!?\n]')
+
+def use_progressive(duration_seconds):
+    """
+    録音の長さから逐次処理を使うかを判定します。
+
+    Args:
+        duration_seconds (float): 録音の長さ（秒）。
+
+    Returns:
+        bool: 逐次処理を使う場合はTrue。
+    """
+    if PROGRESSIVE_MODE == 'always':
+        return True
+    if PROGRESSIVE_MODE == 'auto':
+        return bool(duration_seconds) and duration_seconds >= PROGRESSIVE_MIN_SECONDS
+    return False
+
+def split_ready_sections(buffer, section_chars=None):
+    """
+    受け取った文字起こしから、要約できる長さに達した区切りを切り出します。
+    区切りは文の終わりで分割し、残りは次の区切りに回します。
+
+    Args:
+        buffer (str): 未要約の文字起こし。
+        section_chars (int): 1つの区切りの文字数の目安。省略時は PROGRESSIVE_SECTION_CHARS
+
+    Returns:
+        tuple: (切り出した区切りのリスト, 残りの文字起こし)
+    """
+    section_chars = section_chars or PROGRESSIVE_SECTION_CHARS
+    sections = []
+    while len(buffer) >= section_chars:
+        match = SENTENCE_END_PATTERN.search(buffer, section_chars)
+        if match is None:
+            break
+        sections.append(buffer[:match.end()])
+        buffer = buffer[match.end():]
+    return sections, buffer
+
+def merge_partial_summaries(partials):
+    """
+    区切りごとの要約を1つのメモにまとめます。本文は順に連結し、NextActionsは重複を除いて、
+    タグは出現回数の多い順に選びます。
+
+    Args:
+        partials (list): 区切りごとのSummaryResponseの辞書。
+
+    Returns:
+        dict: SummaryResponseと同じ形式の辞書。
+    """
+    next_actions = []
+    for partial in partials:
+        for action in partial.get('nextActions', []):
+            if action not in next_actions:
+                next_actions.append(action)
+    tag_counts = Counter(tag for partial in partials for tag in partial.get('tags', []))
+    return {
+        'markdown': "\n\n".join(partial['markdown'].strip() for partial in partials),
+        'nextActions': next_actions[:MAX_NEXT_ACTIONS],
+        # 出現回数が同じ場合は先に出てきたタグを優先する
+        'tags': [tag for tag, _ in tag_counts.most_common(MAX_TAGS)],
+    }
+
+class ProgressivePage:
+    """
+    区切りごとの要約を順に追加していくNotionのページ。最初の要約を追加する時点でページを作成する。
+    """
+
+    def __init__(self, file_name, on_first_content=None):
+        """
+        Args:
+            file_name (str): 処理対象のファイル名。
+            on_first_content (callable): 最初の内容がNotionに書き込まれたときに呼び出す関数。
+        """
+        self.file_name = file_name
+        self.on_first_content = on_first_content
+        self.page_id = None
+
+    def append_section(self, markdown):
+        """
+        要約をページの末尾に追加します。ページがない場合は作成します。
+        """
+        if self.page_id is None:
+            created = create_notion_page(self.file_name, convert_markdown_to_notion_blocks(markdown), [])
+            if created is None:
+                raise RuntimeError("Notionのページの作成に失敗しました")
+            self.page_id, _ = created
+            if self.on_first_content:
+                self.on_first_content()
+        elif not append_markdown_to_page(self.page_id, markdown):
+            raise RuntimeError("Notionのページへの要約の追加に失敗しました")
+
+    def finish(self, next_actions, tags):
+        """
+        NextActionsを追加し、タグを設定してページを完成させます。
+        """
+        if next_actions:
+            # 通常の処理と同じく、本文とNextActionsの間に区切りを入れる
+            if append_blocks(self.page_id, [DIVIDER_BLOCK] + convert_markdown_to_notion_blocks(format_next_actions(next_actions))) is None:
+                raise RuntimeError("NotionのページへのNextActionsの追加に失敗しました")
+        if tags and not update_page_tags(self.page_id, tags):
+            raise RuntimeError("Notionのページのタグの更新に失敗しました")
+
+    def discard(self):
+        """
+        途中まで作成したページをアーカイブします（再試行時に重複したページができないようにする）。
+        """
+        if self.page_id is not None:
+            archive_page(self.page_id)
+            self.page_id = None
+
+def progressive_transcribe_and_summarize(file_name, file_path, audio_file=None, duration_seconds=None, content_hash=None, on_first_content=None):
+    """
+    文字起こしを逐次受け取りながら区切りごとに要約し、できた順にNotionのページに追加します。
+    TRANSCRIPTION_SEGMENT_SECONDS を超える録音は、区間ごとに切り出した音声を順にストリーミングで文字起こしします。
+    最後に区切りごとの要約をまとめ、NextActionsとタグをページに設定します。
+    失敗した場合は途中まで作成したページをアーカイブして例外を送出します。
+
+    Args:
+        file_name (str): 処理対象のファイル名。
+        file_path (str): 音声ファイルのパス。
+        audio_file (types.File): アップロード済みのファイル。
+        duration_seconds (float): 録音の長さ（秒）。
+        content_hash (str): 音声ファイルの内容ハッシュ。指定された場合は結果をキャッシュに保存します。
+        on_first_content (callable): 最初の内容がNotionに書き込まれたときに呼び出す関数。
+
+    Returns:
+        dict: 文字起こしと要約の結果を含む辞書（Notionへの送信は完了済み）。
+    """
+    page = ProgressivePage(file_name, on_first_content)
+    partials = []
+    transcript_parts = []
+    pending = deque()
+
+    def flush(wait=False):
+        # 要約は並行して実行されるが、ページには文字起こしの順に追加する
+        while pending and (wait or pending[0].done()):
+            partial = pending.popleft().result()
+            partials.append(partial)
+            page.append_section(partial['markdown'])
+
+    try:
+        with span("progressive.transcribe_and_summarize") as s, \
+                GeminiSession(file_path, audio_file=audio_file, duration_seconds=duration_seconds) as session, \
+                ThreadPoolExecutor(max_workers=PROGRESSIVE_MAX_WORKERS) as executor:
+            buffer = ""
+            # 長い録音は区間ごとに切り出してストリーミングする（1回の出力が上限に達して文字起こしが途切れないように）
+            if duration_seconds and duration_seconds > TRANSCRIPTION_SEGMENT_SECONDS and session.can_segment():
+                stream = session.transcribe_stream_segmented(duration_seconds)
+            else:
+                stream = session.transcribe_stream()
+            for text in stream:
+                transcript_parts.append(text)
+                sections, buffer = split_ready_sections(buffer + text)
+                for section in sections:
+                    pending.append(executor.submit(contextvars.copy_context().run, session.summarize_section, section))
+                flush()
+            # 残りの文字起こし（文字起こしが短く区切りに達しなかった場合は全体）を要約する
+            if buffer.strip() or (not partials and not pending):
+                pending.append(executor.submit(contextvars.copy_context().run, session.summarize_section, buffer))
+            flush(wait=True)
+
+            result = merge_partial_summaries(partials)
+            page.finish(result['nextActions'], result['tags'])
+            s.set(sections=len(partials))
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        # アーカイブに失敗しても、元の例外を送出する
+        try:
+            page.discard()
+        except Exception as e:
+            print(f"途中まで作成したページのアーカイブ中にエラーが発生しました: {e}")
+        raise
+    finally:
+        model_router.report()
+
+    transcription = "".join(transcript_parts)
+    if content_hash:
+        set_cached_result(generate_cache_key(content_hash, model_router.signature(), PROMPT_VERSION), transcription, result)
+    print(f"逐次処理が完了しました（区切り数: {len(partials)}, ページID: {page.page_id}）")
+    return dict(result, transcription=transcription)
@@ -0,0 +1,313 @@
+"""
+GCSトリガーと文字起こし・要約の処理を分離するための作業キュー。
+GCSトリガーはイベントIDをキーにジョブを登録するだけにし、ワーカー（worker.py）が並列数を制御しながら取り出して処理します。
+
+ジョブは visible_at（取り出せるようになる時刻）を持ち、取り出したジョブは visible_at をリース期限まで進めて
+他のワーカーから見えなくします。ワーカーが異常終了した場合は、リース期限を過ぎると再び取り出されます。
+取り出し時は visible_at の古い順に QUEUE_SCAN_LIMIT 件を読み、その中でファイルサイズの小さい（短い）ものを優先します。
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from tracing import span
+
+# キューの保存先（firestore / sqlite / memory）
+QUEUE_BACKEND = os.environ.get('QUEUE_BACKEND', 'firestore')
+QUEUE_COLLECTION_NAME = os.environ.get('QUEUE_COLLECTION_NAME', 'monologue_queue')
+QUEUE_SQLITE_PATH = os.environ.get('QUEUE_SQLITE_PATH', '/tmp/monologue_queue.db')
+# 取り出したジョブのリース期間（秒）。この期間内に完了の記録がなければ再び取り出される
+QUEUE_VISIBILITY_SECONDS = int(os.environ.get('QUEUE_VISIBILITY_SECONDS', 900))
+# 取り出し時に優先度を比較するジョブ数（古いジョブが後回しにされ続けないよう、範囲を限定する）
+QUEUE_SCAN_LIMIT = int(os.environ.get('QUEUE_SCAN_LIMIT', 100))
+
+def job_priority(data):
+    """
+    CloudEventのデータからジョブの優先度を求めます（値が小さいほど先に処理する）。
+    録音の長さはファイルを読まないとわからないため、ファイルサイズで代用します。
+
+    Args:
+        data (dict): CloudEventのデータ
+
+    Returns:
+        int: 優先度
+    """
+    try:
+        return int(data.get('size') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def _select_jobs(jobs, limit):
+    """
+    取り出し可能なジョブ（visible_at の古い順）から、優先度の高いものを選びます。
+    """
+    candidates = sorted(jobs, key=lambda job: job['visible_at'])[:QUEUE_SCAN_LIMIT]
+    return sorted(candidates, key=lambda job: (job['priority'], job['enqueued_at']))[:limit]
+
+class MemoryWorkQueue:
+    """プロセス内のメモリにジョブを保持するキュー（テスト・ベンチマーク用）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def enqueue(self, job):
+        with self.lock:
+            if job['event_id'] in self.jobs:
+                return False
+            self.jobs[job['event_id']] = dict(job)
+            return True
+
+    def lease(self, limit, owner, now):
+        with self.lock:
+            visible = [job for job in self.jobs.values() if job['visible_at'] <= now]
+            leased = []
+            for job in _select_jobs(visible, limit):
+                job.update(status='leased', lease_owner=owner, visible_at=now + QUEUE_VISIBILITY_SECONDS, deliveries=job['deliveries'] + 1)
+                leased.append(dict(job))
+            return leased
+
+    def ack(self, event_id, owner):
+        with self.lock:
+            if self.jobs.get(event_id, {}).get('lease_owner') == owner:
+                del self.jobs[event_id]
+
+    def release(self, event_id, owner, visible_at):
+        with self.lock:
+            job = self.jobs.get(event_id)
+            if job and job.get('lease_owner') == owner:
+                job.update(status='queued', lease_owner=None, visible_at=visible_at)
+
+    def stats(self, now):
+        with self.lock:
+            queued = [job for job in self.jobs.values() if job['status'] == 'queued']
+            return {
+                'depth': len(self.jobs),
+                'ready': sum(1 for job in queued if job['visible_at'] <= now),
+                'in_flight': len(self.jobs) - len(queued),
+            }
+
+class SqliteWorkQueue:
+    """SQLiteのファイルにジョブを保持するキュー（ローカルでの動作確認用。複数プロセスから共有できる）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "event_id TEXT PRIMARY KEY, data TEXT NOT NULL, priority INTEGER NOT NULL, status TEXT NOT NULL, "
+                "enqueued_at REAL NOT NULL, visible_at REAL NOT NULL, lease_owner TEXT, deliveries INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_visible_at ON jobs (visible_at)")
+
+    def _connect(self):
+        # ロックの待機時間を長めにし、複数のワーカープロセスからの同時更新で失敗しないようにする
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _to_job(row):
+        event_id, data, priority, status, enqueued_at, visible_at, lease_owner, deliveries = row
+        return {
+            'event_id': event_id, 'data': json.loads(data), 'priority': priority, 'status': status,
+            'enqueued_at': enqueued_at, 'visible_at': visible_at, 'lease_owner': lease_owner, 'deliveries': deliveries,
+        }
+
+    def enqueue(self, job):
+        with self.lock, self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job['event_id'], json.dumps(job['data'], ensure_ascii=False), job['priority'], job['status'],
+                 job['enqueued_at'], job['visible_at'], job['lease_owner'], job['deliveries']),
+            )
+            return cursor.rowcount == 1
+
+    def lease(self, limit, owner, now):
+        with self.lock, self._connect() as conn:
+            # 取り出しと更新の間に他のプロセスが同じジョブを取り出さないよう、書き込みロックを取得する
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute("SELECT * FROM jobs WHERE visible_at <= ? ORDER BY visible_at LIMIT ?", (now, QUEUE_SCAN_LIMIT)).fetchall()
+                leased = []
+                for job in _select_jobs([self._to_job(row) for row in rows], limit):
+                    job.update(status='leased', lease_owner=owner, visible_at=now + QUEUE_VISIBILITY_SECONDS, deliveries=job['deliveries'] + 1)
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, lease_owner = ?, visible_at = ?, deliveries = ? WHERE event_id = ?",
+                        (job['status'], owner, job['visible_at'], job['deliveries'], job['event_id']),
+                    )
+                    leased.append(job)
+                conn.execute("COMMIT")
+                return leased
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def ack(self, event_id, owner):
+        with self.lock, self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE event_id = ? AND lease_owner = ?", (event_id, owner))
+
+    def release(self, event_id, owner, visible_at):
+        with self.lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', lease_owner = NULL, visible_at = ? WHERE event_id = ? AND lease_owner = ?",
+                (visible_at, event_id, owner),
+            )
+
+    def stats(self, now):
+        with self.lock, self._connect() as conn:
+            depth, ready, in_flight = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(status = 'queued' AND visible_at <= ?), 0), COALESCE(SUM(status = 'leased'), 0) FROM jobs",
+                (now,),
+            ).fetchone()
+            return {'depth': depth, 'ready': ready, 'in_flight': in_flight}
+
+class FirestoreWorkQueue:
+    """Firestoreのコレクションにジョブを保持するキュー。ドキュメントIDはイベントID"""
+
+    def __init__(self, collection_name):
+        self.collection_name = collection_name
+
+    @property
+    def collection(self):
+        from firestore_service import get_firestore_client
+        return get_firestore_client().collection(self.collection_name)
+
+    def enqueue(self, job):
+        from google.api_core.exceptions import AlreadyExists
+        try:
+            # create は同じIDのドキュメントがあれば失敗するため、重複したイベントは1件のジョブにまとまる
+            self.collection.document(job['event_id']).create(job)
+            return True
+        except AlreadyExists:
+            return False
+
+    def lease(self, limit, owner, now):
+        from google.cloud import firestore
+        from firestore_service import get_firestore_client, _transactional
+
+        # visible_at の単一フィールドの条件と並び替えのみを使うため、複合インデックスは不要
+        snapshots = self.collection.where(filter=firestore.FieldFilter('visible_at', '<=', now)) \
+            .order_by('visible_at').limit(QUEUE_SCAN_LIMIT).stream()
+        candidates = [dict(snapshot.to_dict(), event_id=snapshot.id) for snapshot in snapshots]
+
+        def claim(transaction, doc_ref):
+            snapshot = doc_ref.get(transaction=transaction)
+            # 読み込んでから取り出すまでに、他のワーカーが取り出した・完了したジョブは除く
+            if not snapshot.exists or snapshot.get('visible_at') > now:
+                return None
+            job = snapshot.to_dict()
+            job.update(status='leased', lease_owner=owner, visible_at=now + QUEUE_VISIBILITY_SECONDS, deliveries=job.get('deliveries', 0) + 1)
+            transaction.set(doc_ref, job)
+            return dict(job, event_id=doc_ref.id)
+
+        leased = []
+        for job in _select_jobs(candidates, len(candidates)):
+            if len(leased) >= limit:
+                break
+            claimed = _transactional(claim)(get_firestore_client().transaction(), self.collection.document(job['event_id']))
+            if claimed is not None:
+                leased.append(claimed)
+        return leased
+
+    def _if_owner(self, event_id, owner, apply):
+        from firestore_service import get_firestore_client, _transactional
+
+        def update(transaction, doc_ref):
+            snapshot = doc_ref.get(transaction=transaction)
+            # リース期限を過ぎて他のワーカーが取り出したジョブは変更しない
+            if snapshot.exists and snapshot.get('lease_owner') == owner:
+                apply(transaction, doc_ref)
+
+        _transactional(update)(get_firestore_client().transaction(), self.collection.document(event_id))
+
+    def ack(self, event_id, owner):
+        self._if_owner(event_id, owner, lambda transaction, doc_ref: transaction.delete(doc_ref))
+
+    def release(self, event_id, owner, visible_at):
+        self._if_owner(event_id, owner, lambda transaction, doc_ref: transaction.update(doc_ref, {
+            'status': 'queued', 'lease_owner': None, 'visible_at': visible_at,
+        }))
+
+    def stats(self, now):
+        from google.cloud import firestore
+
+        def count(query):
+            return query.count().get()[0][0].value
+
+        depth = count(self.collection)
+        ready = count(self.collection.where(filter=firestore.FieldFilter('visible_at', '<=', now)))
+        in_flight = count(self.collection.where(filter=firestore.FieldFilter('status', '==', 'leased')))
+        # リース期限切れのジョブは取り出し可能な件数と処理中の件数の両方に含まれるため、処理中から除く
+        return {'depth': depth, 'ready': ready, 'in_flight': min(in_flight, depth - ready)}
+
+def create_work_queue(backend: str = QUEUE_BACKEND):
+    """
+    設定に応じたキューの実装を生成
+
+    Args:
+        backend: firestore / sqlite / memory
+
+    Returns:
+        キューの実装
+    """
+    if backend == 'firestore':
+        return FirestoreWorkQueue(QUEUE_COLLECTION_NAME)
+    if backend == 'sqlite':
+        return SqliteWorkQueue(QUEUE_SQLITE_PATH)
+    if backend == 'memory':
+        return MemoryWorkQueue()
+    raise ValueError(f"不明なキューの保存先です: {backend}")
+
+# キューの実装（初回利用時に生成する。ベンチマークなどでは set_work_queue で差し替える）
+_work_queue = None
+_work_queue_lock = threading.Lock()
+
+def get_work_queue():
+    """
+    キューの実装を取得します。初回のみ生成し、以降は再利用します。
+    """
+    global _work_queue
+    if _work_queue is None:
+        with _work_queue_lock:
+            if _work_queue is None:
+                _work_queue = create_work_queue()
+    return _work_queue
+
+def set_work_queue(queue):
+    """
+    キューの実装を差し替えます（ベンチマーク・ローカルでの動作確認用）。
+
+    Args:
+        queue: MemoryWorkQueue などのキューの実装。Noneの場合は次回利用時に再生成します
+    """
+    global _work_queue
+    _work_queue = queue
+
+def enqueue_event(event_id, data):
+    """
+    イベントを処理するジョブをキューに登録します。同じイベントIDのジョブが既にある場合は登録しません。
+
+    Args:
+        event_id (str): イベントID
+        data (dict): CloudEventのデータ
+
+    Returns:
+        bool: 新しく登録した場合True
+    """
+    now = time.time()
+    job = {
+        'event_id': event_id,
+        'data': data,
+        'priority': job_priority(data),
+        'status': 'queued',
+        'enqueued_at': now,
+        'visible_at': now,
+        'lease_owner': None,
+        'deliveries': 0,
+    }
+    with span("queue.enqueue", priority=job['priority']) as s:
+        created = get_work_queue().enqueue(job)
+        s.set(created=created)
+    print(f"キューに登録{'しました' if created else '済みのため、登録をスキップしました'}: イベントID={event_id}, 優先度={job['priority']}")
+    return created
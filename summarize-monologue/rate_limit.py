@@ -0,0 +1,34 @@
+import time
+import threading
+
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限。スレッドをまたいでリクエストの間隔を制御する。
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate (float): 1秒あたりに補充されるトークン数
+            capacity (float): バケットの容量（瞬間的に許容するリクエスト数）
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        トークンを1つ取得する。トークンがない場合は補充されるまで待機する。
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
@@ -0,0 +1,988 @@
+"""
+疑似バックエンド（fakes.py）を使って、障害時の振る舞いを確認するスクリプト。
+シナリオごとに OK/NG を表示し、NG があった場合は終了コード1で終了します。
+
+使い方:
+    python scenarios.py            # すべてのシナリオを実行
+    python scenarios.py notion     # 名前に "notion" を含むシナリオだけを実行
+    python scenarios.py --list     # シナリオの一覧
+"""
+import argparse
+import contextlib
+import io
+import time
+import traceback
+
+SCENARIOS = []
+
+def scenario(func):
+    """
+    シナリオとして登録します。シナリオは確認に失敗した場合 AssertionError を送出します。
+    """
+    SCENARIOS.append(func)
+    return func
+
+def _notion_client(server, max_retries=3, timeout_seconds=30):
+    """
+    疑似Notionサーバーに本番と同じHTTPセッションで接続するクライアントを設定します。
+    """
+    from notion_service import NotionClient, TokenBucket, set_notion_client
+    set_notion_client(NotionClient('fake-notion-api-key', base_url=server.url, rate_limiter=TokenBucket(100), max_retries=max_retries,
+                                   timeout_seconds=timeout_seconds))
+
+def _blocks(count):
+    return [{"object": "block", "type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": f"段落 {i}"}}]}} for i in range(count)]
+
+# ---- Notion
+
+@scenario
+def notion_chunks_children():
+    """childrenの上限（100件）を超えるブロックは、ページ作成と追記に分割して送信する"""
+    from fakes import FakeNotionServer
+    from notion_service import create_notion_page, NOTION_MAX_CHILDREN
+    with FakeNotionServer() as server:
+        _notion_client(server)
+        page_id, requests_sent = create_notion_page('20261017_1200_memo.m4a', _blocks(250), ['仕事'])
+        assert requests_sent == 3, requests_sent
+        writes = [r for r in server.requests if r['operation'] != 'GET databases']
+        assert [r['children'] for r in writes] == [100, 100, 50], server.requests
+        assert all(r['children'] <= NOTION_MAX_CHILDREN for r in writes)
+        assert len(server.backend.pages[page_id]['children']) == 250
+
+@scenario
+def notion_retries_5xx():
+    """ブロックの追加は5xxの場合に再試行し、すべてのブロックが1回ずつ追加される"""
+    from fakes import FakeNotionServer
+    from notion_service import create_notion_page
+    with FakeNotionServer() as server:
+        _notion_client(server)
+        server.script('PATCH blocks', 503, 502)
+        page_id, _ = create_notion_page('20261017_1200_memo.m4a', _blocks(150), [])
+        retried = [r['status_code'] for r in server.requests if r['operation'] == 'PATCH blocks']
+        assert retried == [503, 502, 200], server.requests
+        assert len(server.backend.pages[page_id]['children']) == 150
+
+@scenario
+def notion_page_creation_not_retried_on_5xx():
+    """ページの作成は5xxの場合に再試行せず（処理済みの可能性があるため）、失敗として返す"""
+    from fakes import FakeNotionServer
+    from notion_service import create_notion_page
+    with FakeNotionServer() as server:
+        _notion_client(server)
+        server.script('POST pages', 503)
+        assert create_notion_page('20261017_1200_memo.m4a', _blocks(3), []) is None
+        assert [r['status_code'] for r in server.requests if r['operation'] == 'POST pages'] == [503], server.requests
+
+@scenario
+def notion_page_creation_not_retried_after_timeout():
+    """ページの作成が応答待ちでタイムアウトした場合は再試行せず、同じページを重複して作成しない"""
+    import requests
+    from fakes import FakeNotionServer
+    from notion_service import create_notion_page, _never_sent
+    with FakeNotionServer() as server:
+        _notion_client(server, timeout_seconds=0.3)
+        server.delay_next('POST pages', 1.0)
+        try:
+            create_notion_page('20261017_1200_memo.m4a', _blocks(3), [])
+        except requests.Timeout:
+            pass
+        else:
+            raise AssertionError("タイムアウトが送出されませんでした")
+        assert [r['operation'] for r in server.requests].count('POST pages') == 1, server.requests
+        assert len(server.backend.page_titles()) == 1
+    # 接続を確立できなかった場合は、Notionに届いていないため再試行してよい
+    try:
+        requests.post('http://127.0.0.1:1/v1/pages', timeout=1)
+    except requests.ConnectionError as e:
+        assert _never_sent(e), e
+
+@scenario
+def notion_respects_retry_after():
+    """429の場合は Retry-After の秒数だけ待ってから再試行する"""
+    from fakes import FakeNotionServer
+    from notion_service import create_notion_page
+    with FakeNotionServer() as server:
+        _notion_client(server)
+        server.script('PATCH blocks', 429, retry_after=0.8)
+        assert create_notion_page('20261017_1200_memo.m4a', _blocks(150), []) is not None
+        retried = [r for r in server.requests if r['operation'] == 'PATCH blocks']
+        assert [r['status_code'] for r in retried] == [429, 200], server.requests
+        waited = retried[1]['time'] - retried[0]['time']
+        assert waited >= 0.8, f"Retry-After より前に再試行しました: {waited:.2f}秒"
+
+@scenario
+def notion_gives_up_after_max_retries():
+    """再試行の上限に達した場合は失敗を返し、ページは作成されない"""
+    from fakes import FakeNotionServer
+    from notion_service import create_notion_page
+    with FakeNotionServer() as server:
+        _notion_client(server, max_retries=2)
+        server.script('POST pages', 429, 429, 429, retry_after=0)
+        assert create_notion_page('20261017_1200_memo.m4a', _blocks(3), []) is None
+        assert len(server.requests) == 3, server.requests
+        assert server.backend.page_titles() == []
+
+@scenario
+def notion_archives_page_when_append_fails():
+    """追記に失敗した場合は作成したページをアーカイブし、途中までのページを残さない"""
+    from fakes import FakeNotionServer
+    from notion_service import create_notion_page
+    with FakeNotionServer() as server:
+        _notion_client(server)
+        server.script('PATCH blocks', 400)
+        assert create_notion_page('20261017_1200_memo.m4a', _blocks(150), []) is None
+        assert len(server.backend.pages) == 1
+        assert server.backend.page_titles() == [], "途中までのページが残っています"
+        # 再試行で作り直しても、アーカイブされていないページは1つだけ
+        assert create_notion_page('20261017_1200_memo.m4a', _blocks(150), []) is not None
+        assert len(server.backend.page_titles()) == 1
+
+@scenario
+def notion_links_only_http_urls():
+    """http(s)以外のURLのリンクはリンクにせず、元の記法のまま本文にする（Notionがリクエスト全体を拒否しないように）"""
+    from notion_service import convert_markdown_to_notion_blocks
+    blocks = convert_markdown_to_notion_blocks('- [メモ](note) と [危険](javascript:void) と [資料](https://example.com/a)')
+    rich_text = blocks[0]['bulleted_list_item']['rich_text']
+    links = [element['text']['link']['url'] for element in rich_text if 'link' in element['text']]
+    assert links == ['https://example.com/a'], links
+    assert '[メモ](note)' in ''.join(element['text']['content'] for element in rich_text)
+
+@scenario
+def progressive_keeps_original_error_when_discard_fails():
+    """逐次処理の失敗時にページのアーカイブも失敗した場合、元の例外を送出する"""
+    import os
+    import tempfile
+    from fakes import FakeNotionServer, install_fakes, make_wav
+    from progressive_service import progressive_transcribe_and_summarize
+
+    class SectionFailed(Exception):
+        pass
+
+    install_fakes()
+    with FakeNotionServer() as server, tempfile.TemporaryDirectory() as directory:
+        _notion_client(server, max_retries=0)
+        audio_path = os.path.join(directory, 'memo.wav')
+        with open(audio_path, 'wb') as f:
+            f.write(make_wav(5))
+
+        def fail_after_first_content():
+            # ページを作成した後にNotionに接続できなくなり、処理も失敗した状態
+            server.__exit__()
+            raise SectionFailed("区切りの要約に失敗しました")
+
+        try:
+            progressive_transcribe_and_summarize('20261017_1200_memo.wav', audio_path, duration_seconds=5, on_first_content=fail_after_first_content)
+        except SectionFailed:
+            pass
+        else:
+            raise AssertionError("元の例外が送出されませんでした")
+
+# ---- 長い録音の分割文字起こし
+
+@scenario
+def transcription_plan_segments():
+    """区間は重なりを持って録音全体を覆い、境目は本来の終わりの手前にある無音に寄せる"""
+    from gemini_service import plan_transcription_segments
+    assert plan_transcription_segments(300, 600, 15) == [(0, 300)]
+    assert plan_transcription_segments(1500, 600, 15) == [(0, 600), (585, 1185), (1170, 1500)]
+    # 探す範囲（60秒）より前の無音と、本来の終わりより後の無音は使わない
+    silences = [(500, 502), (560, 562), (590, 592), (610, 612), (1150, 1152)]
+    segments = plan_transcription_segments(1500, 600, 15, silences=silences, search_seconds=60)
+    assert segments == [(0, 591), (576, 1151), (1136, 1500)], segments
+
+@scenario
+def transcription_stitch_removes_overlap():
+    """重なり区間の文字起こしは、一致する部分を境目にして重複なく連結する"""
+    from gemini_service import stitch_transcriptions
+    pieces = [
+        "今日は散歩をしながら考えたことを話します。新しい企画について",
+        "新しい企画については、まず小さく試してみたい。",
+        "全く別の話題です。",
+    ]
+    assert stitch_transcriptions(pieces) == "今日は散歩をしながら考えたことを話します。新しい企画については、まず小さく試してみたい。\n全く別の話題です。"
+
+def _make_aiff(duration_seconds, sample_rate=1000):
+    """
+    指定した長さの無音のAIFF（モノラル・16bit）を生成します。
+    """
+    import struct
+    frames = int(duration_seconds * sample_rate)
+    exponent, mantissa = 16383 + 63, sample_rate
+    while not mantissa & (1 << 63):
+        mantissa <<= 1
+        exponent -= 1
+    comm = b'COMM' + struct.pack('>IhIh', 18, 1, frames, 16) + struct.pack('>HQ', exponent, mantissa)
+    ssnd = b'SSND' + struct.pack('>III', 8 + frames * 2, 0, 0) + bytes(frames * 2)
+    return b'FORM' + struct.pack('>I', 4 + len(comm) + len(ssnd)) + b'AIFF' + comm + ssnd
+
+@scenario
+def transcription_cut_pcm_segment():
+    """非圧縮のWAV/AIFFは、ffmpegなしで指定した区間だけを同じ形式のファイルに切り出す"""
+    import os
+    import tempfile
+    from fakes import make_wav
+    from audio_service import cut_audio_segment, get_audio_duration
+    with tempfile.TemporaryDirectory() as directory:
+        for name, content in (('memo.wav', make_wav(120, sample_rate=1000)), ('memo.aiff', _make_aiff(120))):
+            path = os.path.join(directory, name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            piece = cut_audio_segment(path, os.path.join(directory, f"piece-{name}"), 30, 75.5)
+            with open(piece, 'rb') as f:
+                duration = get_audio_duration(f.read())
+            assert abs(duration - 45.5) < 0.01, (name, duration)
+            assert os.path.getsize(piece) < len(content) / 2, (name, os.path.getsize(piece))
+
+@scenario
+def transcription_segments_upload_only_their_audio():
+    """長い録音は区間ごとに切り出した音声だけをアップロードし、全体を区間の数だけ送らない"""
+    import os
+    import tempfile
+    from fakes import install_fakes, make_wav
+    from gemini_service import GeminiSession, plan_transcription_segments
+    backends = install_fakes()
+    duration = 1500
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'memo.wav')
+        with open(path, 'wb') as f:
+            f.write(make_wav(duration, sample_rate=1000))
+        with GeminiSession(path, duration_seconds=duration) as session:
+            transcription = session.transcribe_segmented(duration)
+            assert session.audio_file is None, "録音全体をアップロードしました"
+        segments = plan_transcription_segments(duration)
+        expected = sum(44 + int((end - start) * 1000) * 2 for start, end in segments)
+        assert backends.genai.uploaded_bytes == expected, (backends.genai.uploaded_bytes, expected)
+        assert backends.genai.uploaded_bytes < os.path.getsize(path) * 1.1
+        assert transcription and not backends.genai.files_alive
+        assert os.listdir(directory) == ['memo.wav'], os.listdir(directory)
+
+# ---- 結果キャッシュ
+
+@contextlib.contextmanager
+def _local_result_cache():
+    """
+    結果キャッシュを一時ディレクトリのファイルに保存する実装に差し替えます。
+    """
+    import tempfile
+    import cache_service
+    previous = cache_service.result_cache
+    with tempfile.TemporaryDirectory() as directory:
+        cache = cache_service.LocalFileResultCache(directory)
+        cache_service.set_result_cache(cache)
+        try:
+            yield cache
+        finally:
+            cache_service.set_result_cache(previous)
+
+@scenario
+def cache_hit_and_miss():
+    """保存前はミス、保存後は同じ文字起こしと要約を返す"""
+    from cache_service import generate_cache_key, get_cached_result, set_cached_result
+    with _local_result_cache():
+        key = generate_cache_key('md5:abc', 'gemini-2.5-flash', '3')
+        assert get_cached_result(key) is None
+        summary = {'markdown': '# メモ', 'tags': ['仕事'], 'nextActions': []}
+        assert set_cached_result(key, '文字起こし', summary)
+        assert get_cached_result(key) == {'transcription': '文字起こし', 'summary': summary}
+
+@scenario
+def cache_expires_after_ttl():
+    """有効期限を過ぎたエントリはミスとして扱い、ファイルも削除する"""
+    import os
+    from datetime import datetime, timedelta
+    from cache_service import generate_cache_key, get_cached_result
+    with _local_result_cache() as cache:
+        key = generate_cache_key('md5:abc', 'gemini-2.5-flash', '3')
+        created_at = datetime.utcnow() - timedelta(days=31)
+        cache.set(key, {'transcription': '古い', 'summary': '{}', 'created_at': created_at, 'expire_at': created_at + timedelta(days=30)})
+        assert get_cached_result(key) is None
+        assert not os.path.exists(cache._path(key))
+
+@scenario
+def cache_key_changes_with_model_and_prompt():
+    """モデルやプロンプトのバージョンが変わった場合は、同じ音声でもキャッシュを使わない"""
+    from cache_service import generate_cache_key, get_cached_result, set_cached_result
+    with _local_result_cache():
+        key = generate_cache_key('md5:abc', 'gemini-2.5-flash', '3')
+        set_cached_result(key, '文字起こし', {'markdown': '# メモ', 'tags': []})
+        for other in (generate_cache_key('md5:abc', 'gemini-2.5-pro', '3'), generate_cache_key('md5:abc', 'gemini-2.5-flash', '4'),
+                      generate_cache_key('md5:def', 'gemini-2.5-flash', '3')):
+            assert other != key and get_cached_result(other) is None
+
+@scenario
+def cache_counts_concurrent_lookups():
+    """複数のスレッドから参照しても、ヒット/ミス回数を取りこぼさない"""
+    from concurrent.futures import ThreadPoolExecutor
+    from cache_service import generate_cache_key, get_cached_result, cache_stats
+    with _local_result_cache(), contextlib.redirect_stdout(io.StringIO()):
+        before = sum(cache_stats.values())
+        keys = [generate_cache_key(f"md5:{i}", 'gemini-2.5-flash', '3') for i in range(400)]
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(get_cached_result, keys))
+        assert sum(cache_stats.values()) - before == 400, cache_stats
+
+# ---- Geminiの失敗
+
+@scenario
+def gemini_failure_marks_memo_failed_without_page():
+    """文字起こし・要約が失敗した場合はエラーのページを作成せず、処理の失敗として記録して再試行させる"""
+    import asyncio
+    import main
+    from fakes import install_fakes, make_wav
+    from firestore_service import generate_event_id
+    backends = install_fakes()
+    data = backends.storage.put_object('bucket', '20261017_1200_memo.wav', make_wav(5))
+    event_id = generate_event_id('bucket', '20261017_1200_memo.wav')
+
+    def malformed_response(**kwargs):
+        raise ValueError("応答をスキーマに従って解析できませんでした")
+
+    backends.genai.models.generate_content = malformed_response
+    result = asyncio.run(main.summarize_monologue_async(data))
+    assert result.startswith('Error'), result
+    assert backends.notion.pages == {}, "エラーのページが作成されました"
+    state = _event_state(event_id)
+    assert state['status'] == 'failed' and state.get('next_retry_at') and 'expire_at' not in state, state
+
+@scenario
+def progressive_streams_each_segment():
+    """逐次処理でも長い録音は区間ごとに切り出してストリーミングし、重なりの重複を取り除く"""
+    import os
+    import tempfile
+    from fakes import install_fakes, make_wav
+    from gemini_service import plan_transcription_segments
+    from progressive_service import progressive_transcribe_and_summarize
+    backends = install_fakes()
+    duration = 1500
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'memo.wav')
+        with open(path, 'wb') as f:
+            f.write(make_wav(duration, sample_rate=1000))
+        result = progressive_transcribe_and_summarize('20261017_1200_memo.wav', path, duration_seconds=duration)
+        segments = plan_transcription_segments(duration)
+        assert backends.genai.uploaded_bytes == sum(44 + int((end - start) * 1000) * 2 for start, end in segments)
+        assert os.listdir(directory) == ['memo.wav'] and not backends.genai.files_alive
+    # 疑似クライアントは区間ごとに同じ文字起こしを返すため、重なりを取り除くと1区間分より少し長い程度になる
+    transcript = backends.genai.transcript()
+    assert transcript in result['transcription'] and len(result['transcription']) < len(transcript) * len(segments), len(result['transcription'])
+    assert len(backends.notion.page_titles()) == 1
+
+@scenario
+def transcription_trim_streamed_overlap():
+    """逐次受け取る次の区間の先頭から、前の区間と重なる部分を取り除く"""
+    from gemini_service import trim_overlap
+    assert trim_overlap("考えたことを話します。新しい企画について", "新しい企画については、まず小さく試してみたい。") == "は、まず小さく試してみたい。"
+    assert trim_overlap("考えたことを話します。", "全く別の話題です。") == "\n全く別の話題です。"
+
+# ---- Firestoreのリース
+
+def _expire_lease(backends, event_id, **fields):
+    """
+    イベントのリースの期限を過去にします（処理していたインスタンスが異常終了した状態）。
+    """
+    from datetime import datetime, timedelta
+    from firestore_service import COLLECTION_NAME
+    backends.firestore.collection(COLLECTION_NAME).document(event_id).update(dict(fields, lease_until=datetime.utcnow() - timedelta(seconds=1)))
+
+def _event_state(event_id):
+    from firestore_service import get_processing_state
+    return get_processing_state(event_id)
+
+@scenario
+def lease_single_winner_among_concurrent_claimers():
+    """同じイベントを同時に処理開始しようとしても、処理を開始できるのは1つだけ"""
+    from concurrent.futures import ThreadPoolExecutor
+    from fakes import install_fakes
+    from firestore_service import try_start_processing
+    install_fakes()
+    owners = [f"owner-{i}" for i in range(8)]
+    with ThreadPoolExecutor(len(owners)) as executor:
+        claimed = list(executor.map(lambda owner: try_start_processing('event-1', 'bucket', 'memo.m4a', owner), owners))
+    assert claimed.count(True) == 1, claimed
+    assert _event_state('event-1')['lease_owner'] == owners[claimed.index(True)]
+
+@scenario
+def lease_takeover_after_expiry():
+    """リースの期限が切れた処理は引き継がれ、元の処理はリースを延長できない"""
+    from fakes import install_fakes
+    from firestore_service import try_start_processing, extend_lease
+    backends = install_fakes()
+    assert try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-a')
+    assert not try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-b'), "リースの期限内に引き継がれました"
+    _expire_lease(backends, 'event-1')
+    assert try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-b')
+    state = _event_state('event-1')
+    assert (state['lease_owner'], state['attempts']) == ('owner-b', 2), state
+    assert extend_lease('event-1', 'owner-a') is False
+    assert extend_lease('event-1', 'owner-b') is True
+
+@scenario
+def lease_stale_owner_cannot_finish():
+    """リースを失った処理は、引き継いだ処理の状態を完了・失敗で上書きできない"""
+    from fakes import install_fakes
+    from firestore_service import try_start_processing, mark_processing_completed, mark_processing_failed
+    backends = install_fakes()
+    assert try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-a')
+    _expire_lease(backends, 'event-1')
+    assert try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-b')
+    assert mark_processing_completed('event-1', 'bucket', 'memo.m4a', 'owner-a') is False
+    assert mark_processing_failed('event-1', 'stale', 'owner-a') is False
+    state = _event_state('event-1')
+    assert (state['status'], state['lease_owner']) == ('processing', 'owner-b'), state
+    assert mark_processing_completed('event-1', 'bucket', 'memo.m4a', 'owner-b') is True
+    assert _event_state('event-1')['status'] == 'completed'
+
+@scenario
+def lease_heartbeat_reports_loss():
+    """ハートビートがリースの引き継ぎを検出し、check が LeaseLost を送出する"""
+    from fakes import install_fakes
+    from firestore_service import try_start_processing, LeaseHeartbeat, LeaseLost
+    backends = install_fakes()
+    assert try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-a')
+    with LeaseHeartbeat('event-1', 'owner-a', interval_seconds=0.05) as lease:
+        time.sleep(0.15)
+        lease.check()
+        _expire_lease(backends, 'event-1')
+        assert try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-b')
+        assert lease.lost.wait(1), "リースの引き継ぎを検出しませんでした"
+        try:
+            lease.check()
+        except LeaseLost:
+            pass
+        else:
+            raise AssertionError("LeaseLost が送出されませんでした")
+
+@scenario
+def lease_stale_owner_skips_notion_write():
+    """Notionへの送信前にリースを失っていた処理は、ページを作成せず、引き継いだ処理の状態も変えない"""
+    import asyncio
+    import main
+    from fakes import install_fakes, FaultProfile, make_wav
+    from firestore_service import COLLECTION_NAME, generate_event_id
+    backends = install_fakes(gemini=FaultProfile(0.3))
+    data = backends.storage.put_object('bucket', '20261017_1200_memo.wav', make_wav(5))
+    event_id = generate_event_id('bucket', '20261017_1200_memo.wav')
+
+    async def take_over():
+        # 1つ目の処理がGeminiの応答を待っている間に、リースを切らして別の処理が引き継ぐ
+        await asyncio.sleep(0.1)
+        _expire_lease(backends, event_id)
+        from firestore_service import try_start_processing
+        assert try_start_processing(event_id, 'bucket', '20261017_1200_memo.wav', 'owner-b')
+
+    async def run_both():
+        return await asyncio.gather(main.summarize_monologue_async(data), take_over())
+
+    result, _ = asyncio.run(run_both())
+    assert result == main.RESULT_SKIPPED, result
+    assert backends.notion.page_titles() == [], "リースを失った処理がページを作成しました"
+    state = backends.firestore.collection(COLLECTION_NAME).document(event_id).get().to_dict()
+    assert (state['status'], state['lease_owner']) == ('processing', 'owner-b'), state
+
+@scenario
+def lease_expired_last_attempt_becomes_failed():
+    """最大試行回数の処理がリースの期限までに終わらなかった場合は、失敗として記録して再試行しない"""
+    from fakes import install_fakes
+    from firestore_service import try_start_processing, MAX_ATTEMPTS
+    backends = install_fakes()
+    assert try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-a')
+    _expire_lease(backends, 'event-1', attempts=MAX_ATTEMPTS)
+    assert not try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-b')
+    state = _event_state('event-1')
+    assert state['status'] == 'failed' and state.get('expire_at'), state
+    assert not try_start_processing('event-1', 'bucket', 'memo.m4a', 'owner-c')
+
+# ---- バッチ処理
+
+def _defer_batch_memo(backends, file_name='20261017_1200_memo.wav'):
+    """
+    処理方式に batch を指定したメモを処理し、バッチへの登録待ちにします。
+
+    Returns:
+        str: イベントID
+    """
+    import asyncio
+    import main
+    from fakes import make_wav
+    from firestore_service import generate_event_id
+    data = backends.storage.put_object('bucket', file_name, make_wav(5), metadata={'processing-mode': 'batch'})
+    assert asyncio.run(main.summarize_monologue_async(data)) == main.RESULT_DEFERRED
+    return generate_event_id('bucket', file_name)
+
+def _submit_now():
+    from batch_service import submit_pending_requests, BATCH_MAX_WAIT_SECONDS
+    return submit_pending_requests(now=time.time() + BATCH_MAX_WAIT_SECONDS)
+
+@scenario
+def batch_stale_submission_returns_to_pending():
+    """ジョブの作成中に異常終了したイベントは、期限を過ぎると登録待ちに戻り、次のジョブに含まれる"""
+    from datetime import datetime, timedelta
+    from fakes import install_fakes
+    from firestore_service import COLLECTION_NAME
+    from batch_service import reclaim_stale_submissions
+    backends = install_fakes()
+    event_id = _defer_batch_memo(backends)
+    doc_ref = backends.firestore.collection(COLLECTION_NAME).document(event_id)
+    doc_ref.update({'status': 'batch_submitting', 'batch_submitter': 'crashed', 'batch_submitting_until': datetime.utcnow() + timedelta(seconds=60)})
+    assert reclaim_stale_submissions() == 0, "期限内の作成中のイベントを戻しました"
+    doc_ref.update({'batch_submitting_until': datetime.utcnow() - timedelta(seconds=1)})
+    assert reclaim_stale_submissions() == 1
+    assert _event_state(event_id)['status'] == 'batch_pending', _event_state(event_id)
+    job_name = _submit_now()
+    assert job_name and _event_state(event_id)['batch_job'] == job_name, _event_state(event_id)
+
+@scenario
+def batch_stale_submission_joins_created_job():
+    """ジョブの作成後に異常終了したイベントは、作成済みのジョブの完了待ちに戻り、そのジョブの結果で完了する"""
+    from datetime import datetime, timedelta
+    import batch_service
+    from fakes import install_fakes
+    backends = install_fakes()
+    event_id = _defer_batch_memo(backends)
+    transition = batch_service._transition
+
+    def crash_before_submitted(event_id, from_status, to_status, fields=None):
+        if to_status == 'batch_submitted':
+            raise RuntimeError("インスタンスが停止しました")
+        return transition(event_id, from_status, to_status, fields)
+
+    batch_service._transition = crash_before_submitted
+    try:
+        _submit_now()
+    except RuntimeError:
+        pass
+    finally:
+        batch_service._transition = transition
+    assert _event_state(event_id)['status'] == 'batch_submitting'
+    later = datetime.utcnow() + timedelta(seconds=batch_service.BATCH_SUBMIT_TIMEOUT_SECONDS + 1)
+    assert batch_service.reclaim_stale_submissions(now=later) == 1
+    state = _event_state(event_id)
+    assert state['status'] == 'batch_submitted' and state['batch_job'] in backends.genai.batches.jobs, state
+    assert batch_service.poll_submitted_jobs()['completed'] == 1
+    assert _event_state(event_id)['status'] == 'completed'
+    assert len(backends.notion.page_titles()) == 1
+
+@scenario
+def batch_failed_job_requeues_interactive():
+    """バッチジョブが期限切れ・失敗で終了した場合は、メモを失敗にせず通常の処理でやり直す"""
+    from fakes import install_fakes
+    from batch_service import poll_submitted_jobs
+    backends = install_fakes()
+    event_ids = [_defer_batch_memo(backends, f"20261017_12{minute:02d}_memo.wav") for minute in range(2)]
+    job_name = _submit_now()
+    backends.genai.batches.finish(job_name, 'JOB_STATE_EXPIRED')
+    counts = poll_submitted_jobs()
+    assert (counts['requeued'], counts['failed']) == (2, 0), counts
+    for event_id in event_ids:
+        state = _event_state(event_id)
+        assert state['status'] == 'completed' and state['attempts'] == 2, state
+    assert len(backends.notion.page_titles()) == 2
+    assert not backends.genai.files_alive, "バッチ用にアップロードしたファイルが残っています"
+
+# ---- 再開可能なアップロード（upload-monologue）
+
+@contextlib.contextmanager
+def _upload_function_with_gcs():
+    """
+    アップロード用の関数のモジュールを、疑似GCSサーバーに接続したCloud Storageクライアントで読み込みます。
+    """
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import storage
+    from benchmark import _load_upload_function
+    from fakes import FakeGcsServer
+    with FakeGcsServer() as server:
+        upload = _load_upload_function()
+        upload._storage_client = storage.Client(project='fake', credentials=AnonymousCredentials(), client_options={'api_endpoint': server.url})
+        yield upload, server
+
+def _upload_chunks(session_url, data, content_type, chunk_size):
+    """
+    アプリと同じ手順で、セッションURLにチャンクごとにPUTします。失敗した場合は受信済みの範囲を問い合わせて続きから送信します。
+
+    Returns:
+        tuple: (完了時のレスポンス, 失敗して再開した回数)
+    """
+    import requests
+    offset = 0
+    resumed = 0
+    while True:
+        chunk = data[offset:offset + chunk_size]
+        end = offset + len(chunk) - 1
+        total = len(data) if end + 1 == len(data) else '*'
+        response = requests.put(session_url, data=chunk, headers={'Content-Type': content_type, 'Content-Range': f"bytes {offset}-{end}/{total}"})
+        if response.status_code in (200, 201):
+            return response, resumed
+        if response.status_code != 308:
+            # 送信済みのバイト数を問い合わせて、続きから再開する
+            resumed += 1
+            response = requests.put(session_url, headers={'Content-Range': f"bytes */{len(data)}"})
+            if response.status_code in (200, 201):
+                return response, resumed
+        committed = response.headers.get('Range')
+        offset = int(committed.rsplit('-', 1)[1]) + 1 if committed else 0
+
+@scenario
+def upload_resumable_session_in_chunks():
+    """再開可能なアップロードのセッションに256KiBの倍数のチャンクで送信すると、メディアタイプとメタデータ付きのオブジェクトになる"""
+    with _upload_function_with_gcs() as (upload, server):
+        session = upload.create_signed_url('朝の散歩', 'm4a', 'resumable', origin='https://app.example', processing_mode='batch')
+        assert session['content_type'] == 'audio/mp4', session
+        data = bytes(range(256)) * 4500
+        response, resumed = _upload_chunks(session['session_url'], data, session['content_type'], 4 * 256 * 1024)
+        assert response.json()['name'] == session['filename'] and resumed == 0
+        stored = server.objects[(upload.BUCKET_NAME, session['filename'])]
+        assert stored['data'] == data
+        assert stored['contentType'] == 'audio/mp4' and stored['metadata'] == {'processing-mode': 'batch'}, stored
+
+@scenario
+def upload_resumable_resumes_after_interruption():
+    """チャンクの途中で通信が切れても、受信済みの範囲を問い合わせて続きから送信できる"""
+    with _upload_function_with_gcs() as (upload, server):
+        session = upload.create_signed_url('長いメモ', 'wav', 'resumable')
+        data = bytes(range(256)) * 9000
+        server.interrupt_next_chunk()
+        response, resumed = _upload_chunks(session['session_url'], data, session['content_type'], 8 * 256 * 1024)
+        assert response.status_code == 200 and resumed == 1 and server.interruptions == 1
+        assert server.objects[(upload.BUCKET_NAME, session['filename'])]['data'] == data
+
+@scenario
+def upload_content_type_from_extension():
+    """アップロードセッションのメディアタイプは file_extension から判定する"""
+    expected = {'m4a': 'audio/mp4', 'WAV': 'audio/wav', 'mp3': 'audio/mpeg', 'aiff': 'audio/aiff', 'caf': 'audio/x-caf', 'xyz123': 'application/octet-stream'}
+    with _upload_function_with_gcs() as (upload, server):
+        for extension, content_type in expected.items():
+            session = upload.create_signed_url('memo', extension, 'resumable')
+            assert session['content_type'] == content_type, (extension, session)
+        assert sorted(entry['content_type'] for entry in server.sessions.values()) == sorted(expected.values())
+
+# ---- 作業ディレクトリの予算
+
+@scenario
+def workspace_budget_after_claim_keeps_attempt():
+    """処理開始後の追加の予約が予算を超えた場合は、試行回数を消費せずに処理を戻し、再試行で完了する"""
+    import asyncio
+    import main
+    from fakes import install_fakes, make_wav
+    from firestore_service import generate_event_id
+    from workspace_service import reservation_bytes, WorkspaceBudgetExceeded
+    backends = install_fakes()
+    # ストリーミング用の予約（WORKSPACE_STREAM_RESERVATION_BYTES）より大きいファイルとして配信する
+    data = dict(backends.storage.put_object('bucket', '20261017_1200_memo.wav', make_wav(5)), size=16 * 1024 * 1024)
+    event_id = generate_event_id('bucket', '20261017_1200_memo.wav')
+    streaming = reservation_bytes(data['size'], streaming=True)
+    assert reservation_bytes(data['size']) > streaming
+    manager = main.workspace_manager
+    stream_upload = main.stream_file_from_gcs_to_gemini
+    # ストリーミングでのアップロードに失敗し、ダウンロードに切り替える時点でほかのイベントが予算を使っている状態
+    main.stream_file_from_gcs_to_gemini = lambda bucket_name, file_name: None
+    try:
+        with manager.reserve('other-event', manager.budget_bytes - streaming):
+            for _ in range(3):
+                try:
+                    asyncio.run(main.summarize_monologue_async(data))
+                except WorkspaceBudgetExceeded:
+                    pass
+                else:
+                    raise AssertionError("予算を超えたのに例外が送出されませんでした")
+                state = _event_state(event_id)
+                assert (state['status'], state['attempts']) == ('failed', 0), state
+        assert asyncio.run(main.summarize_monologue_async(data)) == main.RESULT_COMPLETED
+    finally:
+        main.stream_file_from_gcs_to_gemini = stream_upload
+    state = _event_state(event_id)
+    assert (state['status'], state['attempts']) == ('completed', 1), state
+
+@scenario
+def workspace_too_large_after_claim_fails_terminally():
+    """処理開始後のファイル全体の予約が予算そのものを超えた場合は、再試行せずに失敗として記録する"""
+    import asyncio
+    import main
+    from fakes import install_fakes, make_wav
+    from firestore_service import generate_event_id, try_start_processing, MAX_ATTEMPTS
+    from workspace_service import reservation_bytes
+    backends = install_fakes()
+    manager = main.workspace_manager
+    # ストリーミング用の予約は予算に収まるが、ファイル全体の予約は予算を超えるファイルとして配信する
+    data = dict(backends.storage.put_object('bucket', '20261017_1300_memo.wav', make_wav(5)), size=manager.budget_bytes)
+    event_id = generate_event_id('bucket', '20261017_1300_memo.wav')
+    assert reservation_bytes(data['size'], streaming=True) <= manager.budget_bytes < reservation_bytes(data['size'])
+    stream_upload = main.stream_file_from_gcs_to_gemini
+    main.stream_file_from_gcs_to_gemini = lambda bucket_name, file_name: None
+    try:
+        assert asyncio.run(main.summarize_monologue_async(data)) == main.RESULT_TOO_LARGE
+    finally:
+        main.stream_file_from_gcs_to_gemini = stream_upload
+    state = _event_state(event_id)
+    assert (state['status'], state['attempts']) == ('failed', MAX_ATTEMPTS), state
+    assert 'expire_at' in state and 'next_retry_at' not in state, state
+    # 再試行の対象にならず、予約も解放されている
+    assert not try_start_processing(event_id, 'bucket', '20261017_1300_memo.wav', 'retry-owner')
+    assert manager.reserved_bytes == 0, manager.reservations
+
+# ---- 音声の変換
+
+FAKE_FFMPEG = """#!{python}
+import os, sys
+# 実際のffmpegが警告を大量に出力する場合と同じく、入力を読む前にパイプの容量を超える量をstderrに書き込む
+with open(os.environ['FAKE_FFMPEG_PID_FILE'], 'w') as f:
+    f.write(str(os.getpid()))
+sys.stderr.write('warning: ' + 'x' * 1024 * 1024 + '\\n')
+sys.stderr.flush()
+data = sys.stdin.buffer.read()
+with open(sys.argv[-1], 'wb') as f:
+    f.write(data[:1024])
+"""
+
+@contextlib.contextmanager
+def _fake_ffmpeg():
+    """
+    ffmpeg/ffprobe の代わりの実行ファイルをPATHの先頭に置きます（ffmpegのない環境でもプロセスとパイプの扱いを確認するため）。
+
+    Returns:
+        str: ffmpegのプロセスIDを書き込むファイルのパス
+    """
+    import os
+    import sys
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        for name, content in (('ffmpeg', FAKE_FFMPEG.format(python=sys.executable)), ('ffprobe', '#!/bin/sh\necho 5.0\n')):
+            path = os.path.join(directory, name)
+            with open(path, 'w') as f:
+                f.write(content)
+            os.chmod(path, 0o755)
+        pid_file = os.path.join(directory, 'ffmpeg.pid')
+        original_path = os.environ['PATH']
+        os.environ.update(PATH=directory + os.pathsep + original_path, FAKE_FFMPEG_PID_FILE=pid_file)
+        try:
+            yield pid_file
+        finally:
+            os.environ['PATH'] = original_path
+            os.environ.pop('FAKE_FFMPEG_PID_FILE', None)
+
+@scenario
+def transcode_survives_large_stderr():
+    """ffmpegがstderrに大量に出力しても、入力の書き込みが止まらずに変換が終わる"""
+    import io
+    import os
+    import tempfile
+    import threading
+    from audio_service import transcode_stream
+    with _fake_ffmpeg(), tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, 'out.opus')
+        result = {}
+        worker = threading.Thread(target=lambda: result.update(transcode_stream(io.BytesIO(bytes(8 * 1024 * 1024)), output_path)), daemon=True)
+        worker.start()
+        worker.join(20)
+        assert not worker.is_alive(), "ffmpegへの書き込みが止まりました"
+        assert result['input_bytes'] == 8 * 1024 * 1024 and result['duration_seconds'] == 5.0, result
+
+@scenario
+def transcode_kills_ffmpeg_when_input_fails():
+    """入力の読み込みで例外が発生した場合も、ffmpegのプロセスを残さない"""
+    import os
+    import tempfile
+    from audio_service import transcode_stream
+
+    class FailingStream:
+        def __init__(self):
+            self.reads = 0
+
+        def read(self, size):
+            self.reads += 1
+            if self.reads > 2:
+                raise ConnectionResetError("GCSからの読み込みが切断されました")
+            return bytes(size)
+
+    with _fake_ffmpeg() as pid_file, tempfile.TemporaryDirectory() as directory:
+        try:
+            transcode_stream(FailingStream(), os.path.join(directory, 'out.opus'))
+        except ConnectionResetError:
+            pass
+        else:
+            raise AssertionError("例外が送出されませんでした")
+        with open(pid_file) as f:
+            pid = int(f.read())
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            pass
+        else:
+            raise AssertionError(f"ffmpegのプロセス（{pid}）が残っています")
+
+# ---- アーカイブの検索インデックス
+
+def _archive_record(event_id, transcription, title='引っ越しの段取り'):
+    return {'event_id': event_id, 'title': title, 'tags': ['生活'], 'markdown': '## 要約\n引っ越しの準備', 'transcription': transcription,
+            'archived_at': '2026-10-17T12:00:00'}
+
+def _sentences(count, topic):
+    return "".join(f"{topic}について{i}番目に考えたことを話しています。" for i in range(count))
+
+def _allocated_passages(index):
+    row = index.db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'passages'").fetchone()
+    return row[0] if row else 0
+
+@scenario
+def archive_index_reuses_rows_for_reprocessed_memo():
+    """再処理されたメモはパッセージの行を再利用し、内容の変わったパッセージだけを埋め込み直す"""
+    import os
+    import tempfile
+    from fakes import install_fakes
+    from archive_index import ArchiveIndex
+    install_fakes()
+    with tempfile.TemporaryDirectory() as directory:
+        index = ArchiveIndex(directory, dimensions=16)
+        try:
+            transcription = _sentences(40, '引っ越し')
+            index.index_file('memos/a.jsonl.gz', 'v1', [_archive_record('event-a', transcription)])
+            first = index.embed_pending()
+            size = os.path.getsize(index.vectors.path)
+            # 最後の文だけが変わった再処理
+            index.index_file('memos/a.jsonl.gz', 'v2', [_archive_record('event-a', transcription + "最後に段ボールを数えました。")])
+            assert _allocated_passages(index) == first, (_allocated_passages(index), first)
+            assert index.embed_pending() == 1
+            assert os.path.getsize(index.vectors.path) == size
+            assert [result['event_id'] for result in index.search('段ボール')] == ['event-a']
+        finally:
+            index.close()
+
+@scenario
+def archive_index_rolls_back_failed_file():
+    """ファイルの途中のレコードで失敗した場合は、そのファイルのメモと取り込み済みの記録をどちらも変更しない"""
+    import tempfile
+    from fakes import install_fakes
+    from archive_index import ArchiveIndex
+    install_fakes()
+    with tempfile.TemporaryDirectory() as directory:
+        index = ArchiveIndex(directory, dimensions=16)
+        try:
+            index.index_file('memos/a.jsonl.gz', 'v1', [_archive_record('event-a', _sentences(20, '引っ越し'))])
+            index.embed_pending()
+            before = index.db.execute("SELECT id, text, embedded FROM passages ORDER BY id").fetchall()
+            try:
+                # 1件目は入れ替えられるが、2件目（イベントIDのないレコード）で失敗する
+                index.index_file('memos/a.jsonl.gz', 'v2', [_archive_record('event-a', _sentences(3, '旅行'), title='旅行の計画'), {'title': '壊れたレコード'}])
+            except KeyError:
+                pass
+            else:
+                raise AssertionError("壊れたレコードで例外が送出されませんでした")
+            assert index.db.execute("SELECT id, text, embedded FROM passages ORDER BY id").fetchall() == before
+            assert index.indexed_versions() == {'memos/a.jsonl.gz': 'v1'}
+            assert index.embed_pending() == 0
+            # ロールバックしたパッセージのベクトルは0にされず、検索できる
+            assert [result['event_id'] for result in index.search('引っ越しについて')] == ['event-a']
+            assert index.vectors.search(index._embed(['引っ越しについて'], 'RETRIEVAL_QUERY')[0], 1)
+        finally:
+            index.close()
+
+@scenario
+def archive_index_compacts_dead_rows():
+    """パッセージが減った再処理で削除した行が増えたら、IDを詰めてベクトルのファイルを作り直し、開き直しても検索できる"""
+    import os
+    import tempfile
+    from fakes import install_fakes
+    from archive_index import ArchiveIndex
+    install_fakes()
+    with tempfile.TemporaryDirectory() as directory:
+        index = ArchiveIndex(directory, dimensions=16)
+        try:
+            index.index_file('memos/a.jsonl.gz', 'v1', [_archive_record('event-a', _sentences(200, '引っ越し'))])
+            index.index_file('memos/b.jsonl.gz', 'v1', [_archive_record('event-b', _sentences(10, '旅行'), title='旅行の計画')])
+            index.embed_pending()
+            assert index.compact() == 0
+            old_path = index.vectors.path
+            index.index_file('memos/a.jsonl.gz', 'v2', [_archive_record('event-a', _sentences(4, '引っ越し'))])
+            index.embed_pending()
+            live = index.db.execute("SELECT COUNT(*) FROM passages").fetchone()[0]
+            dead = _allocated_passages(index) - live
+            assert index.compact() == dead > 0
+            assert _allocated_passages(index) == live
+            assert not os.path.exists(old_path)
+            assert os.path.getsize(index.vectors.path) == live * index.vectors.row_bytes
+            assert index.embed_pending() == 0
+        finally:
+            index.close()
+        index = ArchiveIndex(directory, dimensions=16)
+        try:
+            assert [result['event_id'] for result in index.search('旅行について', use_vectors=False)] == ['event-b']
+            # 詰めた後のIDの行に、そのパッセージのベクトルが並んでいる
+            for passage_id, text in index.db.execute("SELECT id, text FROM passages"):
+                assert index.vectors.search(index._embed([text], 'RETRIEVAL_DOCUMENT')[0], 1)[0][0] == passage_id, passage_id
+            assert [result['event_id'] for result in index.search('旅行の計画')][0] == 'event-b'
+            # 詰めた後のIDで新しいパッセージを追加・埋め込みできる
+            index.index_file('memos/c.jsonl.gz', 'v1', [_archive_record('event-c', _sentences(2, '料理'), title='料理の献立')])
+            assert index.embed_pending() == 2
+            assert [result['event_id'] for result in index.search('料理の献立')][0] == 'event-c'
+        finally:
+            index.close()
+
+# ---- 起動時の読み込み
+
+@scenario
+def duplicate_event_skips_heavy_modules():
+    """重複イベントの処理では、Gemini・Notion・スキーマのモジュールを読み込まない"""
+    import json
+    import os
+    import subprocess
+    import sys
+    from startup_profile import DUPLICATE_PATH_FORBIDDEN_MODULES, RESULT_PREFIX
+    # このプロセスでは他のシナリオが読み込み済みのため、新しいプロセスで確認する
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    completed = subprocess.run([sys.executable, 'startup_profile.py', '--run-duplicate-event'], cwd=script_dir, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr[-2000:]
+    result = next(json.loads(line[len(RESULT_PREFIX):]) for line in completed.stdout.splitlines() if line.startswith(RESULT_PREFIX))
+    assert result['result'] == 'Event already processed or in progress', result
+    assert result['forbidden_modules_loaded'] == [], f"読み込まれたモジュール: {result['forbidden_modules_loaded']}（対象: {DUPLICATE_PATH_FORBIDDEN_MODULES}）"
+
+# ---- HTTP関数
+
+@scenario
+def digest_rejects_invalid_date():
+    """ダイジェストの date が日付として解釈できない場合は、500ではなく400を返す"""
+    import json
+    from flask import Flask
+    import main
+    with Flask(__name__).test_request_context('/?period=weekly&date=2026-13-45'):
+        from flask import request
+        body, status, headers = main.generate_digest(request)
+    assert status == 400 and 'YYYY-MM-DD' in json.loads(body)['error'], (status, body)
+
+def run(names=None):
+    """
+    シナリオを実行し、結果を表示します。シナリオのログは失敗した場合だけ表示します。
+
+    Args:
+        names (list): 実行するシナリオの名前の一部。省略時はすべて
+
+    Returns:
+        int: 失敗したシナリオの数
+    """
+    failures = 0
+    for func in SCENARIOS:
+        if names and not any(name in func.__name__ for name in names):
+            continue
+        started_at = time.monotonic()
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                func()
+            status = 'OK'
+        except Exception:
+            status = 'NG'
+            failures += 1
+            print(output.getvalue(), end='')
+            traceback.print_exc()
+        print(f"{status}: {func.__name__}（{(time.monotonic() - started_at) * 1000:.0f}ms）- {func.__doc__}")
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='疑似バックエンドで障害時の振る舞いを確認します')
+    parser.add_argument('names', nargs='*', help='実行するシナリオの名前の一部')
+    parser.add_argument('--list', action='store_true', help='シナリオの一覧を表示する')
+    args = parser.parse_args()
+
+    if args.list:
+        for func in SCENARIOS:
+            print(f"{func.__name__}: {func.__doc__}")
+        raise SystemExit(0)
+    raise SystemExit(1 if run(args.names) else 0)
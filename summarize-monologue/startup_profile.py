@@ -0,0 +1,135 @@
+"""
+コールドスタート時のモジュール読み込み時間を計測するスクリプト。
+`python -X importtime` の出力をパッケージ単位に集計し、読み込みに時間がかかっているものを表示します。
+
+使い方:
+    python startup_profile.py                   # main.py の読み込み時間
+    python startup_profile.py --duplicate-path  # 重複イベントを処理するまでの読み込み時間
+
+--duplicate-path では疑似バックエンド（fakes.py）に処理済みのイベントを登録して重複イベントを処理し、
+Gemini（google-genai・pydantic）とNotionのモジュールが読み込まれていないことを確認します。
+読み込まれていた場合は終了コード1で終了します。
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+# 重複イベントの処理で読み込まれてはいけないモジュール
+DUPLICATE_PATH_FORBIDDEN_MODULES = ('google.genai', 'pydantic', 'schema', 'notion_service')
+IMPORTTIME_PATTERN = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$')
+RESULT_PREFIX = 'STARTUP_PROFILE_RESULT:'
+
+def _package_of(module_name, depth):
+    """
+    モジュール名を集計単位のパッケージ名に変換します（google.* は名前空間パッケージのため1段深く集計する）。
+    """
+    parts = module_name.split('.')
+    if parts[0] == 'google' and len(parts) > 1:
+        depth += 1
+    return '.'.join(parts[:depth])
+
+def parse_importtime(stderr, depth=1):
+    """
+    -X importtime の出力をパッケージ単位に集計します。
+
+    Args:
+        stderr (str): -X importtime の出力
+        depth (int): 集計するパッケージ名の階層
+
+    Returns:
+        tuple: (パッケージごとの {self_ms, modules} の辞書, 合計時間（ミリ秒）)
+    """
+    packages = defaultdict(lambda: {'self_ms': 0.0, 'modules': 0})
+    total_us = 0
+    for line in stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        self_us, _, _, module_name = match.groups()
+        package = packages[_package_of(module_name, depth)]
+        # 自身の読み込み時間（子モジュールを除く）を合計するため、二重に数えない
+        package['self_ms'] += int(self_us) / 1000
+        package['modules'] += 1
+        total_us += int(self_us)
+    return dict(packages), total_us / 1000
+
+def print_profile(packages, total_ms, top):
+    """
+    集計結果を読み込み時間の長い順に表示します。
+    """
+    print(f"{'package':<40}{'self_ms':>10}{'share':>8}{'modules':>9}")
+    for name, stats in sorted(packages.items(), key=lambda item: -item[1]['self_ms'])[:top]:
+        share = stats['self_ms'] / total_ms * 100 if total_ms else 0
+        print(f"{name:<40}{stats['self_ms']:>10.1f}{share:>7.1f}%{stats['modules']:>9}")
+    print(f"合計: {total_ms:.1f} ms（{sum(stats['modules'] for stats in packages.values())}モジュール）")
+
+def run_duplicate_event():
+    """
+    （子プロセスで実行）処理済みのイベントを疑似バックエンドに登録して重複イベントを処理し、
+    読み込まれたモジュールを確認します。
+    """
+    from fakes import FakeStorageClient, FakeFirestoreClient, make_wav
+    from cloud_storage_service import set_storage_client
+    from firestore_service import set_firestore_client, generate_event_id, COLLECTION_NAME
+    from main import summarize_monologue_async
+
+    storage_client = FakeStorageClient()
+    firestore_client = FakeFirestoreClient()
+    set_storage_client(storage_client)
+    set_firestore_client(firestore_client)
+
+    data = storage_client.put_object('startup-profile-bucket', '20250101000000_00000000_重複.wav', make_wav(1))
+    firestore_client.collection(COLLECTION_NAME).document(generate_event_id(data['bucket'], data['name'])).set({'status': 'completed'})
+
+    result = asyncio.run(summarize_monologue_async(data))
+    loaded = [name for name in DUPLICATE_PATH_FORBIDDEN_MODULES if name in sys.modules]
+    print(RESULT_PREFIX + json.dumps({'result': result, 'forbidden_modules_loaded': loaded}, ensure_ascii=False))
+
+def profile(duplicate_path):
+    """
+    子プロセスを -X importtime 付きで実行し、その出力を返します。
+
+    Args:
+        duplicate_path (bool): 重複イベントの処理まで実行するか
+
+    Returns:
+        tuple: (標準出力, 標準エラー出力)
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    if duplicate_path:
+        command = [sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--run-duplicate-event']
+    else:
+        command = [sys.executable, '-X', 'importtime', '-c', 'import main']
+    completed = subprocess.run(command, cwd=script_dir, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"プロファイル対象の実行に失敗しました:\n{completed.stderr[-2000:]}")
+    return completed.stdout, completed.stderr
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='コールドスタート時のモジュール読み込み時間をパッケージ単位で集計します')
+    parser.add_argument('--duplicate-path', action='store_true', help='重複イベントを処理するまでの読み込み時間を計測し、不要なモジュールが読み込まれていないか確認する')
+    parser.add_argument('--depth', type=int, default=1, help='集計するパッケージ名の階層')
+    parser.add_argument('--top', type=int, default=20, help='表示するパッケージ数')
+    parser.add_argument('--run-duplicate-event', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_duplicate_event:
+        run_duplicate_event()
+        raise SystemExit(0)
+
+    stdout, stderr = profile(args.duplicate_path)
+    packages, total_ms = parse_importtime(stderr, args.depth)
+    print_profile(packages, total_ms, args.top)
+
+    if args.duplicate_path:
+        result = next(json.loads(line[len(RESULT_PREFIX):]) for line in stdout.splitlines() if line.startswith(RESULT_PREFIX))
+        print(f"重複イベントの処理結果: {result['result']}")
+        if result['forbidden_modules_loaded']:
+            print(f"NG: 重複イベントの処理で読み込まれたモジュール: {', '.join(result['forbidden_modules_loaded'])}")
+            raise SystemExit(1)
+        print(f"OK: {', '.join(DUPLICATE_PATH_FORBIDDEN_MODULES)} は読み込まれていません")
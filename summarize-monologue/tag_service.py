@@ -0,0 +1,231 @@
+"""
+Notionのデータベースの既存のタグ（multi_selectの選択肢）を辞書として使い、生成されたタグを正規化する処理。
+表記ゆれ（全角・半角、大文字・小文字）や似たタグを既存のタグにまとめ、選択肢が増え続けないようにします。
+
+データベースのスキーマは TAG_SCHEMA_TTL_SECONDS の間インスタンス内にキャッシュし、メモごとに取得しないようにします。
+"""
+import os
+import re
+import json
+import math
+import time
+import difflib
+import threading
+import unicodedata
+from tracing import span
+
+# タグを保存するNotionのプロパティ名
+NOTION_TAG_PROPERTY = os.environ.get('NOTION_TAG_PROPERTY', 'Tags')
+# データベースのスキーマ（既存のタグ）をキャッシュする期間（秒）
+TAG_SCHEMA_TTL_SECONDS = int(os.environ.get('TAG_SCHEMA_TTL_SECONDS', 600))
+# 既存のタグとみなす文字列の類似度（difflibの比率）の下限
+TAG_FUZZY_THRESHOLD = float(os.environ.get('TAG_FUZZY_THRESHOLD', 0.85))
+# 埋め込みで既存のタグにまとめる場合のモデルとコサイン類似度の下限（モデルを指定しない場合は使わない）
+TAG_EMBEDDING_MODEL = os.environ.get('TAG_EMBEDDING_MODEL', '')
+TAG_EMBEDDING_THRESHOLD = float(os.environ.get('TAG_EMBEDDING_THRESHOLD', 0.9))
+# 別名の辞書（JSON。例: {"人工知能": "AI"}）。類似度では判定できない言い換えをまとめる
+TAG_ALIASES = json.loads(os.environ.get('TAG_ALIASES', '{}'))
+# 要約のプロンプトに含める既存のタグの最大数
+TAG_VOCABULARY_LIMIT = int(os.environ.get('TAG_VOCABULARY_LIMIT', 100))
+# 1つのメモに付けるタグの最大数
+MAX_TAGS = 3
+
+def normalize_tag_text(tag):
+    """
+    タグの表記を整えます（全角英数字・記号を半角にし、前後の空白と先頭の#を除く）。
+
+    Args:
+        tag (str): タグ
+
+    Returns:
+        str: 表記を整えたタグ
+    """
+    text = unicodedata.normalize('NFKC', tag)
+    return re.sub(r'\s+', ' ', text).strip().lstrip('#').strip()
+
+def tag_key(tag):
+    """
+    タグを比較するためのキーを返します（表記を整えたうえで大文字・小文字を区別しない）。
+    """
+    return normalize_tag_text(tag).casefold()
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class TagDictionary:
+    """
+    Notionのデータベースの既存のタグをキャッシュし、生成されたタグを既存のタグに対応付ける。
+    """
+
+    def __init__(self, ttl_seconds=TAG_SCHEMA_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.options = []
+        self.fetched_at = None
+        self.embeddings = {}
+
+    def _fetch_options(self):
+        """
+        Notionのデータベースのスキーマから、タグのプロパティの選択肢を取得します。
+        """
+        from notion_service import get_notion_client, NOTION_DATABASE_ID
+
+        with span("notion.retrieve_database") as s:
+            response = get_notion_client().retrieve_database(NOTION_DATABASE_ID)
+            if response.status_code != 200:
+                s.set(error=f"status_code={response.status_code}")
+                raise RuntimeError(f"Notionのデータベースの取得に失敗しました: ステータスコード={response.status_code}, レスポンス={response.text}")
+            tag_property = response.json().get('properties', {}).get(NOTION_TAG_PROPERTY, {})
+            options = [option['name'] for option in tag_property.get('multi_select', {}).get('options', [])]
+            s.set(options=len(options))
+            return options
+
+    def get_options(self):
+        """
+        既存のタグの一覧を返します。キャッシュの期限が切れている場合のみNotionから取得します。
+        取得に失敗した場合は、前回取得した一覧（なければ空の一覧）を使います。
+
+        Returns:
+            list: 既存のタグの名前のリスト
+        """
+        with self.lock:
+            if self.fetched_at is None or time.monotonic() - self.fetched_at >= self.ttl_seconds:
+                try:
+                    self.options = self._fetch_options()
+                    self.embeddings = {}
+                    print(f"Notionのデータベースから既存のタグを取得しました: {len(self.options)}件")
+                except Exception as e:
+                    print(f"既存のタグの取得に失敗したため、{'前回取得した' if self.options else '空の'}一覧を使います: {e}")
+                # 失敗した場合も期限までは再取得しない（Notionの障害時にメモごとに取得を試みないようにする）
+                self.fetched_at = time.monotonic()
+            return list(self.options)
+
+    def remember(self, tags):
+        """
+        新しく作成されたタグを既存のタグに加えます（次回の取得を待たずに、以降のメモで同じタグにまとめるため）。
+        """
+        with self.lock:
+            known = {tag_key(option) for option in self.options}
+            self.options.extend(tag for tag in tags if tag_key(tag) not in known)
+
+    def _embed(self, texts):
+        from gemini_service import get_genai_client
+        response = get_genai_client().models.embed_content(model=TAG_EMBEDDING_MODEL, contents=texts)
+        return [embedding.values for embedding in response.embeddings]
+
+    def _match_by_embedding(self, tag, options):
+        """
+        埋め込みのコサイン類似度が最も高い既存のタグを返します（TAG_EMBEDDING_THRESHOLD 未満の場合はNone）。
+        既存のタグの埋め込みはスキーマを取得し直すまで再利用します。
+        """
+        missing = [option for option in options if option not in self.embeddings]
+        if missing:
+            self.embeddings.update(zip(missing, self._embed(missing)))
+        vector = self._embed([tag])[0]
+        best = max(options, key=lambda option: _cosine(vector, self.embeddings[option]))
+        return best if _cosine(vector, self.embeddings[best]) >= TAG_EMBEDDING_THRESHOLD else None
+
+    def match(self, tag, options):
+        """
+        タグに対応する既存のタグを返します。対応するものがない場合は表記を整えたタグを返します。
+
+        Args:
+            tag (str): 生成されたタグ
+            options (list): 既存のタグの名前のリスト
+
+        Returns:
+            str: 対応する既存のタグ、または表記を整えたタグ
+        """
+        text = normalize_tag_text(tag)
+        text = TAG_ALIASES.get(text, TAG_ALIASES.get(text.casefold(), text))
+        by_key = {tag_key(option): option for option in options}
+        key = tag_key(text)
+        if key in by_key:
+            return by_key[key]
+
+        matches = difflib.get_close_matches(key, list(by_key), n=1, cutoff=TAG_FUZZY_THRESHOLD)
+        if matches:
+            return by_key[matches[0]]
+
+        if TAG_EMBEDDING_MODEL and options:
+            try:
+                matched = self._match_by_embedding(text, options)
+                if matched:
+                    return matched
+            except Exception as e:
+                print(f"埋め込みによるタグの対応付けに失敗しました: {e}")
+        return text
+
+    def normalize(self, tags):
+        """
+        生成されたタグを既存のタグに対応付け、重複を除きます。
+
+        Args:
+            tags (list): 生成されたタグのリスト
+
+        Returns:
+            list: 正規化したタグのリスト（最大 MAX_TAGS 件）
+        """
+        options = self.get_options()
+        with span("tags.normalize", tags=len(tags)) as s:
+            normalized = []
+            mapped = 0
+            for tag in tags:
+                text = normalize_tag_text(tag)
+                if not text:
+                    continue
+                matched = self.match(tag, options)
+                mapped += matched != text
+                if tag_key(matched) not in {tag_key(existing) for existing in normalized}:
+                    normalized.append(matched)
+            normalized = normalized[:MAX_TAGS]
+            new_tags = [tag for tag in normalized if tag not in options]
+            s.set(mapped=mapped, new=len(new_tags))
+        if new_tags:
+            self.remember(new_tags)
+        if normalized != list(tags):
+            print(f"タグを正規化しました: {tags} -> {normalized}")
+        return normalized
+
+# 既存のタグの辞書（インスタンス内で共有する）
+tag_dictionary = TagDictionary()
+
+def get_tag_options():
+    """
+    既存のタグの一覧を取得します（キャッシュの期限内であればNotionに問い合わせない）。
+
+    Returns:
+        list: 既存のタグの名前のリスト
+    """
+    return tag_dictionary.get_options()
+
+def normalize_tags(tags):
+    """
+    生成されたタグを既存のタグに対応付けて正規化します。
+
+    Args:
+        tags (list): 生成されたタグのリスト
+
+    Returns:
+        list: 正規化したタグのリスト
+    """
+    return tag_dictionary.normalize(tags)
+
+def tag_vocabulary_prompt():
+    """
+    既存のタグを要約のプロンプトに含めるための指示を作成します。
+
+    Returns:
+        str: 既存のタグの一覧と、その中から選ぶよう求める指示。既存のタグがない場合は空文字列
+    """
+    options = get_tag_options()[:TAG_VOCABULARY_LIMIT]
+    if not options:
+        return ""
+    return (
+        "\n<existing-tags>\n"
+        "タグは次の既存のタグからできるだけ選んでください。該当するものがない場合のみ、新しいタグを作成してください。\n"
+        + "、".join(options)
+        + "\n</existing-tags>\n"
+    )
@@ -0,0 +1,128 @@
+"""
+構造化ログ（tracing.pyが出力するスパンのJSON）を集計し、スパンごとのレイテンシとエラー数を出力するスクリプト。
+
+使い方:
+    python trace_report.py trace.log
+    gcloud logging read 'jsonPayload.span:*' --format=json | python trace_report.py -
+
+1行1件のJSONと、Cloud Loggingのエクスポート形式（jsonPayloadを持つエントリの配列）の両方に対応しています。
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+# スパンごとに合計を出力する数値属性
+SUM_ATTRIBUTES = ('bytes', 'payload_bytes', 'prompt_token_count', 'cached_content_token_count', 'candidates_token_count', 'total_token_count', 'retries')
+
+def _percentile(values, percent):
+    """
+    最近傍法でパーセンタイルを求めます。
+
+    Args:
+        values (list): 昇順に並んだ値
+        percent (float): パーセンタイル（0〜100）
+
+    Returns:
+        float: パーセンタイルの値
+    """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+def _iter_records(lines):
+    """
+    ログの行からスパンのレコードを取り出します。JSONでない行は無視します。
+
+    Args:
+        lines (iterable): ログの行
+
+    Yields:
+        dict: スパンのレコード
+    """
+    text = ''.join(lines)
+    stripped = text.lstrip()
+    if stripped.startswith('['):
+        entries = json.loads(stripped)
+    else:
+        entries = []
+        for line in text.splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        record = entry.get('jsonPayload', entry)
+        if record.get('span'):
+            yield record
+
+def summarize_spans(records):
+    """
+    スパン名ごとに件数・エラー数・レイテンシのパーセンタイル・数値属性の合計を集計します。
+
+    Args:
+        records (iterable): スパンのレコード
+
+    Returns:
+        dict: スパン名ごとの集計結果
+    """
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    totals = defaultdict(lambda: defaultdict(float))
+    for record in records:
+        name = record['span']
+        latencies[name].append(float(record.get('latency_ms', 0)))
+        if record.get('status') == 'error':
+            errors[name] += 1
+        for key in SUM_ATTRIBUTES:
+            if isinstance(record.get(key), (int, float)):
+                totals[name][key] += record[key]
+
+    summary = {}
+    for name, values in latencies.items():
+        values.sort()
+        summary[name] = {
+            'count': len(values),
+            'errors': errors[name],
+            'p50_ms': _percentile(values, 50),
+            'p90_ms': _percentile(values, 90),
+            'p99_ms': _percentile(values, 99),
+            'max_ms': values[-1],
+            **{key: int(value) for key, value in totals[name].items()},
+        }
+    return summary
+
+def print_summary(summary):
+    """
+    集計結果を表形式で出力します。
+
+    Args:
+        summary (dict): summarize_spansの戻り値
+    """
+    print(f"{'span':<40}{'count':>7}{'errors':>7}{'p50_ms':>10}{'p90_ms':>10}{'p99_ms':>10}{'max_ms':>10}  totals")
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]['p50_ms'] * item[1]['count']):
+        totals = ', '.join(f"{key}={stats[key]}" for key in SUM_ATTRIBUTES if key in stats)
+        print(f"{name:<40}{stats['count']:>7}{stats['errors']:>7}{stats['p50_ms']:>10.1f}{stats['p90_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}  {totals}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='構造化ログからスパンごとのレイテンシとエラー数を集計します')
+    parser.add_argument('paths', nargs='+', help='ログファイルのパス（-で標準入力）')
+    parser.add_argument('--json', action='store_true', help='集計結果をJSONで出力する')
+    args = parser.parse_args()
+
+    records = []
+    for path in args.paths:
+        if path == '-':
+            records.extend(_iter_records(sys.stdin))
+        else:
+            with open(path, encoding='utf-8') as f:
+                records.extend(_iter_records(f))
+
+    summary = summarize_spans(records)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print_summary(summary)
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import contextvars
+import threading
+from contextlib import contextmanager
+
+# 構造化ログを標準出力に加えて書き出すファイル（集計レポート用、任意）
+TRACE_LOG_PATH = os.environ.get('TRACE_LOG_PATH')
+# OpenTelemetryにスパンを送信するか（opentelemetry-sdk と OTLPエクスポーターが必要）
+OTEL_EXPORTER_ENABLED = os.environ.get('OTEL_EXPORTER_ENABLED', 'false').lower() == 'true'
+
+# 処理中のイベントID（asyncio.to_threadで実行したスレッドにも引き継がれる）
+current_event_id = contextvars.ContextVar('event_id', default=None)
+_log_lock = threading.Lock()
+
+def _create_otel_tracer():
+    """
+    OpenTelemetryのトレーサーを作成します。無効化されている場合や、ライブラリがない場合はNoneを返します。
+    """
+    if not OTEL_EXPORTER_ENABLED:
+        return None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        print(f"OpenTelemetryのライブラリが見つからないため、スパンは送信しません: {e}")
+        return None
+
+    provider = TracerProvider(resource=Resource.create({'service.name': 'summarize-monologue'}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer('summarize-monologue')
+
+otel_tracer = _create_otel_tracer()
+
+def emit(record):
+    """
+    構造化ログを1行のJSONとして出力します（Cloud LoggingではjsonPayloadとして取り込まれる）。
+
+    Args:
+        record (dict): ログの内容
+    """
+    severity = record.get('severity') or ('ERROR' if record.get('status') == 'error' else 'INFO')
+    line = json.dumps(dict(record, severity=severity), ensure_ascii=False, default=str)
+    print(line)
+    if TRACE_LOG_PATH:
+        with _log_lock, open(TRACE_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+class Span:
+    """
+    計測中のスパン。処理の途中で判明した値（バイト数やトークン数など）を属性として追加できる。
+    """
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """
+        スパンに属性を追加します。Noneの値は記録しません。
+        errorを設定したスパンは失敗として記録されます。
+        """
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+@contextmanager
+def span(name, **attributes):
+    """
+    処理の所要時間を計測し、終了時にイベントIDと属性を含む構造化ログを出力するコンテキストマネージャー。
+
+    Args:
+        name (str): スパン名（例: "gcs.download"）
+        attributes: スパンの属性
+
+    Yields:
+        Span: 属性を追加するためのスパン
+    """
+    current = Span(name, {key: value for key, value in attributes.items() if value is not None})
+    started_at = time.perf_counter()
+    otel_context = otel_tracer.start_as_current_span(name) if otel_tracer else None
+    otel_span = otel_context.__enter__() if otel_context else None
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=str(e))
+        raise
+    finally:
+        latency_ms = round((time.perf_counter() - started_at) * 1000, 1)
+        record = {
+            'message': f"span {name}",
+            'span': name,
+            'event_id': current_event_id.get(),
+            # 例外を返り値に変換する関数でも、errorを設定すれば失敗として記録される
+            'status': 'error' if 'error' in current.attributes else 'ok',
+            'latency_ms': latency_ms,
+            **current.attributes,
+        }
+        emit(record)
+        if otel_span is not None:
+            for key, value in record.items():
+                if isinstance(value, (str, bool, int, float)):
+                    otel_span.set_attribute(key, value)
+            otel_context.__exit__(None, None, None)
@@ -0,0 +1,173 @@
+"""
+作業キュー（queue_service.py）からジョブを取り出し、並列数を制御しながら処理するワーカー。
+Cloud Schedulerから定期的に呼び出すHTTP関数（main.drain_work_queue）と、ローカルで実行するコマンドの両方から使います。
+
+使い方:
+    QUEUE_BACKEND=sqlite python worker.py --concurrency 4 --batch-size 10
+
+処理が完了しなかったジョブは、Firestoreに記録された再試行時刻（失敗時）またはリース期限（他のインスタンスが処理中の場合）まで
+キューに戻します。処理済み・最大試行回数に達したイベントのジョブはキューから削除します。
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timezone
+from queue_service import get_work_queue
+from firestore_service import get_processing_state, _as_naive_utc, MAX_ATTEMPTS, RETRY_BACKOFF_SECONDS
+from tracing import current_event_id, emit, span
+from main import summarize_monologue_async, RESULT_COMPLETED, RESULT_DEFERRED, RESULT_TOO_LARGE
+
+# 同時に処理するジョブ数（GeminiとNotionへの同時リクエスト数の上限の目安）
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 4))
+# 1回の取り出しで取得するジョブの最大数
+WORKER_BATCH_SIZE = int(os.environ.get('WORKER_BATCH_SIZE', 10))
+# 新しいジョブを取り出す時間の上限（秒）。関数のタイムアウトまでに処理中のジョブを終えられるよう、余裕を持たせる
+WORKER_MAX_SECONDS = int(os.environ.get('WORKER_MAX_SECONDS', 300))
+
+def _timestamp(value):
+    """
+    Firestoreから取得した時刻をUNIX時間に変換します。
+    """
+    return _as_naive_utc(value).replace(tzinfo=timezone.utc).timestamp()
+
+def next_visible_at(event_id, now):
+    """
+    処理が完了しなかったジョブを次に取り出す時刻を、Firestoreの処理状況から求めます。
+
+    Args:
+        event_id (str): イベントID
+        now (float): 現在時刻（UNIX時間）
+
+    Returns:
+        float: 次に取り出す時刻。再試行しない（処理済み・最大試行回数に達した）場合はNone
+    """
+    state = get_processing_state(event_id)
+    if state is None:
+        # 処理開始の記録に失敗した場合など
+        return now + RETRY_BACKOFF_SECONDS
+    status = state.get('status')
+    if status == 'completed':
+        return None
+    retry_at = state.get('next_retry_at') if status == 'failed' else state.get('lease_until')
+    retry_at = _timestamp(retry_at) if retry_at is not None else now + RETRY_BACKOFF_SECONDS
+    # 最後の試行が失敗した、またはリースが切れたまま引き継げなくなったイベントは再試行しない
+    if state.get('attempts', 1) >= MAX_ATTEMPTS and (status == 'failed' or retry_at <= now):
+        return None
+    return max(now, retry_at)
+
+def process_job(queue, owner, job):
+    """
+    1件のジョブをCloudEventトリガー時と同じパイプラインで処理し、結果に応じてキューから削除するか戻します。
+
+    Args:
+        queue: キューの実装
+        owner (str): このワーカーを識別するID
+        job (dict): 取り出したジョブ
+
+    Returns:
+        str: completed（処理完了）/ deferred（バッチ処理に登録）/ acked（処理不要・処理できないため削除）/ requeued（キューに戻した）
+    """
+    event_id = job['event_id']
+    current_event_id.set(event_id)
+    wait_seconds = time.time() - job['enqueued_at']
+    # キューでの待ち時間をスパンと同じ形式で出力し、trace_report.py でパーセンタイルを集計できるようにする
+    emit({
+        'message': "queue wait",
+        'span': "queue.wait",
+        'event_id': event_id,
+        'status': 'ok',
+        'latency_ms': round(wait_seconds * 1000, 1),
+        'priority': job['priority'],
+        'deliveries': job['deliveries'],
+    })
+
+    with span("queue.job", priority=job['priority'], deliveries=job['deliveries']) as s:
+        try:
+            result = asyncio.run(summarize_monologue_async(job['data']))
+        except Exception as e:
+            result = f"Error: {e}"
+
+        if result in (RESULT_COMPLETED, RESULT_DEFERRED):
+            queue.ack(event_id, owner)
+            outcome = 'completed' if result == RESULT_COMPLETED else 'deferred'
+        elif result == RESULT_TOO_LARGE:
+            # 作業ディレクトリの予算より大きいファイルは再試行しても処理できない
+            queue.ack(event_id, owner)
+            outcome = 'acked'
+        else:
+            visible_at = next_visible_at(event_id, time.time())
+            if visible_at is None:
+                queue.ack(event_id, owner)
+                outcome = 'acked'
+            else:
+                queue.release(event_id, owner, visible_at)
+                outcome = 'requeued'
+        s.set(outcome=outcome)
+    return outcome
+
+def drain_queue(concurrency=WORKER_CONCURRENCY, batch_size=WORKER_BATCH_SIZE, max_seconds=WORKER_MAX_SECONDS, queue=None):
+    """
+    キューが空になるか、時間の上限に達するまでジョブを取り出して処理します。
+    処理中のジョブが concurrency 件未満になるたびに、空いた分（最大 batch_size 件）を優先度の高い順に取り出します。
+
+    Args:
+        concurrency (int): 同時に処理するジョブ数
+        batch_size (int): 1回の取り出しで取得するジョブの最大数
+        max_seconds (float): 新しいジョブを取り出す時間の上限（秒）
+        queue: キューの実装。省略時は設定に応じたキュー
+
+    Returns:
+        dict: 処理件数とキューの深さ
+    """
+    queue = queue or get_work_queue()
+    owner = uuid.uuid4().hex
+    started_at = time.time()
+    outcomes = Counter()
+    leases = 0
+
+    with span("queue.drain", concurrency=concurrency, batch_size=batch_size) as s:
+        before = queue.stats(started_at)
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                free = concurrency - len(in_flight)
+                if free > 0 and time.time() - started_at < max_seconds:
+                    jobs = queue.lease(min(batch_size, free), owner, time.time())
+                    leases += 1 if jobs else 0
+                    in_flight |= {executor.submit(process_job, queue, owner, job) for job in jobs}
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    outcomes[future.result()] += 1
+        after = queue.stats(time.time())
+        s.set(
+            processed=sum(outcomes.values()), leases=leases,
+            depth_before=before['depth'], depth_after=after['depth'], ready_after=after['ready'],
+            **{f"outcome_{name}": count for name, count in outcomes.items()},
+        )
+
+    summary = {
+        'processed': sum(outcomes.values()),
+        'outcomes': dict(outcomes),
+        'leases': leases,
+        'elapsed_seconds': round(time.time() - started_at, 3),
+        'queue_before': before,
+        'queue_after': after,
+    }
+    print(f"キューの処理を終了しました: {json.dumps(summary, ensure_ascii=False)}")
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='作業キューからジョブを取り出して処理します')
+    parser.add_argument('--concurrency', type=int, default=WORKER_CONCURRENCY, help='同時に処理するジョブ数')
+    parser.add_argument('--batch-size', type=int, default=WORKER_BATCH_SIZE, help='1回の取り出しで取得するジョブの最大数')
+    parser.add_argument('--max-seconds', type=float, default=WORKER_MAX_SECONDS, help='新しいジョブを取り出す時間の上限（秒）')
+    args = parser.parse_args()
+
+    drain_queue(args.concurrency, args.batch_size, args.max_seconds)
@@ -0,0 +1,237 @@
+"""
+イベントごとの作業ディレクトリと、その容量の予約を管理する処理。
+
+Cloud Functionsの/tmpはインスタンスのメモリを消費するため、大きな音声が同時に届くとインスタンスが強制終了し、
+処理中として記録したイベントがリースの期限まで残ってしまいます。
+処理開始の記録より前に、CloudEventのオブジェクトのサイズで容量を予約し、予算を超える場合は再試行可能なエラーで後回しにします。
+
+    with workspace_manager.reserve(event_id, reservation_bytes(size)) as workspace:
+        local_file_path = workspace.path(file_name)
+        ...
+    # 作業ディレクトリは例外が発生した場合も削除され、予約は解放される
+"""
+import os
+import shutil
+import threading
+import uuid
+from tracing import current_event_id, emit
+
+WORKSPACE_ROOT = os.environ.get('WORKSPACE_ROOT', '/tmp/monologue-workspaces')
+# 作業ディレクトリに使える容量の予算（バイト）。0の場合はインスタンスのメモリの WORKSPACE_MEMORY_FRACTION を使う
+WORKSPACE_BUDGET_BYTES = int(os.environ.get('WORKSPACE_BUDGET_BYTES', 0))
+WORKSPACE_MEMORY_FRACTION = float(os.environ.get('WORKSPACE_MEMORY_FRACTION', 0.5))
+# 1件あたりに予約する容量のオブジェクトのサイズに対する倍率（変換後の音声などの一時ファイルの分を含める）
+WORKSPACE_SIZE_FACTOR = float(os.environ.get('WORKSPACE_SIZE_FACTOR', 1.5))
+# サイズが不明なオブジェクトに予約する容量
+WORKSPACE_DEFAULT_RESERVATION_BYTES = int(os.environ.get('WORKSPACE_DEFAULT_RESERVATION_BYTES', 64 * 1024 * 1024))
+# ストリーミングで処理する（一時ファイルを書き込まない）場合に予約する容量。失敗してダウンロードに切り替える場合は ensure で追加する
+WORKSPACE_STREAM_RESERVATION_BYTES = int(os.environ.get('WORKSPACE_STREAM_RESERVATION_BYTES', 8 * 1024 * 1024))
+# ファイルシステムの空き容量として残しておく量
+WORKSPACE_DISK_MARGIN_BYTES = 16 * 1024 * 1024
+CGROUP_MEMORY_LIMIT_PATHS = ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+
+class WorkspaceBudgetExceeded(Exception):
+    """
+    作業ディレクトリの容量の予算を超えるため、処理を後回しにすることを表す例外（再試行すれば処理できる）。
+    """
+
+class WorkspaceTooLarge(Exception):
+    """
+    1件だけでも予算を超えるため、このインスタンスでは処理できないことを表す例外（再試行しても解消しない）。
+    """
+
+def _memory_limit_bytes():
+    """
+    インスタンスのメモリの上限（コンテナのcgroupの上限、なければ物理メモリ）を返します。
+    """
+    for path in CGROUP_MEMORY_LIMIT_PATHS:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value.isdigit() and int(value) < 1 << 60:
+                return int(value)
+        except OSError:
+            continue
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def default_budget_bytes():
+    """
+    作業ディレクトリの容量の予算を返します（WORKSPACE_BUDGET_BYTES が未設定の場合はメモリの上限から求める）。
+    """
+    return WORKSPACE_BUDGET_BYTES or int(_memory_limit_bytes() * WORKSPACE_MEMORY_FRACTION)
+
+def reservation_bytes(size, streaming=False):
+    """
+    オブジェクトのサイズから、1件の処理に予約する容量を求めます。
+
+    Args:
+        size (int): CloudEventのオブジェクトのサイズ（バイト）。不明な場合はNone
+        streaming (bool): 一時ファイルを書き込まずにストリーミングで処理する場合True
+
+    Returns:
+        int: 予約する容量（バイト）
+    """
+    full = int(int(size) * WORKSPACE_SIZE_FACTOR) if size else WORKSPACE_DEFAULT_RESERVATION_BYTES
+    return min(full, WORKSPACE_STREAM_RESERVATION_BYTES) if streaming else full
+
+class Workspace:
+    """
+    1件のイベントの作業ディレクトリ。
+    """
+
+    def __init__(self, manager, event_id, key, directory, reserved_bytes):
+        self.manager = manager
+        self.event_id = event_id
+        self.key = key
+        self.directory = directory
+        self.reserved_bytes = reserved_bytes
+
+    def path(self, file_name):
+        """
+        作業ディレクトリ内のファイルのパスを返します（オブジェクト名のディレクトリ部分は除く）。
+        """
+        return os.path.join(self.directory, os.path.basename(file_name))
+
+    def ensure(self, required_bytes):
+        """
+        予約した容量が required_bytes に満たない場合、不足分を追加で予約します（ストリーミングからダウンロードに切り替える場合など）。
+
+        Raises:
+            WorkspaceBudgetExceeded: 予算を超える場合（再試行すれば処理できる）
+            WorkspaceTooLarge: 1件だけでも予算を超える場合
+        """
+        if required_bytes > self.reserved_bytes:
+            self.manager._grow(self.event_id, self.key, required_bytes)
+            self.reserved_bytes = required_bytes
+
+    def __enter__(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError:
+            self.manager.release(self)
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self.manager.release(self)
+
+class WorkspaceManager:
+    """
+    作業ディレクトリの容量の予約を、インスタンス内の同時に処理中のイベントで共有する予算と照らし合わせて管理する。
+    """
+
+    def __init__(self, root=WORKSPACE_ROOT, budget_bytes=None):
+        self.root = root
+        self.budget_bytes = budget_bytes or default_budget_bytes()
+        self.lock = threading.Lock()
+        self.reservations = {}
+        self.peak_reserved_bytes = 0
+        self.rejected = 0
+
+    @property
+    def reserved_bytes(self):
+        return sum(self.reservations.values())
+
+    def _emit(self, event_id, action, requested_bytes, status='ok'):
+        """
+        予算の使用状況を構造化ログとして出力します（trace_report.py でスパンと同じように集計できる）。
+        """
+        with self.lock:
+            reserved = self.reserved_bytes
+            in_flight = len(self.reservations)
+            peak = self.peak_reserved_bytes
+        emit({
+            'message': f"workspace {action}",
+            'span': f"workspace.{action}",
+            'event_id': event_id or current_event_id.get(),
+            'status': status,
+            'latency_ms': 0,
+            'requested_bytes': requested_bytes,
+            'reserved_bytes': reserved,
+            'peak_reserved_bytes': peak,
+            'budget_bytes': self.budget_bytes,
+            'utilization': round(reserved / self.budget_bytes, 3) if self.budget_bytes else None,
+            'in_flight': in_flight,
+        })
+
+    def _check(self, key, requested_bytes):
+        """
+        予約済みの容量（key の分を除く）に requested_bytes を加えても、予算とファイルシステムの空き容量に収まるかを確認し、予約します（lock を取得して呼び出す）。
+        """
+        if requested_bytes > self.budget_bytes:
+            raise WorkspaceTooLarge(f"作業ディレクトリの予算（{self.budget_bytes} bytes）を超えるため処理できません: {requested_bytes} bytes")
+        others = self.reserved_bytes - self.reservations.get(key, 0)
+        free_bytes = shutil.disk_usage(self.root).free - WORKSPACE_DISK_MARGIN_BYTES
+        if others + requested_bytes > self.budget_bytes or requested_bytes > free_bytes:
+            self.rejected += 1
+            raise WorkspaceBudgetExceeded(
+                f"作業ディレクトリの予算を超えるため後回しにします: 予約済み {others} bytes + {requested_bytes} bytes"
+                f" > 予算 {self.budget_bytes} bytes（空き容量 {free_bytes} bytes）"
+            )
+        self.reservations[key] = requested_bytes
+        self.peak_reserved_bytes = max(self.peak_reserved_bytes, self.reserved_bytes)
+
+    def _grow(self, event_id, key, requested_bytes):
+        """
+        予約済みの容量を requested_bytes に増やします。
+        """
+        try:
+            with self.lock:
+                self._check(key, requested_bytes)
+        except (WorkspaceBudgetExceeded, WorkspaceTooLarge):
+            self._emit(event_id, 'reject', requested_bytes, status='error')
+            raise
+        self._emit(event_id, 'grow', requested_bytes)
+
+    def reserve(self, event_id, requested_bytes):
+        """
+        容量を予約してイベントの作業ディレクトリを返します。
+        作業ディレクトリは with ブロックの終了時（例外の場合を含む）に削除され、予約は解放されます。
+
+        Args:
+            event_id (str): イベントID
+            requested_bytes (int): 予約する容量（reservation_bytes で求める）
+
+        Returns:
+            Workspace: 作業ディレクトリ
+
+        Raises:
+            WorkspaceBudgetExceeded: 予算を超える場合（再試行すれば処理できる）
+            WorkspaceTooLarge: 1件だけでも予算を超える場合
+        """
+        # 同じイベントの重複配信が同時に届いても作業ディレクトリが重ならないよう、配信ごとのキーで予約する
+        key = f"{event_id}-{uuid.uuid4().hex[:8]}"
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with self.lock:
+                self._check(key, requested_bytes)
+        except (WorkspaceBudgetExceeded, WorkspaceTooLarge):
+            self._emit(event_id, 'reject', requested_bytes, status='error')
+            raise
+        self._emit(event_id, 'reserve', requested_bytes)
+        return Workspace(self, event_id, key, os.path.join(self.root, key), requested_bytes)
+
+    def release(self, workspace):
+        """
+        作業ディレクトリを削除し、予約を解放します。
+        """
+        shutil.rmtree(workspace.directory, ignore_errors=True)
+        with self.lock:
+            self.reservations.pop(workspace.key, None)
+        self._emit(workspace.event_id, 'release', workspace.reserved_bytes)
+
+    def stats(self):
+        """
+        予算の使用状況を返します。
+        """
+        with self.lock:
+            return {
+                'budget_bytes': self.budget_bytes,
+                'reserved_bytes': self.reserved_bytes,
+                'peak_reserved_bytes': self.peak_reserved_bytes,
+                'in_flight': len(self.reservations),
+                'rejected': self.rejected,
+            }
+
+# 作業ディレクトリの管理（インスタンス内で共有する）
+workspace_manager = WorkspaceManager()
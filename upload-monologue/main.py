@@ -4,17 +4,184 @@ from google.cloud import storage
 import google.auth
 import google.auth.transport.requests
 import datetime
+import mimetypes
+import threading
 import uuid
 import os
 import json
 
 # 環境変数からバケット名を取得
 BUCKET_NAME = os.environ.get('BUCKET_NAME', 'gcs_bucket_name')
+# アクセストークンの有効期限がこの秒数以内に迫っていたら更新する
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+# 1回のリクエストで発行できる署名付きURLの上限
+MAX_BATCH_SIZE = 20
+# 拡張子ごとのメディアタイプ（mimetypesで判定できない、または判定が環境依存のもの）
+AUDIO_CONTENT_TYPES = {
+    'aiff': 'audio/aiff',
+    'aif': 'audio/aiff',
+    'aifc': 'audio/aiff',
+    'm4a': 'audio/mp4',
+    'mp4': 'audio/mp4',
+    'mp3': 'audio/mpeg',
+    'wav': 'audio/wav',
+    'caf': 'audio/x-caf',
+    'flac': 'audio/flac',
+    'ogg': 'audio/ogg',
+    'opus': 'audio/ogg',
+    'webm': 'audio/webm',
+    'aac': 'audio/aac',
+}
+# アップロード方式（signed_url: 1回のPUTでアップロード / resumable: 分割・再開可能なアップロード）
+UPLOAD_MODES = ('signed_url', 'resumable')
+# 処理方式（interactive: アップロード後すぐに処理 / batch: GeminiのバッチAPIでまとめて処理。急がないメモ向け）
+PROCESSING_MODES = ('interactive', 'batch')
+# 処理方式を要約の関数に伝えるオブジェクトのメタデータ
+PROCESSING_MODE_METADATA_KEY = 'processing-mode'
+
+# リクエストをまたいで再利用する認証情報とクライアント
+_credentials = None
+_storage_client = None
+_credentials_lock = threading.Lock()
+_storage_client_lock = threading.Lock()
+
+def get_credentials():
+    """認証情報を取得する。
+    初回のみ生成し、アクセストークンの有効期限が近い場合のみ更新する。
+    同時に複数のリクエストが来ても更新は1回だけ行われる。
+
+    Returns:
+        google.auth.credentials.Credentials: 有効なアクセストークンを持つ認証情報。
+    """
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials, _ = google.auth.default()
+
+        expiry = _credentials.expiry
+        needs_refresh = (
+            not _credentials.token
+            or expiry is None
+            or expiry - datetime.datetime.utcnow() < datetime.timedelta(seconds=TOKEN_REFRESH_MARGIN_SECONDS)
+        )
+        if needs_refresh:
+            _credentials.refresh(google.auth.transport.requests.Request())
+        return _credentials
+
+def get_storage_client():
+    """Cloud Storageクライアントを取得する。初回のみ生成し、以降は再利用する。
+
+    Returns:
+        google.cloud.storage.Client: Cloud Storageクライアント。
+    """
+    global _storage_client
+    if _storage_client is None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client()
+    return _storage_client
+
+def get_content_type(file_extension):
+    """拡張子からメディアタイプを判定する。
+
+    Args:
+        file_extension (str): ファイルの拡張子。
+
+    Returns:
+        str: メディアタイプ。判定できない場合はapplication/octet-stream。
+    """
+    extension = file_extension.lower().lstrip('.')
+    if extension in AUDIO_CONTENT_TYPES:
+        return AUDIO_CONTENT_TYPES[extension]
+    content_type, _ = mimetypes.guess_type(f"file.{extension}")
+    return content_type or 'application/octet-stream'
+
+def create_resumable_upload_session(blob, content_type, origin=None):
+    """GCSの再開可能なアップロードセッションを開始する。
+    クライアントはセッションURLにContent-Range付きのPUTでチャンクごとにアップロードでき、
+    通信が途切れた場合は送信済みのバイト数を問い合わせて続きから再開できる。
+
+    Args:
+        blob (google.cloud.storage.Blob): アップロード先のオブジェクト。
+        content_type (str): メディアタイプ。
+        origin (str): ブラウザからアップロードする場合のOrigin（CORS用）。
+
+    Returns:
+        str: アップロードセッションのURL（1週間有効）。
+    """
+    return blob.create_resumable_upload_session(content_type=content_type, origin=origin)
+
+def create_signed_url(title, file_extension, upload_mode='signed_url', origin=None, processing_mode='interactive'):
+    """アップロード用の署名付きURL（または再開可能なアップロードセッションのURL）を1つ生成する。
+
+    Args:
+        title (str): メモのタイトル。ファイル名に含める。
+        file_extension (str): ファイルの拡張子。メディアタイプの判定にも使用する。
+        upload_mode (str): アップロード方式（signed_url または resumable）。
+        origin (str): リクエスト元のOrigin。
+        processing_mode (str): 処理方式（interactive または batch）。
+
+    Returns:
+        dict: アップロード先のURL・ファイル名・メディアタイプ。
+            batchの署名付きURLの場合は、PUTで送信する必要のあるヘッダー（headers）も含む。
+    """
+    # ファイル名を生成（タイトルとUUIDを含む）
+    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    file_id = str(uuid.uuid4())[:8]
+    filename = f"{timestamp}_{file_id}_{title}.{file_extension}"
+
+    content_type = get_content_type(file_extension)
+    bucket = get_storage_client().bucket(BUCKET_NAME)
+    blob = bucket.blob(filename)
+    metadata = {PROCESSING_MODE_METADATA_KEY: processing_mode} if processing_mode == 'batch' else {}
+
+    # 長いメモや不安定な回線向けに、分割・再開可能なアップロードセッションを開始
+    if upload_mode == 'resumable':
+        # セッション開始時に指定したメタデータはアップロード完了時のオブジェクトに設定される
+        blob.metadata = metadata or None
+        return {
+            'upload_mode': upload_mode,
+            'processing_mode': processing_mode,
+            'session_url': create_resumable_upload_session(blob, content_type, origin),
+            'filename': filename,
+            'content_type': content_type
+        }
+
+    credentials = get_credentials()
+    # メタデータは署名に含めるヘッダーとして指定し、クライアントはPUTで同じヘッダーを送信する
+    required_headers = {f"x-goog-meta-{key}": value for key, value in metadata.items()}
+
+    # 署名付きURLを生成（15分間有効）
+    url = blob.generate_signed_url(
+        version="v4",
+        expiration=datetime.timedelta(minutes=15),
+        method="PUT",
+        content_type=content_type,  # 拡張子から判定したメディアタイプを設定する
+        headers=required_headers or None,
+        service_account_email=credentials.service_account_email,
+        access_token=credentials.token,
+    )
+
+    response = {
+        'upload_mode': upload_mode,
+        'processing_mode': processing_mode,
+        'signed_url': url,
+        'filename': filename,
+        'content_type': content_type
+    }
+    if required_headers:
+        response['headers'] = required_headers
+    return response
 
 @functions_framework.http
 def generate_signed_url(request):
     """GCSの署名付きURLをHTTPリクエストから生成する。
     リクエストから'title'パラメータを取得し、ファイル名に含める。
+    'memos'パラメータ（titleとfile_extensionを持つオブジェクトの配列）を指定した場合は、
+    キューに溜まったメモ用に複数の署名付きURLをまとめて生成する。
+    'upload_mode'に'resumable'を指定した場合は、署名付きURLの代わりに再開可能なアップロードセッションを開始する。
+    'processing_mode'に'batch'を指定した場合は、急がないメモとしてGeminiのバッチAPIでまとめて処理する
+    （'memos'の各要素でも指定でき、要素の指定が優先される）。
 
     Args:
         request (flask.Request): HTTPリクエストオブジェクト。
@@ -31,13 +198,35 @@ def generate_signed_url(request):
             'Access-Control-Max-Age': '3600'
         }
         return ('', 204, headers)
-    
+
     headers = {
         'Access-Control-Allow-Origin': '*'
     }
 
     try:
         request_data = request.get_json()
+        upload_mode = (request_data or {}).get('upload_mode', 'signed_url')
+        if upload_mode not in UPLOAD_MODES:
+            return jsonify({'error': f'upload_modeは{", ".join(UPLOAD_MODES)}のいずれかを指定してください'}), 400, headers
+        processing_mode = (request_data or {}).get('processing_mode', 'interactive')
+        memo_modes = [memo.get('processing_mode', processing_mode) for memo in (request_data or {}).get('memos') or []]
+        if any(mode not in PROCESSING_MODES for mode in [processing_mode] + memo_modes):
+            return jsonify({'error': f'processing_modeは{", ".join(PROCESSING_MODES)}のいずれかを指定してください'}), 400, headers
+        origin = request.headers.get('Origin')
+
+        # 複数のメモの署名付きURLをまとめて生成
+        if request_data and 'memos' in request_data:
+            memos = request_data['memos']
+            if not memos or any('title' not in memo for memo in memos):
+                return jsonify({'error': 'タイトルが指定されていないメモがあります'}), 400, headers
+            if len(memos) > MAX_BATCH_SIZE:
+                return jsonify({'error': f'一度に生成できる署名付きURLは{MAX_BATCH_SIZE}件までです'}), 400, headers
+
+            urls = [
+                create_signed_url(memo['title'], memo.get('file_extension', 'aiff'), upload_mode, origin, memo.get('processing_mode', processing_mode))
+                for memo in memos
+            ]
+            return jsonify({'urls': urls}), 200, headers
 
         if not request_data or 'title' not in request_data:
             return jsonify({'error': 'タイトルが指定されていません'}), 400, headers
@@ -45,34 +234,9 @@ def generate_signed_url(request):
         title = request_data['title']
         file_extension = request_data.get('file_extension', 'aiff')  # デフォルトはaiffとする
 
-        # ファイル名を生成（タイトルとUUIDを含む）
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        file_id = str(uuid.uuid4())[:8]
-        filename = f"{timestamp}_{file_id}_{title}.{file_extension}"
-
-        # Cloud Storageクライアントを初期化
-        credentials, _ = google.auth.default()
-        credentials.refresh(google.auth.transport.requests.Request())
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob(filename)
-
-        # 署名付きURLを生成（15分間有効）
-        url = blob.generate_signed_url(
-            version="v4",
-            expiration=datetime.timedelta(minutes=15),
-            method="PUT",
-            content_type="audio/aiff",  # メディアタイプを設定する
-            service_account_email=credentials.service_account_email,
-            access_token=credentials.token,
-        )
-
-        response = {
-            'signed_url': url,
-            'filename': filename
-        }
+        response = create_signed_url(title, file_extension, upload_mode, origin, processing_mode)
 
         return jsonify(response), 200, headers
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500, headers
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500, headers